@@ -0,0 +1,176 @@
+# artifact_store.py
+"""
+Content hashing and object storage for build_train_deploy.py.
+
+Every input of a training run is reduced to a sha256: the feature store files
+(sha256_tree), the code shipped to the training job (sha256_files) and the
+job parameters (sha256_json). Objects are written under keys derived from
+those hashes, so an existing key means identical content and the upload, the
+training job or the deployment can be skipped.
+
+Two interchangeable stores (same methods, keys are "/"-separated):
+  - S3Store: s3://bucket/<key>; large files go up as parallel multipart uploads
+  - LocalStore: a directory, for running and testing the pipeline offline
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+HASH_CHUNK_BYTES = 1024 * 1024
+MULTIPART_CHUNK_MB = 16     # S3 parts; files above one part are uploaded in parallel parts
+UPLOAD_WORKERS = 8          # files (and parts of one file) in flight at once
+
+
+# ----------------------------
+# Content hashes
+# ----------------------------
+def sha256_file(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sha256_files(paths, root=".") -> str:
+    """One hash over the names (relative to root) and contents of paths."""
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(os.path.relpath(path, root).encode("utf-8") + b"\0")
+        digest.update(sha256_file(path).encode("ascii"))
+    return digest.hexdigest()
+
+
+def sha256_tree(directory, exclude=()) -> str:
+    names = [n for n in os.listdir(directory) if n not in exclude]
+    return sha256_files([os.path.join(directory, n) for n in names], directory)
+
+
+def sha256_json(obj) -> str:
+    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# ----------------------------
+# Stores
+# ----------------------------
+class LocalStore:
+    """Objects as files under root; writes go through a temp file and a rename."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def uri(self, key) -> str:
+        return self.path(key)
+
+    def exists(self, key) -> bool:
+        return os.path.exists(self.path(key))
+
+    def put_file(self, path, key):
+        target = self.path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".upload-")
+        os.close(fd)
+        try:
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, target)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def get_file(self, key, path):
+        shutil.copyfile(self.path(key), path)
+
+    def put_json(self, key, obj):
+        target = self.path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target + ".tmp", "w") as f:
+            json.dump(obj, f, indent=2)
+        os.replace(target + ".tmp", target)
+
+    def get_json(self, key):
+        """The object as JSON, or None if it does not exist."""
+        if not self.exists(key):
+            return None
+        with open(self.path(key)) as f:
+            return json.load(f)
+
+    def __repr__(self):
+        return f"LocalStore({self.root!r})"
+
+
+class S3Store:
+    """Objects in an S3 bucket; the client is created once, lazily."""
+
+    def __init__(self, bucket, region=None, endpoint_url=None,
+                 multipart_chunk_mb=MULTIPART_CHUNK_MB, workers=UPLOAD_WORKERS):
+        self.bucket = bucket
+        self.region = region
+        self.endpoint_url = endpoint_url
+        self.multipart_chunk_mb = multipart_chunk_mb
+        self.workers = workers
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client("s3", region_name=self.region, endpoint_url=self.endpoint_url)
+        return self._client
+
+    def uri(self, key) -> str:
+        return f"s3://{self.bucket}/{key}"
+
+    def exists(self, key) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put_file(self, path, key):
+        from boto3.s3.transfer import TransferConfig
+        chunk = self.multipart_chunk_mb * 1024 * 1024
+        config = TransferConfig(multipart_threshold=chunk, multipart_chunksize=chunk,
+                                max_concurrency=self.workers, use_threads=True)
+        self.client.upload_file(path, self.bucket, key, Config=config)
+
+    def get_file(self, key, path):
+        self.client.download_file(self.bucket, key, path)
+
+    def put_json(self, key, obj):
+        body = json.dumps(obj, indent=2).encode("utf-8")
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=body, ContentType="application/json")
+
+    def get_json(self, key):
+        """The object as JSON, or None if it does not exist."""
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return json.loads(body)
+
+    def __repr__(self):
+        return f"S3Store('s3://{self.bucket}')"
+
+
+def put_tree(store, directory, prefix, workers=UPLOAD_WORKERS, dry_run=False) -> dict:
+    """
+    Upload every file of directory to <prefix>/<name>, skipping keys that
+    already exist, several files at a time. Returns {"uploaded": [...], "skipped": [...]}.
+    """
+    names = sorted(n for n in os.listdir(directory) if os.path.isfile(os.path.join(directory, n)))
+    with ThreadPoolExecutor(workers) as pool:
+        present = dict(zip(names, pool.map(lambda n: store.exists(f"{prefix}/{n}"), names)))
+        missing = [n for n in names if not present[n]]
+        if not dry_run:
+            list(pool.map(lambda n: store.put_file(os.path.join(directory, n), f"{prefix}/{n}"), missing))
+    return {"uploaded": missing, "skipped": [n for n in names if present[n]]}
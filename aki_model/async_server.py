@@ -0,0 +1,217 @@
+# async_server.py
+"""
+Asyncio HTTP/1.1 front end for inference.py (serve.py --asyncio).
+
+Connections cost a coroutine, not a thread, so mobile clients that keep a
+connection open on a flaky network never hold a worker. HTTP parsing runs on
+the event loop; input_fn (JSON decoding, preprocessing), predict_fn and
+output_fn (response encoding) run together on a small thread pool, so a large
+body never stalls the other connections.
+
+Keep-alive and HTTP/1.1 pipelining are supported: requests on a connection
+are dispatched as soon as they are read and answered in order.
+
+Load is shed instead of queued without bound:
+  - 503 (Retry-After: 1) when max_in_flight invocations are already admitted,
+    or when an invocation waited longer than max_queue_wait_ms for the pool
+  - 429 when more than max_pipeline requests are queued on one connection
+    behind the response being written
+Idle connections are closed after idle_timeout seconds, and a write that
+cannot drain within it drops the client.
+"""
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import inference
+
+DEFAULT_CONTENT_TYPE = "application/json"
+MAX_BODY_BYTES = 6 * 1024 * 1024   # the SageMaker real-time payload limit
+_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+    429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+class _HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class _Shed(Exception):
+    pass
+
+
+class _Request:
+    __slots__ = ("method", "path", "headers", "body", "keep_alive")
+
+    def __init__(self, method, path, headers, body, keep_alive):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+        self.keep_alive = keep_alive
+
+
+class AsyncInferenceServer:
+    def __init__(self, model, executor_threads=2, max_in_flight=64, max_pipeline=8,
+                 max_queue_wait_ms=1000.0, idle_timeout=75.0, workers=1):
+        self.model = model
+        self.executor = ThreadPoolExecutor(executor_threads, thread_name_prefix="invoke")
+        self.max_in_flight = max_in_flight
+        self.max_pipeline = max_pipeline
+        self.max_queue_wait = max_queue_wait_ms / 1000.0
+        self.idle_timeout = idle_timeout
+        self.workers = workers
+        self.in_flight = 0
+        self.connections = 0
+        inference.METRICS.add_collector("async_server", self.stats)
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "connections": self.connections}
+
+    # ----------------------------
+    # connection handling
+    # ----------------------------
+    async def handle_connection(self, reader, writer):
+        self.connections += 1
+        pending = asyncio.Queue()   # (response task, keep_alive) in request order
+        responder = asyncio.create_task(self._write_responses(pending, writer))
+        try:
+            while not responder.done():
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.idle_timeout)
+                except _HTTPError as e:
+                    await pending.put((self._done(_error(e.status, str(e))), False))
+                    break
+                if request is None:
+                    break
+                if pending.qsize() >= self.max_pipeline:
+                    inference.METRICS.inc("requests_shed_pipeline")
+                    response = self._done(_error(429, "Too many pipelined requests"))
+                else:
+                    response = asyncio.create_task(self._dispatch(request))
+                await pending.put((response, request.keep_alive))
+                if not request.keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            await pending.put(None)
+            await responder
+            writer.close()
+            self.connections -= 1
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        try:
+            method, path, version = line.decode("latin-1").split()
+        except ValueError:
+            raise _HTTPError(400, "Malformed request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise _HTTPError(400, "Bad Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise _HTTPError(413, f"Body larger than {MAX_BODY_BYTES} bytes")
+        body = await reader.readexactly(length) if length else b""
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        return _Request(method, path, headers, body, keep_alive)
+
+    async def _write_responses(self, pending, writer):
+        while True:
+            item = await pending.get()
+            if item is None:
+                return
+            response, keep_alive = item
+            status, body, content_type, extra = await response
+            head = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}",
+                    f"Content-Type: {content_type}",
+                    f"Content-Length: {len(body)}"]
+            head += [f"{k}: {v}" for k, v in extra.items()]
+            if not keep_alive:
+                head.append("Connection: close")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+            try:
+                await asyncio.wait_for(writer.drain(), self.idle_timeout)
+            except (asyncio.TimeoutError, ConnectionError):
+                return
+            if not keep_alive:
+                return
+
+    @staticmethod
+    def _done(response):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(response)
+        return future
+
+    # ----------------------------
+    # request handling
+    # ----------------------------
+    async def _dispatch(self, request):
+        if request.method == "GET" and request.path == "/ping":
+            return 200, b"", "text/plain", {}
+        if request.method == "GET" and request.path == "/execution-parameters":
+            body = json.dumps({"MaxConcurrentTransforms": self.workers,
+                               "BatchStrategy": "MULTI_RECORD", "MaxPayloadInMB": 6})
+            return 200, body.encode("utf-8"), "application/json", {}
+        if request.method != "POST" or request.path != "/invocations":
+            return _error(404, "Not found")
+
+        if self.in_flight >= self.max_in_flight:
+            inference.METRICS.inc("requests_shed_overload")
+            return _error(503, "Overloaded", {"Retry-After": "1"})
+        self.in_flight += 1
+        try:
+            content_type = request.headers.get("content-type", DEFAULT_CONTENT_TYPE).split(";")[0].strip()
+            accept = request.headers.get("accept", "").split(",")[0].split(";")[0].strip()
+            if accept in ("", "*/*"):
+                accept = DEFAULT_CONTENT_TYPE
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._invoke, request.body, content_type, accept, time.perf_counter()
+            )
+        except _Shed:
+            inference.METRICS.inc("requests_shed_queue_wait")
+            return _error(503, "Queued too long", {"Retry-After": "1"})
+        except ValueError as e:
+            return _error(400, str(e))
+        except Exception as e:
+            inference.logger.exception("Invocation failed")
+            return _error(500, str(e))
+        finally:
+            self.in_flight -= 1
+        if isinstance(result, str):
+            result = result.encode("utf-8")
+        return 200, result, accept, {}
+
+    def _invoke(self, body, content_type, accept, enqueued):
+        # runs on the pool; work that already waited too long is dropped unparsed
+        if time.perf_counter() - enqueued > self.max_queue_wait:
+            raise _Shed()
+        data = inference.input_fn(body, content_type)
+        return inference.output_fn(inference.predict_fn(data, self.model), accept)
+
+
+def _error(status, message, headers=None):
+    return status, message.encode("utf-8"), "text/plain", headers or {}
+
+
+async def serve_socket(listener, model, stop_event, **options):
+    """Serve on an already-listening socket until stop_event is set."""
+    app = AsyncInferenceServer(model, **options)
+    server = await asyncio.start_server(app.handle_connection, sock=listener)
+    async with server:
+        await stop_event.wait()
+    app.executor.shutdown(wait=True)
@@ -0,0 +1,94 @@
+# batch_score.py
+"""
+Multiprocess batch scoring for offline re-scoring of large CSV cohorts.
+
+The main process reads the input CSV in chunks and fans them out to a process
+pool; every worker loads the models once (inference.model_fn) at startup and
+scores the chunks it receives. Results are written back in input order, with at
+most `processes * 2` chunks in flight, so memory stays bounded.
+
+    python batch_score.py <input_csv> <output_csv> --processes 8 --chunk-size 20000
+
+Each worker's XGBoost thread count is pinned (--nthread, default
+cpu_count // processes) so processes x threads never oversubscribes the box.
+"""
+import argparse
+import collections
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+_MODEL = None
+
+
+def _init_worker(model_dir, nthread):
+    global _MODEL
+    # must be set before the OpenMP runtime starts in this process
+    os.environ["OMP_NUM_THREADS"] = str(nthread)
+    import inference
+    _MODEL = inference.model_fn(model_dir)
+    for booster in _MODEL.models.values():
+        inference.get_booster(booster).set_param({"nthread": nthread})
+
+
+def _score_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    import inference
+    df = inference.preprocess_frame(chunk)
+    return inference.predict_fn(df, _MODEL)
+
+
+def score_csv_parallel(input_path, output_path, model_dir, processes=None,
+                       chunk_size=20000, nthread=None):
+    """
+    Score input_path into output_path with a pool of `processes` workers.
+    Output rows keep the input order. Returns (rows_read, rows_written, seconds).
+    """
+    processes = processes or os.cpu_count() or 1
+    nthread = nthread or max(1, (os.cpu_count() or 1) // processes)
+    start = time.perf_counter()
+    rows_read = rows_written = 0
+    in_flight = collections.deque()
+
+    def write_next(out):
+        nonlocal rows_written
+        preds_df = in_flight.popleft().result()
+        preds_df.to_csv(out, header=(out.tell() == 0), index=False)
+        rows_written += len(preds_df)
+
+    with ProcessPoolExecutor(max_workers=processes, mp_context=mp.get_context("spawn"),
+                             initializer=_init_worker, initargs=(model_dir, nthread)) as pool, \
+            open(output_path, "w", newline="") as out:
+        for chunk in pd.read_csv(input_path, chunksize=chunk_size):
+            rows_read += len(chunk)
+            in_flight.append(pool.submit(_score_chunk, chunk))
+            if len(in_flight) >= processes * 2:
+                write_next(out)
+        while in_flight:
+            write_next(out)
+    return rows_read, rows_written, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_csv", help="CSV of patients to score")
+    parser.add_argument("output_csv", help="Where to write the predictions")
+    parser.add_argument("--model-dir", default=os.environ.get("SM_MODEL_DIR", "/opt/ml/model"),
+                        help="Directory holding the model artifacts (default: $SM_MODEL_DIR)")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Worker processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=20000,
+                        help="Rows per chunk sent to a worker (default: 20000)")
+    parser.add_argument("--nthread", type=int, default=None,
+                        help="XGBoost threads per worker (default: cores // processes)")
+    args = parser.parse_args()
+
+    rows_read, rows_written, seconds = score_csv_parallel(
+        args.input_csv, args.output_csv, args.model_dir,
+        processes=args.processes, chunk_size=args.chunk_size, nthread=args.nthread
+    )
+    print(f"Scored {rows_read} rows ({rows_written} written) in {seconds:.2f}s "
+          f"({rows_read / max(seconds, 1e-9):,.0f} rows/s)")
+    print("Wrote predictions to", args.output_csv)
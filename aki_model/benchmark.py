@@ -0,0 +1,200 @@
+# benchmark.py
+"""
+Latency / throughput benchmark for the inference.py request pipeline.
+
+Synthetic patients are drawn column-by-column from data_clean_name.csv (so
+value ranges and missing-value rates match the training data). For each
+request format and batch size, every stage is timed separately:
+
+    deserialize -> preprocess -> predict -> serialize, plus end_to_end
+    (input_fn -> predict_fn -> output_fn)
+
+and p50/p95/p99 latency (ms) and rows/s are written as JSON:
+
+    python benchmark.py --model-dir model --output bench_results.json
+    python benchmark.py --compare bench_results.json   # exit 1 on a >20% p50 regression
+
+The prediction cache is disabled so repeated bodies measure the real work.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+os.environ.setdefault("PREDICTION_CACHE_MB", "0")
+
+import numpy as np
+import pandas as pd
+
+import inference as inf
+
+DEFAULT_BATCH_SIZES = [1, 10, 100, 1000, 10000, 100000]
+DEFAULT_FORMATS = ["json", "csv"]
+CONTENT_TYPES = {"json": "application/json", "csv": "text/csv"}
+
+
+def synthetic_patients(n, reference_csv="data_clean_name.csv", columns=None, seed=42) -> pd.DataFrame:
+    """
+    n synthetic rows shaped like reference_csv: every column (default: all) is
+    resampled independently from its observed values, keeping its NaN rate.
+    """
+    ref = pd.read_csv(reference_csv)
+    if columns is not None:
+        ref = ref[columns]
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        col: ref[col].to_numpy()[rng.integers(0, len(ref), size=n)] for col in ref.columns
+    })
+
+
+def encode(df: pd.DataFrame, fmt) -> str:
+    if fmt == "json":
+        return df.to_json(orient="records")
+    return df.to_csv(index=False)
+
+
+def _deserialize(body, fmt):
+    # mirrors input_fn up to (not including) preprocessing
+    if fmt == "json":
+        payload = json.loads(body)
+        if inf.is_fast_path_payload(payload):
+            return inf.records_to_matrix(payload)
+        return pd.DataFrame(payload)
+    return pd.read_csv(io.StringIO(body))
+
+
+def _preprocess(data):
+    if isinstance(data, np.ndarray):
+        return inf.preprocess_matrix(data)
+    return inf.preprocess_frame(data)
+
+
+def time_calls(fn, min_seconds, max_iters):
+    """Call fn repeatedly (at least 3 times, about min_seconds in total); return per-call seconds."""
+    times = []
+    start = time.perf_counter()
+    while len(times) < 3 or (len(times) < max_iters and time.perf_counter() - start < min_seconds):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return np.array(times)
+
+
+def summarize(times, rows) -> dict:
+    p50, p95, p99 = np.percentile(times, [50, 95, 99]) * 1000.0
+    return {
+        "iterations": len(times),
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+        "rows_per_s": rows / (p50 / 1000.0) if p50 > 0 else float("inf"),
+    }
+
+
+def bench_case(model, df, fmt, min_seconds, max_iters) -> dict:
+    body = encode(df, fmt)
+    content_type = CONTENT_TYPES[fmt]
+    raw = _deserialize(body, fmt)
+    prepared = _preprocess(raw)
+    preds = inf.predict_fn(prepared, model)
+    stages = {
+        "deserialize": lambda: _deserialize(body, fmt),
+        "preprocess": lambda: _preprocess(raw.copy()),
+        "predict": lambda: inf.predict_fn(prepared, model),
+        "serialize": lambda: inf.output_fn(preds, content_type),
+        "end_to_end": lambda: inf.output_fn(
+            inf.predict_fn(inf.input_fn(body, content_type), model), content_type
+        ),
+    }
+    return {
+        name: summarize(time_calls(fn, min_seconds, max_iters), len(df))
+        for name, fn in stages.items()
+    }
+
+
+def run(model_dir, batch_sizes, formats, min_seconds, max_iters, reference_csv,
+        all_columns=False) -> dict:
+    model = inf.model_fn(model_dir)
+    patients = synthetic_patients(max(batch_sizes), reference_csv,
+                                  columns=None if all_columns else inf.FEATURE_COLS)
+    results = []
+    for fmt in formats:
+        for n in batch_sizes:
+            stages = bench_case(model, patients.iloc[:n], fmt, min_seconds, max_iters)
+            results.append({"format": fmt, "batch_size": n, "stages": stages})
+            e2e = stages["end_to_end"]
+            print(f"{fmt:>4} batch={n:<7} e2e p50={e2e['p50_ms']:.3f}ms "
+                  f"p99={e2e['p99_ms']:.3f}ms {e2e['rows_per_s']:,.0f} rows/s")
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "xgboost": inf.xgb.__version__,
+            "model_dir": model_dir,
+            "model_version": getattr(model, "version", None),
+            "all_columns": all_columns,
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, tolerance) -> list:
+    """Return (format, batch_size, stage, baseline_p50, current_p50) for every p50 regression."""
+    base = {(r["format"], r["batch_size"]): r["stages"] for r in baseline["results"]}
+    regressions = []
+    for r in current["results"]:
+        old = base.get((r["format"], r["batch_size"]))
+        if old is None:
+            continue
+        for stage, stats in r["stages"].items():
+            if stage in old and stats["p50_ms"] > old[stage]["p50_ms"] * (1 + tolerance):
+                regressions.append((r["format"], r["batch_size"], stage,
+                                    old[stage]["p50_ms"], stats["p50_ms"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", default=os.environ.get("SM_MODEL_DIR", "model"),
+                        help="Directory holding the model artifacts (default: model)")
+    parser.add_argument("--reference-csv", default="data_clean_name.csv",
+                        help="CSV the synthetic patients are shaped after")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=DEFAULT_BATCH_SIZES)
+    parser.add_argument("--formats", nargs="+", choices=DEFAULT_FORMATS, default=DEFAULT_FORMATS)
+    parser.add_argument("--all-columns", action="store_true",
+                        help="Send every CSV column, not just the 12 model features (the mobile request shape)")
+    parser.add_argument("--min-seconds", type=float, default=1.0,
+                        help="Approximate time spent per stage and case")
+    parser.add_argument("--max-iters", type=int, default=2000)
+    parser.add_argument("--output", default="bench_results.json",
+                        help="Where to write the machine-readable results")
+    parser.add_argument("--compare", default=None,
+                        help="Baseline results JSON; exit 1 if any p50 regressed")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative p50 slowdown against --compare (default: 0.2)")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    inf.logger.setLevel("WARNING")
+    current = run(args.model_dir, args.batch_sizes, args.formats,
+                  args.min_seconds, args.max_iters, args.reference_csv, args.all_columns)
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=2)
+    print("Wrote results to", args.output)
+
+    if baseline is not None:
+        regressions = compare(current, baseline, args.tolerance)
+        for fmt, n, stage, old, new in regressions:
+            print(f"REGRESSION {fmt} batch={n} {stage}: p50 {old:.3f}ms -> {new:.3f}ms")
+        sys.exit(1 if regressions else 0)
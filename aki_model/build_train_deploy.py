@@ -1,23 +1,330 @@
 # build_train_deploy.py
+"""
+Build the feature store, train on SageMaker and deploy an endpoint -- running
+only the steps whose inputs changed since a previous run.
+
+Each step is keyed by content hashes (artifact_store.py):
+  - data:   the feature store files      -> <prefix>/feature_store/<data hash>/
+  - train:  data + TRAINING_SOURCES + job parameters
+            -> <prefix>/cache/train/<train hash>.json (the model.tar.gz it produced)
+  - deploy: the trained model + SERVING_SOURCES + endpoint instance type
+            -> <prefix>/cache/deploy/<deploy hash>.json (the endpoint config serving it)
+Files already uploaded are skipped, a cached model is reused instead of
+starting a training job, and an endpoint still serving the cached config is
+kept. --force ignores the training and deployment records.
+
+There is one endpoint, --endpoint-name, which the app calls (SAGEMAKER_ENDPOINT
+in its .env). A new deployment creates a hash-named model and EndpointConfig and
+updates that endpoint to it in place (SageMaker switches traffic once the new
+instances are up), so the name never changes.
+
+--local-dir runs the same pipeline offline: the directory replaces the S3
+bucket, train.py runs in a subprocess instead of a training job, and the
+"deployment" unpacks the model for serve.py. --dry-run reports what would be
+uploaded, trained and deployed without doing it:
+
+    python build_train_deploy.py --local-dir /tmp/pipeline --s3-prefix aki-risk --dry-run
+"""
 import os
 import argparse
-import boto3
-import sagemaker
-from sagemaker.sklearn.estimator import SKLearn
-from sagemaker.sklearn.model import SKLearnModel
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+from artifact_store import (
+    MULTIPART_CHUNK_MB, UPLOAD_WORKERS, LocalStore, S3Store,
+    put_tree, sha256_files, sha256_json, sha256_tree,
+)
+from feature_store import SCHEMA_FILENAME, open_store
+
+# The files that decide what a training job / an endpoint does (whatever else
+# is in source_dir does not invalidate the cache).
+TRAINING_SOURCES = (
+    "train.py", "feature_store.py", "preprocessing.py", "hparam_search.py",
+    "decision_threshold.py", "drift_monitor.py", "requirements.txt",
+)
+SERVING_SOURCES = (
+    "inference.py", "compiled_trees.py", "decision_threshold.py", "drift_monitor.py",
+    "log_pipeline.py", "metrics.py", "microbatch.py", "prediction_cache.py",
+    "preprocessing.py", "requirements.txt",
+)
+FRAMEWORK_VERSION = "0.23-1"
+# The root model is train.py's --target (aki); every extra target is trained into
+# model.tar.gz's <target>/ directory, which inference.py serves under that name.
+SERVED_TARGETS = ("aki", "dialysis")
+HYPERPARAMETERS = {"input-path": "/opt/ml/input/data/training",
+                   "target": SERVED_TARGETS[0], "extra-targets": ",".join(SERVED_TARGETS[1:])}
+KEY_CHARS = 16      # hash prefix used in keys and endpoint names
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# ----------------------------
+# Data
+# ----------------------------
+def data_hash(store) -> str:
+    """Hash of what train.py reads: the column files and their schema (not the CSV's mtime)."""
+    return sha256_json({
+        "files": sha256_tree(store.store_dir, exclude=(SCHEMA_FILENAME,)),
+        "columns": store.meta["columns"],
+        "version": store.meta["version"],
+    })
+
+
+def upload_data(backend, store, prefix, workers, dry_run) -> tuple:
+    """Upload the store under its content hash; returns (data hash, key prefix)."""
+    digest = data_hash(store)
+    data_prefix = f"{prefix}/feature_store/{digest[:KEY_CHARS]}"
+    result = put_tree(backend, store.store_dir, data_prefix, workers=workers, dry_run=dry_run)
+    verb = "would upload" if dry_run else "uploaded"
+    print(f"Data {digest[:KEY_CHARS]} ({len(store)} rows): {verb} {len(result['uploaded'])} files, "
+          f"{len(result['skipped'])} already in {backend.uri(data_prefix)}")
+    return digest, data_prefix
+
+
+# ----------------------------
+# Training
+# ----------------------------
+def train_sagemaker(args, data_uri) -> str:
+    import boto3
+    import sagemaker
+    from sagemaker.sklearn.estimator import SKLearn
+
+    boto_session      = boto3.Session(region_name=args.region)
+    sagemaker_session = sagemaker.Session(boto_session=boto_session)
+
+    estimator = SKLearn(
+        entry_point       = "train.py",
+        source_dir        = SOURCE_DIR,
+        role              = args.role_arn,
+        instance_type     = args.instance,
+        framework_version = FRAMEWORK_VERSION,
+        py_version        = "py3",
+        dependencies      = ["requirements.txt"],
+        hyperparameters   = HYPERPARAMETERS,
+        sagemaker_session = sagemaker_session,
+        output_path       = f"s3://{args.s3_bucket}/{args.s3_prefix}/model-artifacts/"
+    )
+
+    print("▶ Starting SageMaker training job...")
+    estimator.fit({"training": data_uri}, wait=True)
+    print("✅ Training job complete.")
+    # estimator.model_data points to the trained model.tar.gz in S3
+    return estimator.model_data
+
+
+def train_local(backend, data_prefix, model_key) -> str:
+    """Run train.py on the stored feature store and store its model.tar.gz at model_key."""
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = os.path.join(tmp, "model")
+        hyperparameters = {
+            **HYPERPARAMETERS,
+            "input-path": backend.path(data_prefix),
+            "model-dir": model_dir,
+            "output-data-dir": os.path.join(tmp, "output"),
+            "cache-dir": os.path.join(tmp, "search_cache"),
+        }
+        command = [sys.executable, "train.py"]
+        for name, value in hyperparameters.items():
+            command += [f"--{name}", str(value)]
+        print("▶ Running train.py locally...")
+        subprocess.run(command, cwd=SOURCE_DIR, check=True)
+        check_model_dir(model_dir)
+        # packed like a SageMaker model.tar.gz: the model dir's files at the root
+        archive = os.path.join(tmp, "model.tar.gz")
+        with tarfile.open(archive, "w:gz") as tar:
+            for name in sorted(os.listdir(model_dir)):
+                tar.add(os.path.join(model_dir, name), arcname=name)
+        backend.put_file(archive, model_key)
+    print("✅ Local training complete.")
+    return backend.uri(model_key)
+
+
+# loads a model directory the way the endpoint does and scores one request naming every target
+_CHECK_SCRIPT = """
+import json, sys
+import inference
+model = inference.model_fn(sys.argv[1])
+body = json.dumps({"targets": sys.argv[2:], "instances": [inference.PREPROCESSOR.example_record()]})
+print(inference.output_fn(inference.predict_fn(inference.input_fn(body, "application/json"), model),
+                          "application/json"))
+"""
+
+
+def check_model_dir(model_dir, targets=SERVED_TARGETS):
+    """Fail (CalledProcessError) unless inference.py serves every target from model_dir."""
+    result = subprocess.run([sys.executable, "-c", _CHECK_SCRIPT, model_dir, *targets], cwd=SOURCE_DIR,
+                            check=True, capture_output=True, text=True)
+    print(f"✅ {model_dir} serves {', '.join(targets)}: {result.stdout.strip()}")
+
+
+def train_or_reuse(args, backend, data_digest, data_prefix) -> tuple:
+    """Returns (train hash, cache record or None on a dry run that would train)."""
+    params = {
+        "hyperparameters": HYPERPARAMETERS,
+        "instance": "local" if args.local_dir else args.instance,
+        "framework": FRAMEWORK_VERSION,
+    }
+    code = sha256_files([os.path.join(SOURCE_DIR, f) for f in TRAINING_SOURCES], SOURCE_DIR)
+    digest = sha256_json({"data": data_digest, "code": code, "params": params})
+    record_key = f"{args.s3_prefix}/cache/train/{digest[:KEY_CHARS]}.json"
+    record = None if args.force else backend.get_json(record_key)
+    if record is not None:
+        print(f"Training {digest[:KEY_CHARS]}: inputs unchanged, reusing {record['model_data']}")
+        return digest, record
+    if args.dry_run:
+        print(f"Training {digest[:KEY_CHARS]}: would train on {backend.uri(data_prefix)}")
+        return digest, None
+
+    started = time.perf_counter()
+    if args.local_dir:
+        model_key = f"{args.s3_prefix}/model-artifacts/{digest[:KEY_CHARS]}/model.tar.gz"
+        record = {"model_data": train_local(backend, data_prefix, model_key), "model_key": model_key}
+    else:
+        record = {"model_data": train_sagemaker(args, backend.uri(data_prefix))}
+    record.update(
+        data=data_digest, code=code, params=params,
+        timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        seconds=round(time.perf_counter() - started, 1),
+    )
+    backend.put_json(record_key, record)
+    return digest, record
+
+
+# ----------------------------
+# Deployment
+# ----------------------------
+def endpoint_config(args, name):
+    """The EndpointConfig endpoint `name` is serving (or moving to), or None if it is not up."""
+    import boto3
+    from botocore.exceptions import ClientError
+    try:
+        status = boto3.client("sagemaker", region_name=args.region).describe_endpoint(EndpointName=name)
+    except ClientError:
+        return None
+    if status["EndpointStatus"] not in ("InService", "Creating", "Updating"):
+        return None
+    return status["EndpointConfigName"]
+
+
+def deploy_sagemaker(args, model_data, config_name) -> str:
+    """
+    Register model_data with the serving code as model + EndpointConfig
+    `config_name`, then create --endpoint-name on it or update that endpoint
+    in place. Returns the endpoint name.
+    """
+    import boto3
+    import sagemaker
+    from sagemaker.sklearn.model import SKLearnModel
+
+    boto_session = boto3.Session(region_name=args.region)
+    sagemaker_session = sagemaker.Session(boto_session=boto_session)
+    sklearn_serving_model = SKLearnModel(
+        model_data=model_data,              # "<s3://…/model-artifacts/…/model.tar.gz>"
+        role=args.role_arn,
+        entry_point="inference.py",         # <-- tell SageMaker to use inference.py at serve‐time
+        source_dir=SOURCE_DIR,              # directory where inference.py lives
+        framework_version=FRAMEWORK_VERSION,
+        py_version="py3",
+        sagemaker_session=sagemaker_session,
+        name=config_name,
+    )
+    sklearn_serving_model.create(instance_type=args.endpoint_instance)
+
+    client = boto_session.client("sagemaker")
+    client.create_endpoint_config(
+        EndpointConfigName=config_name,
+        ProductionVariants=[{
+            "VariantName": "AllTraffic",
+            "ModelName": config_name,
+            "InitialInstanceCount": 1,
+            "InstanceType": args.endpoint_instance,
+        }],
+    )
+    endpoint_name = args.endpoint_name
+    if endpoint_config(args, endpoint_name) is None:
+        print(f"▶ Creating endpoint {endpoint_name} on {config_name} (1 {args.endpoint_instance} instance)…")
+        client.create_endpoint(EndpointName=endpoint_name, EndpointConfigName=config_name)
+    else:
+        print(f"▶ Updating endpoint {endpoint_name} to {config_name} (1 {args.endpoint_instance} instance)…")
+        client.update_endpoint(EndpointName=endpoint_name, EndpointConfigName=config_name)
+    client.get_waiter("endpoint_in_service").wait(EndpointName=endpoint_name)
+    print(f"✅ Endpoint {endpoint_name} serves {config_name}. The app's SAGEMAKER_ENDPOINT must be {endpoint_name}")
+    return endpoint_name
+
+
+def _extract_model(tar, target):
+    # the "data" filter (Python 3.8.17 / 3.9.17 / 3.10.12 / 3.11.4+) refuses absolute
+    # paths, links out of target and special files; without it, allow plain files only
+    if hasattr(tarfile, "data_filter"):
+        tar.extractall(target, filter="data")
+        return
+    for member in tar.getmembers():
+        parts = member.name.replace("\\", "/").split("/")
+        if not (member.isfile() or member.isdir()) or os.path.isabs(member.name) or ".." in parts:
+            raise ValueError(f"Refusing to extract {member.name!r} from the model archive")
+    tar.extractall(target)
+
+
+def deploy_local(backend, model_key, serve_dir) -> str:
+    """Unpack the model.tar.gz for serve.py; returns the model directory."""
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = os.path.join(tmp, "model.tar.gz")
+        backend.get_file(model_key, archive)
+        if os.path.exists(serve_dir):
+            shutil.rmtree(serve_dir)
+        with tarfile.open(archive) as tar:
+            _extract_model(tar, serve_dir)
+    print(f"✅ Model unpacked. Serve it with: python serve.py --model-dir {serve_dir}")
+    return serve_dir
+
+
+def deploy_or_reuse(args, backend, train_digest, train_record):
+    code = sha256_files([os.path.join(SOURCE_DIR, f) for f in SERVING_SOURCES], SOURCE_DIR)
+    instance = "local" if args.local_dir else args.endpoint_instance
+    digest = sha256_json({"model": train_digest, "code": code, "instance": instance})
+    record_key = f"{args.s3_prefix}/cache/deploy/{digest[:KEY_CHARS]}.json"
+    record = None if args.force else backend.get_json(record_key)
+    if record is not None:
+        if args.local_dir:
+            alive = os.path.isdir(record["endpoint"])
+        else:
+            alive = endpoint_config(args, record["endpoint"]) == record.get("endpoint_config")
+        if alive:
+            print(f"Deployment {digest[:KEY_CHARS]}: model and serving code unchanged, "
+                  f"keeping {record['endpoint']}")
+            return record
+    if args.dry_run or train_record is None:
+        print(f"Deployment {digest[:KEY_CHARS]}: would deploy")
+        return None
+
+    if args.local_dir:
+        endpoint = deploy_local(backend, train_record["model_key"],
+                                backend.path(f"{args.s3_prefix}/endpoints/{digest[:KEY_CHARS]}"))
+        config = None
+    else:
+        config = f"{args.endpoint_name}-{digest[:KEY_CHARS]}"
+        endpoint = deploy_sagemaker(args, train_record["model_data"], config)
+    record = {"endpoint": endpoint, "endpoint_config": config, "model_data": train_record["model_data"],
+              "code": code, "instance": instance, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    backend.put_json(record_key, record)
+    return record
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "--region", type=str, required=True,
+        "--region", type=str, default=None,
         help="AWS region (e.g. ca-central-1)"
     )
     parser.add_argument(
-        "--role-arn", type=str, required=True,
+        "--role-arn", type=str, default=None,
         help="IAM role ARN with SageMaker permissions"
     )
     parser.add_argument(
-        "--s3-bucket", type=str, required=True,
+        "--s3-bucket", type=str, default=None,
         help="S3 bucket to use for data & model‐artifacts"
     )
     parser.add_argument(
@@ -28,56 +335,55 @@ if __name__ == "__main__":
         "--instance", type=str, default="ml.m5.xlarge",
         help="Instance type for training (default: ml.m5.xlarge)"
     )
+    parser.add_argument(
+        "--endpoint-instance", type=str, default="ml.m5.large",
+        help="Instance type for the endpoint (default: ml.m5.large)"
+    )
+    parser.add_argument(
+        "--endpoint-name", type=str, default="aki-risk",
+        help="The endpoint the app calls (its SAGEMAKER_ENDPOINT); updated in place on every "
+             "deployment, whose model and EndpointConfig are named <endpoint-name>-<deployment hash>"
+    )
+    parser.add_argument(
+        "--input-csv", type=str, default="data_clean_name.csv",
+        help="Training data (CSV or feature store directory)"
+    )
+    parser.add_argument(
+        "--local-dir", type=str, default=None,
+        help="Run offline: store everything under this directory instead of S3 and train locally"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="Only report which uploads, training and deployment would run"
+    )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="Train and deploy even when a cached model / endpoint matches"
+    )
+    parser.add_argument("--upload-workers", type=int, default=UPLOAD_WORKERS,
+                        help="Files (and multipart parts) uploaded in parallel")
+    parser.add_argument("--multipart-chunk-mb", type=int, default=MULTIPART_CHUNK_MB,
+                        help="S3 multipart part size; larger files are uploaded in parts")
     args = parser.parse_args()
+    if not args.local_dir:
+        missing = [f"--{n.replace('_', '-')}" for n in ("region", "role_arn", "s3_bucket") if not getattr(args, n)]
+        if missing:
+            parser.error(f"{', '.join(missing)} required (or --local-dir to run offline)")
 
-    REGION        = args.region
-    ROLE_ARN      = args.role_arn
-    S3_BUCKET     = args.s3_bucket
-    S3_PREFIX     = args.s3_prefix
-    INSTANCE_TYPE = args.instance
+    if args.local_dir:
+        backend = LocalStore(args.local_dir)
+    else:
+        backend = S3Store(args.s3_bucket, region=args.region,
+                          multipart_chunk_mb=args.multipart_chunk_mb, workers=args.upload_workers)
 
-    # 1) Upload local CSV to S3 under <bucket>/<prefix>/data_clean_name.csv
-    local_csv = "data_clean_name.csv"
-    s3_data_key = f"{S3_PREFIX}/data_clean_name.csv"
-    s3_data_uri = f"s3://{S3_BUCKET}/{s3_data_key}"
+    # 1) Convert the local CSV into the columnar feature store (feature_store.py)
+    #    and upload it under <prefix>/feature_store/<data hash>/; train.py
+    #    memory-maps the columns instead of parsing CSV text
+    store = open_store(args.input_csv)
+    data_digest, data_prefix = upload_data(backend, store, args.s3_prefix, args.upload_workers, args.dry_run)
 
-    print(f"Uploading {local_csv} → {s3_data_uri}")
-    boto3.client("s3", region_name=REGION).upload_file(local_csv, S3_BUCKET, s3_data_key)
-    print("✅ Data upload complete.")
+    # 2) Train (or reuse the model trained on the same data, code and parameters)
+    train_digest, train_record = train_or_reuse(args, backend, data_digest, data_prefix)
 
-    # 2) Create SageMaker SKLearn estimator
-    boto_session      = boto3.Session(region_name=REGION)
-    sagemaker_session = sagemaker.Session(boto_session=boto_session)
-
-    estimator = SKLearn(
-        entry_point       = "train.py",
-        source_dir        = ".",
-        role              = ROLE_ARN,
-        instance_type     = INSTANCE_TYPE,
-        framework_version = "0.23-1",
-        py_version        = "py3",
-        dependencies      = ["requirements.txt"],
-        sagemaker_session = sagemaker_session,
-        output_path       = f"s3://{S3_BUCKET}/{S3_PREFIX}/model-artifacts/"
-    )
-
-    print("▶ Starting SageMaker training job...")
-    estimator.fit({"training": s3_data_uri}, wait=True)
-    print("✅ Training job complete.")
-
-    # estimator.model_data now points to the trained model.tar.gz in S3
-    sklearn_serving_model = SKLearnModel(
-        model_data=estimator.model_data,    # "<s3://…/model-artifacts/…/model.tar.gz>"
-        role=ROLE_ARN,
-        entry_point="inference.py",         # <-- tell SageMaker to use inference.py at serve‐time
-        source_dir=".",                     # directory where inference.py lives
-        framework_version="0.23-1",
-        py_version="py3",
-    )
-
-    print("▶ Deploying endpoint (1 ml.m5.large instance)…")
-    predictor = sklearn_serving_model.deploy(
-        initial_instance_count=1,
-        instance_type="ml.m5.large"
-    )
-    print("✅ Endpoint deployed. Name =", predictor.endpoint_name)
\ No newline at end of file
+    # 3) Deploy (or keep the endpoint already serving that model with this inference code)
+    deploy_or_reuse(args, backend, train_digest, train_record)
@@ -0,0 +1,185 @@
+# compiled_trees.py
+"""
+Pure-NumPy evaluator for the (small) XGBoost binary classifiers.
+
+compile_model flattens every tree of a booster (model.ubj / model.json /
+model.xgb, or the XGBClassifier in model.joblib) into fixed-shape arrays. Each
+tree is padded to a perfect binary tree of the ensemble's max depth D, so the
+children of split slot p on a level are slots 2p and 2p + 1 on the next one and
+need no pointers:
+
+    feature       (2**D - 1, n_trees)  split feature per slot (numbered level by level)
+    threshold     (2**D - 1, n_trees)  go left when x < threshold
+    default_left  (2**D - 1, n_trees)  direction for a missing (NaN) x
+    leaf          (n_trees, 2**D)      leaf value per bottom slot
+
+A leaf above depth D becomes splits that always go left, over copies of its
+value. Scoring a batch gathers the features of every slot once and compares
+them with every threshold in one vectorized step; then all trees are walked
+together, one level per step, by selecting each (tree, row)'s comparison at
+its current slot, and the leaf values are summed into log-odds. There is no
+DMatrix, no thread pool and no call into the XGBoost runtime, which is what
+dominates small-batch latency.
+
+Only numerical splits, trees up to MAX_DEPTH and a binary:logistic /
+reg:logistic / binary:logitraw objective are supported; compile_model raises
+ValueError otherwise. check_parity compares an ensemble with the booster it
+came from (inference.py runs it before serving with COMPILED_TREES);
+tree_benchmark.py checks parity on synthetic patients too and shows where this
+beats the native call.
+"""
+import json
+
+import numpy as np
+
+SUPPORTED_OBJECTIVES = ("binary:logistic", "reg:logistic", "binary:logitraw")
+MAX_DEPTH = 6   # the padded trees evaluate 2**depth - 1 comparisons each
+PARITY_ROWS = 512
+
+
+class CompiledEnsemble:
+    def __init__(self, feature, threshold, default_left, leaf, base_margin, n_features,
+                 objective="binary:logistic"):
+        self.feature = feature            # (n_slots, n_trees)
+        self.threshold = threshold[..., None].astype(np.float32)
+        self.default_right = ~default_left[..., None]
+        self.leaf = leaf                  # (n_trees, n_leaves)
+        self.base_margin = base_margin
+        self.n_features = n_features
+        self.objective = objective
+        self.depth = int(np.log2(leaf.shape[1]))
+        self._leaf_start = (np.arange(self.n_trees) * leaf.shape[1])[:, None]
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.leaf)
+
+    def predict_margin(self, X: np.ndarray) -> np.ndarray:
+        """Raw scores (log-odds) for an (n_rows, n_features) matrix; NaN is missing."""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected a matrix with {self.n_features} columns, got shape {X.shape}")
+        columns = np.ascontiguousarray(X.T)
+        # one contiguous (n_trees, n_rows) plane of directions per slot; NaN -> left ...
+        go_right = columns[self.feature] >= self.threshold
+        missing = np.isnan(columns)
+        if missing.any():
+            go_right |= missing[self.feature] & self.default_right   # ... unless it defaults right
+        # Walk every tree one level at a time. The direction taken on a level is
+        # one bit of the leaf index; the slot reached on the next level is picked
+        # by halving that level's planes with the bits so far (bitwise selects).
+        pos = np.zeros((self.n_trees, len(X)), dtype=np.intp)
+        bits = []
+        for level in range(self.depth):
+            start = (1 << level) - 1
+            taken = go_right[start:start + (1 << level)]
+            for bit in bits:
+                half = len(taken) // 2
+                taken = (bit & taken[half:]) | (~bit & taken[:half])
+            bit = taken[0]
+            bits.append(bit)
+            pos += pos + bit
+        return self.leaf.ravel()[self._leaf_start + pos].sum(axis=0, dtype=np.float32) \
+            + np.float32(self.base_margin)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """P(positive) per row, like Booster.inplace_predict / predict_proba[:, 1]."""
+        margin = self.predict_margin(X)
+        if self.objective == "binary:logitraw":
+            return margin
+        return (1.0 / (1.0 + np.exp(-margin))).astype(np.float32)
+
+
+def _base_margin(learner) -> float:
+    # "5.674869E-1" (XGBoost 1.x) or "[5.674869E-1]" (2.x+); stored as a probability
+    base_score = float(learner["learner_model_param"]["base_score"].strip("[]"))
+    if learner["objective"]["name"] == "binary:logitraw":
+        return base_score
+    return float(np.log(base_score / (1.0 - base_score)))
+
+
+def _tree_depth(tree) -> int:
+    left, right = tree["left_children"], tree["right_children"]
+    depth, level = 0, [0]
+    while True:
+        splits = [n for n in level if left[n] != -1]
+        if not splits:
+            return depth
+        level = [left[n] for n in splits] + [right[n] for n in splits]
+        depth += 1
+
+
+def _pad_tree(tree, depth, feature, threshold, default_left, leaf):
+    # fill one tree's rows of the padded arrays, level by level from the root
+    level = [0]
+    for d in range(depth):
+        nxt = []
+        for p, node in enumerate(level):
+            slot = (1 << d) - 1 + p
+            if tree["left_children"][node] == -1:   # leaf above the bottom: always go left
+                threshold[slot], default_left[slot] = np.inf, True
+                nxt += [node, node]
+            else:
+                feature[slot] = tree["split_indices"][node]
+                threshold[slot] = tree["split_conditions"][node]
+                default_left[slot] = bool(tree["default_left"][node])
+                nxt += [tree["left_children"][node], tree["right_children"][node]]
+        level = nxt
+    for p, node in enumerate(level):
+        leaf[p] = tree["split_conditions"][node]    # a leaf's split_condition is its value
+
+
+def compile_model(model) -> CompiledEnsemble:
+    """Flatten a Booster or XGBClassifier into a CompiledEnsemble."""
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    learner = json.loads(bytes(booster.save_raw(raw_format="json")))["learner"]
+    objective = learner["objective"]["name"]
+    if objective not in SUPPORTED_OBJECTIVES:
+        raise ValueError(f"Cannot compile objective {objective!r} (supported: {SUPPORTED_OBJECTIVES})")
+    if learner["gradient_booster"]["name"] != "gbtree":
+        raise ValueError(f"Cannot compile booster {learner['gradient_booster']['name']!r}")
+    trees = learner["gradient_booster"]["model"]["trees"]
+    if any(any(t.get("split_type", [])) for t in trees):
+        raise ValueError("Cannot compile categorical splits")
+    depth = max((_tree_depth(t) for t in trees), default=0)
+    if depth > MAX_DEPTH:
+        raise ValueError(f"Cannot compile trees deeper than {MAX_DEPTH} (got {depth})")
+
+    n_slots = (1 << depth) - 1
+    feature = np.zeros((len(trees), n_slots), dtype=np.intp)
+    threshold = np.zeros((len(trees), n_slots), dtype=np.float32)
+    default_left = np.zeros((len(trees), n_slots), dtype=bool)
+    leaf = np.zeros((len(trees), 1 << depth), dtype=np.float32)
+    for i, tree in enumerate(trees):
+        _pad_tree(tree, depth, feature[i], threshold[i], default_left[i], leaf[i])
+    return CompiledEnsemble(
+        feature.T.copy(), threshold.T.copy(), default_left.T.copy(), leaf,
+        base_margin=_base_margin(learner),
+        n_features=int(learner["learner_model_param"]["num_feature"]),
+        objective=objective,
+    )
+
+
+def parity_matrix(compiled: CompiledEnsemble, n_rows=PARITY_ROWS, seed=0) -> np.ndarray:
+    """
+    Rows built from the ensemble's own split thresholds, so both sides and the
+    missing direction of the splits are exercised without any training data:
+    every value is one of its feature's thresholds, the float just below one,
+    or NaN.
+    """
+    rng = np.random.default_rng(seed)
+    X = np.full((n_rows, compiled.n_features), np.nan, dtype=np.float32)
+    thresholds = compiled.threshold[..., 0]
+    for j in range(compiled.n_features):
+        values = np.unique(thresholds[(compiled.feature == j) & np.isfinite(thresholds)])
+        if values.size:
+            below = np.nextafter(values, np.float32(-np.inf))
+            X[:, j] = rng.choice(np.concatenate([values, below, [np.nan]]), n_rows)
+    return X
+
+
+def check_parity(compiled: CompiledEnsemble, model, n_rows=PARITY_ROWS) -> float:
+    """Largest |difference| between compiled and the booster's inplace_predict on parity_matrix rows."""
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    X = parity_matrix(compiled, n_rows)
+    return float(np.max(np.abs(compiled.predict_proba(X) - booster.inplace_predict(X))))
@@ -0,0 +1,80 @@
+# decision_threshold.py
+"""
+Decision threshold for the positive class, chosen from out-of-fold scores.
+
+threshold_curves sorts the (stacked) scores once and derives recall /
+precision / false-positive rate at every distinct score with cumulative sums,
+so every candidate threshold is evaluated in one vectorized pass.
+threshold_for_recall then picks the most precise threshold that still reaches
+a target recall.
+
+train_local.py saves the result as threshold.json next to the model;
+inference.py classifies with `proba >= threshold` when that file is present
+and falls back to XGBClassifier.predict's `proba > 0.5` otherwise.
+"""
+import json
+import os
+
+import numpy as np
+
+THRESHOLD_FILENAME = "threshold.json"
+
+
+def threshold_curves(y_true, scores) -> dict:
+    """
+    Metrics for "predict positive when score >= threshold", at every distinct
+    score (thresholds descending). Arrays of any shape are flattened, so
+    repeated-CV scores can be passed stacked as (n_repeats, n_rows).
+    """
+    y = np.asarray(y_true).ravel().astype(bool)
+    s = np.asarray(scores, dtype=np.float64).ravel()
+    order = np.argsort(-s, kind="mergesort")
+    s, y = s[order], y[order]
+    last = np.r_[np.flatnonzero(np.diff(s)), len(s) - 1]   # last row of each distinct score
+    tp = np.cumsum(y)[last]
+    fp = last + 1 - tp
+    return {
+        "thresholds": s[last],
+        "recall": tp / max(tp[-1], 1),
+        "precision": tp / (tp + fp),
+        "fpr": fp / max(fp[-1], 1),
+    }
+
+
+def roc_auc(curves) -> float:
+    """Area under the ROC curve given by threshold_curves."""
+    fpr = np.r_[0.0, curves["fpr"]]
+    tpr = np.r_[0.0, curves["recall"]]
+    return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+
+def threshold_for_recall(curves, target_recall) -> dict:
+    """
+    The threshold with the best precision among those reaching target_recall
+    (ties go to the higher threshold), with its recall / precision / fpr.
+    """
+    eligible = curves["recall"] >= target_recall
+    i = int(np.argmax(np.where(eligible, curves["precision"], -1.0)))
+    return {
+        "threshold": float(curves["thresholds"][i]),
+        "target_recall": target_recall,
+        "recall": float(curves["recall"][i]),
+        "precision": float(curves["precision"][i]),
+        "fpr": float(curves["fpr"][i]),
+    }
+
+
+def save_threshold(model_dir, info: dict) -> str:
+    path = os.path.join(model_dir, THRESHOLD_FILENAME)
+    with open(path, "w") as f:
+        json.dump(info, f, indent=2)
+    return path
+
+
+def load_threshold(model_dir):
+    """The saved threshold for the model in model_dir, or None if there is none."""
+    path = os.path.join(model_dir, THRESHOLD_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return float(json.load(f)["threshold"])
@@ -0,0 +1,328 @@
+# drift_monitor.py
+"""
+Input-drift monitoring for the served features, in fixed memory.
+
+At training time DriftReference.fit cuts every FEATURE_COLS column of the
+model input (served_matrix: scaled and log-sqrt transformed, not imputed, with
+outliers kept -- the matrix predict_fn sees for the mobile requests) at its
+quantiles into up to DEFAULT_BINS bins, and counts the training rows per bin
+plus a "missing" bin. train.py saves it next to the
+model as drift_reference.json; it holds edges and counts only, no rows.
+
+At serving time DriftMonitor.update adds each scored batch to a histogram
+over the same bins: a vectorized comparison against a padded
+(features, edges) array (or a binary search per column, for larger batches)
+and one bincount, i.e. a fixed number of operations per row and a fixed-size
+counts array however much traffic arrives. Because
+the bins are the reference quantiles, the histogram is also a quantile sketch:
+the fraction of live rows per reference decile (or finer) is what it keeps.
+
+When a window closes (window_rows rows, or window_seconds with at least
+min_rows rows) every feature is scored against the reference:
+  - PSI: population stability index over the bins, missing bin included
+    (< 0.1 stable, 0.1 - 0.25 moderate, > 0.25 major shift by the usual rule)
+  - KS: largest gap between the binned CDFs of the present values
+  - the missing-value rate, live vs. reference
+The report is logged (a warning naming the features over psi_alert) and
+DriftMonitor.stats exports the last one as gauges; then the window restarts.
+
+A reference can be (re)built for an existing model directory:
+
+    python drift_monitor.py --input-csv data_clean_name.csv --model-dir model_artifact
+
+The script then replays the training rows through inference.py's input_fn /
+predict_fn, one request per row, and exits 1 if that window raises an alert
+(a reference that does not match what serving bins).
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from preprocessing import FEATURE_COLS
+
+DRIFT_REFERENCE_FILENAME = "drift_reference.json"
+DRIFT_REFERENCE_VERSION = 1
+DEFAULT_BINS = 20
+PSI_EPSILON = 1e-4   # floor for empty bins, so PSI stays finite
+BROADCAST_MAX_ROWS = 64
+
+logger = logging.getLogger(__name__)
+
+
+class DriftReference:
+    """Per-feature bin edges and counts (the last bin of every feature counts missing values)."""
+
+    def __init__(self, columns, edges, counts, rows=0):
+        self.columns = list(columns)
+        self.edges = [np.asarray(e, dtype=np.float32) for e in edges]
+        self.counts = [np.asarray(c, dtype=np.int64) for c in counts]
+        self.rows = rows
+
+    @classmethod
+    def fit(cls, X: np.ndarray, columns=FEATURE_COLS, n_bins=DEFAULT_BINS) -> "DriftReference":
+        """Quantile bins of every column of the model input matrix X."""
+        X = np.asarray(X, dtype=np.float32)
+        edges = []
+        for j in range(X.shape[1]):
+            present = X[:, j][~np.isnan(X[:, j])]
+            cuts = np.quantile(present, np.linspace(0, 1, n_bins + 1)[1:-1]) if present.size else []
+            edges.append(np.unique(np.asarray(cuts, dtype=np.float32)))
+        reference = cls(columns, edges, [np.zeros(len(e) + 2, dtype=np.int64) for e in edges])
+        return reference.add(X)
+
+    def add(self, X: np.ndarray) -> "DriftReference":
+        """Count more rows into the same bins (incremental training)."""
+        binned = Binning(self)
+        for j, counts in enumerate(np.split(binned.histogram(X), binned.offsets[1:-1])):
+            self.counts[j] += counts
+        self.rows += len(X)
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "version": DRIFT_REFERENCE_VERSION,
+            "rows": self.rows,
+            "features": {
+                name: {"edges": e.tolist(), "counts": c[:-1].tolist(), "missing": int(c[-1])}
+                for name, e, c in zip(self.columns, self.edges, self.counts)
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "DriftReference":
+        if d.get("version") != DRIFT_REFERENCE_VERSION:
+            raise ValueError(f"Unsupported drift reference version {d.get('version')}")
+        features = d["features"]
+        return cls(
+            features,
+            [f["edges"] for f in features.values()],
+            [f["counts"] + [f["missing"]] for f in features.values()],
+            rows=d["rows"],
+        )
+
+    def save(self, model_dir: str) -> str:
+        path = os.path.join(model_dir, DRIFT_REFERENCE_FILENAME)
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+        return path
+
+    @classmethod
+    def load(cls, model_dir: str) -> "DriftReference":
+        path = os.path.join(model_dir, DRIFT_REFERENCE_FILENAME)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No {DRIFT_REFERENCE_FILENAME} in {model_dir}")
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+class Binning:
+    """A reference's edges as one padded array, for binning whole batches at once."""
+
+    def __init__(self, reference: DriftReference):
+        n_edges = np.array([len(e) for e in reference.edges], dtype=np.intp)
+        self.edges = np.full((len(n_edges), max(n_edges, default=0)), np.inf, dtype=np.float32)
+        for j, e in enumerate(reference.edges):
+            self.edges[j, :len(e)] = e
+        self.n_edges = n_edges
+        # feature j owns bins offsets[j] .. offsets[j + 1] - 1; the last one is "missing"
+        self.offsets = np.concatenate([[0], np.cumsum(n_edges + 2)])
+        self.size = int(self.offsets[-1])
+
+    def histogram(self, X: np.ndarray) -> np.ndarray:
+        """Counts per bin of all features, flat (see offsets)."""
+        X = np.asarray(X, dtype=np.float32)
+        # bin = number of edges <= x (searchsorted side="right"); one broadcast
+        # comparison is cheapest for the small requests, a search per column beyond
+        if len(X) <= BROADCAST_MAX_ROWS:
+            bins = np.minimum((X[:, :, None] >= self.edges).sum(axis=2), self.n_edges)
+        else:
+            bins = np.empty(X.shape, dtype=np.intp)
+            for j, n in enumerate(self.n_edges):
+                bins[:, j] = np.searchsorted(self.edges[j, :n], X[:, j], side="right")
+        bins = np.where(np.isnan(X), self.n_edges + 1, bins) + self.offsets[:-1]
+        return np.bincount(bins.ravel(), minlength=self.size)
+
+
+def served_matrix(preprocessor, df) -> np.ndarray:
+    """
+    What predict_fn bins for raw rows df: FEATURE_COLS scaled and log-sqrt
+    transformed (transform_matrix) with no imputation, since the mobile / fast
+    path requests carry no grouping keys -- missing values stay missing.
+    """
+    X = np.array(df.reindex(columns=FEATURE_COLS).to_numpy(dtype=np.float64))   # own writable copy
+    return preprocessor.transform_matrix(X).astype(np.float32)
+
+
+def replay_training_rows(model_dir, df, reference, psi_alert=0.2) -> dict:
+    """
+    Score every row of df (raw FEATURE_COLS) as its own JSON request through
+    inference.py with a monitor on reference, and return the window's report.
+    """
+    import inference
+
+    model = inference.model_fn(model_dir)
+    monitor = DriftMonitor(reference, window_rows=len(df) + 1, window_seconds=float("inf"),
+                           psi_alert=psi_alert)
+    saved, inference.DRIFT_MONITOR = inference.DRIFT_MONITOR, monitor
+    try:
+        for record in df.reindex(columns=FEATURE_COLS).to_dict("records"):
+            body = json.dumps({k: v for k, v in record.items() if v == v})   # NaN -> key left out
+            inference.predict_fn(inference.input_fn(body, "application/json"), model)
+    finally:
+        inference.DRIFT_MONITOR = saved
+    return monitor.check()
+
+
+def psi(expected: np.ndarray, actual: np.ndarray, eps=PSI_EPSILON) -> float:
+    e = np.maximum(expected / max(expected.sum(), 1), eps)
+    a = np.maximum(actual / max(actual.sum(), 1), eps)
+    return float(np.sum((a - e) * np.log(a / e)))
+
+
+def ks(expected: np.ndarray, actual: np.ndarray) -> float:
+    """KS distance of the binned present values (both arrays without the missing bin)."""
+    if not expected.sum() or not actual.sum():
+        return 0.0
+    return float(np.max(np.abs(np.cumsum(expected) / expected.sum() - np.cumsum(actual) / actual.sum())))
+
+
+def compare(reference: DriftReference, counts: np.ndarray, offsets) -> dict:
+    """Per-feature PSI, KS and missing rates of flat live counts against the reference."""
+    features = {}
+    for j, name in enumerate(reference.columns):
+        expected, actual = reference.counts[j], counts[offsets[j]:offsets[j + 1]]
+        features[name] = {
+            "psi": psi(expected, actual),
+            "ks": ks(expected[:-1], actual[:-1]),
+            "missing_rate": float(actual[-1] / max(actual.sum(), 1)),
+            "reference_missing_rate": float(expected[-1] / max(expected.sum(), 1)),
+        }
+    return features
+
+
+def _metric_name(feature) -> str:
+    return re.sub(r"\W+", "_", feature).strip("_").lower()
+
+
+class DriftMonitor:
+    def __init__(self, reference: DriftReference, window_rows=1000, window_seconds=300.0,
+                 min_rows=100, psi_alert=0.2, logger=logger):
+        if reference.columns != list(FEATURE_COLS):
+            raise ValueError(f"Drift reference columns {reference.columns} do not match FEATURE_COLS")
+        self.reference = reference
+        self.binning = Binning(reference)
+        self.window_rows = window_rows
+        self.window_seconds = window_seconds
+        self.min_rows = min_rows
+        self.psi_alert = psi_alert
+        self.logger = logger
+        self.counts = np.zeros(self.binning.size, dtype=np.int64)
+        self.rows = 0
+        self.rows_observed = 0
+        self.windows = 0
+        self.last_report = None
+        self._window_started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def update(self, X: np.ndarray):
+        """Add a scored (model input) batch; closes the window when it is due."""
+        if not len(X):
+            return
+        histogram = self.binning.histogram(X)
+        with self._lock:
+            self.counts += histogram
+            self.rows += len(X)
+            self.rows_observed += len(X)
+            report = self._close_window() if self._window_due() else None
+        if report is not None:
+            self._log(report)
+
+    def check(self):
+        """Close the current window now (if it has any rows) and return its report."""
+        with self._lock:
+            report = self._close_window() if self.rows else None
+        if report is not None:
+            self._log(report)
+        return report
+
+    def _window_due(self) -> bool:
+        if self.rows >= self.window_rows:
+            return True
+        return self.rows >= self.min_rows and time.monotonic() - self._window_started >= self.window_seconds
+
+    def _close_window(self) -> dict:
+        now = time.monotonic()
+        features = compare(self.reference, self.counts, self.binning.offsets)
+        report = {
+            "window": self.windows,
+            "rows": self.rows,
+            "seconds": now - self._window_started,
+            "max_psi": max((f["psi"] for f in features.values()), default=0.0),
+            "drifted": sorted(name for name, f in features.items() if f["psi"] > self.psi_alert),
+            "features": features,
+        }
+        self.counts[:] = 0
+        self.rows = 0
+        self.windows += 1
+        self._window_started = now
+        self.last_report = report
+        return report
+
+    def _log(self, report):
+        summary = ", ".join(f"{name} psi={f['psi']:.3f} ks={f['ks']:.3f}"
+                            for name, f in report["features"].items())
+        if report["drifted"]:
+            self.logger.warning("Input drift in %s over the last %d rows (%s)",
+                           report["drifted"], report["rows"], summary)
+        else:
+            self.logger.info("Input drift check over the last %d rows: max psi %.3f (%s)",
+                        report["rows"], report["max_psi"], summary)
+
+    def stats(self) -> dict:
+        """Gauges for the metrics collector: counters plus the last window's scores."""
+        out = {"rows_observed": self.rows_observed, "windows": self.windows, "window_rows": self.rows}
+        report = self.last_report
+        if report is not None:
+            out["max_psi"] = report["max_psi"]
+            out["features_drifted"] = len(report["drifted"])
+            for name, f in report["features"].items():
+                metric = _metric_name(name)
+                out[f"psi_{metric}"] = f["psi"]
+                out[f"ks_{metric}"] = f["ks"]
+                out[f"missing_rate_{metric}"] = f["missing_rate"]
+        return out
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import sys
+
+    from feature_store import open_store
+    from preprocessing import Preprocessor
+
+    parser = argparse.ArgumentParser(description="Write drift_reference.json for a model directory")
+    parser.add_argument("--input-csv", default="data_clean_name.csv",
+                        help="Training data (CSV or feature store directory)")
+    parser.add_argument("--model-dir", default="model_artifact",
+                        help="Model directory holding preprocessor.json; the reference is written there")
+    parser.add_argument("--bins", type=int, default=DEFAULT_BINS)
+    parser.add_argument("--no-replay", action="store_true",
+                        help="Skip replaying the training rows through inference.py")
+    args = parser.parse_args()
+
+    pre = Preprocessor.load(args.model_dir)
+    df = open_store(args.input_csv).frame(FEATURE_COLS)
+    reference = DriftReference.fit(served_matrix(pre, df), n_bins=args.bins)
+    print(f"Wrote {reference.save(args.model_dir)} ({reference.rows} rows)")
+    if not args.no_replay:
+        report = replay_training_rows(args.model_dir, df, DriftReference.load(args.model_dir))
+        print(f"Replayed {report['rows']} training rows: max psi {report['max_psi']:.4f}, "
+              f"drifted {report['drifted'] or 'none'}")
+        if report["drifted"]:
+            sys.exit(1)
@@ -0,0 +1,249 @@
+# feature_store.py
+"""
+Columnar on-disk copy of the patient table (data_clean_name.csv).
+
+build_store parses the CSV once, checks it against SCHEMA and writes one .npy
+file per column plus schema.json into a store directory:
+  - "float" columns are float64 (missing values are NaN; text that does not
+    parse as a number is an error, not a silent NaN)
+  - "label" columns (the AKI / dialysis targets) are int8 and must be 0 or 1
+  - "category" columns are int32 codes (-1 = missing) with the categories
+    kept in schema.json
+FeatureStore memory-maps the column files, so reading the table costs the
+columns a trainer selects, not the size of the CSV text.
+
+The AKI and dialysis models train on the same table; TARGETS maps the target
+name to its label column:
+
+    store = open_store("data_clean_name.csv")     # built on first use, then reused
+    df = store.frame(RAW_INPUT_COLS + [TARGETS["dialysis"]])
+
+A CSV passed to open_store is converted into "<name>.store" next to it (or
+under FEATURE_STORE_DIR) and rebuilt only when the CSV's size or mtime changes.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+SCHEMA_FILENAME = "schema.json"
+SCHEMA_VERSION = 1
+FEATURE_STORE_DIR = os.environ.get("FEATURE_STORE_DIR")
+
+SCHEMA = [
+    ("Gender", "float"),
+    ("Age", "float"),
+    ("Height", "float"),
+    ("Weight", "float"),
+    ("Route of Entry", "category"),
+    ("Hypertension", "float"),
+    ("Diabetes", "float"),
+    ("Mechanical Ventilation", "float"),
+    ("Glasgow", "float"),
+    ("Pulse", "float"),
+    ("Temperature", "float"),
+    ("Mean Arterial Pressure", "float"),
+    ("Respiratory Rate", "float"),
+    ("SOFA", "float"),
+    ("APACHEII", "float"),
+    ("pH", "float"),
+    ("HCO3", "float"),
+    ("Lactate", "float"),
+    ("Urea", "float"),
+    ("Creatinine", "float"),
+    ("Procalcitonin", "float"),
+    ("Bilirubin", "float"),
+    ("Albumin", "float"),
+    ("White Blood Cell Count", "float"),
+    ("Outcome of acute kidney injury", "label"),
+    ("Dialysis treatment", "label"),
+]
+TARGETS = {
+    "aki": "Outcome of acute kidney injury",
+    "dialysis": "Dialysis treatment",
+}
+
+
+def data_fingerprint(path, n_bytes=None) -> dict:
+    """
+    sha256 of the CSV's first n_bytes (default: every complete line), so a later
+    run can tell appended rows from an edited file.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if n_bytes is None:
+        n_bytes = data.rfind(b"\n") + 1
+    return {
+        "path": os.path.basename(path),
+        "bytes": n_bytes,
+        "sha256": hashlib.sha256(data[:n_bytes]).hexdigest(),
+    }
+
+
+# ----------------------------
+# Schema validation
+# ----------------------------
+def validate(df: pd.DataFrame, schema=SCHEMA) -> pd.DataFrame:
+    """
+    The schema's columns of df, typed: float64, int8 labels and categoricals.
+    Raises ValueError listing every problem (missing columns, unparseable
+    numbers, labels that are missing or not 0/1).
+    """
+    problems = []
+    out = {}
+    for name, kind in schema:
+        if name not in df.columns:
+            problems.append(f"missing column {name!r}")
+            continue
+        raw = df[name]
+        if kind == "category":
+            out[name] = raw.astype("category")
+            continue
+        values = pd.to_numeric(raw, errors="coerce")
+        bad = values.isna() & raw.notna()
+        if bad.any():
+            problems.append(f"{name!r}: {int(bad.sum())} non-numeric values (e.g. {raw[bad].iloc[0]!r})")
+        if kind == "label":
+            if values.isna().any() or not values.isin([0, 1]).all():
+                problems.append(f"{name!r}: labels must be 0 or 1 with none missing")
+                continue
+            out[name] = values.astype(np.int8)
+        else:
+            out[name] = values.astype(np.float64)
+    if problems:
+        raise ValueError("Data does not match the feature store schema: " + "; ".join(problems))
+    return pd.DataFrame(out, index=df.index)
+
+
+def read_csv(path, schema=SCHEMA) -> pd.DataFrame:
+    """Parse and validate a CSV (for small files, e.g. the rows of an incremental update)."""
+    return validate(pd.read_csv(path), schema)
+
+
+# ----------------------------
+# Store
+# ----------------------------
+def build_store(csv_path, store_dir, schema=SCHEMA) -> "FeatureStore":
+    """Convert csv_path into a store at store_dir (replacing any previous one)."""
+    df = validate(pd.read_csv(csv_path), schema)
+    stat = os.stat(csv_path)
+    meta = {
+        "version": SCHEMA_VERSION,
+        "rows": len(df),
+        "source": {**data_fingerprint(csv_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+        "columns": [],
+    }
+    parent = os.path.dirname(os.path.abspath(store_dir))
+    os.makedirs(parent, exist_ok=True)
+    # write-then-rename, so readers never see a half-written store
+    tmp = tempfile.mkdtemp(prefix=".store-", dir=parent)
+    try:
+        for i, (name, kind) in enumerate(schema):
+            column = {"name": name, "kind": kind, "file": f"{i:03d}.npy"}
+            values = df[name]
+            if kind == "category":
+                column["categories"] = [str(c) for c in values.cat.categories]
+                values = values.cat.codes.astype(np.int32)
+            np.save(os.path.join(tmp, column["file"]), values.to_numpy())
+            meta["columns"].append(column)
+        with open(os.path.join(tmp, SCHEMA_FILENAME), "w") as f:
+            json.dump(meta, f, indent=2)
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)
+        os.rename(tmp, store_dir)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return FeatureStore(store_dir)
+
+
+class FeatureStore:
+    """A store directory written by build_store; columns are memory-mapped on first use."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, SCHEMA_FILENAME)) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != SCHEMA_VERSION:
+            raise ValueError(f"{store_dir}: unsupported store version {self.meta.get('version')}")
+        self._columns = {c["name"]: c for c in self.meta["columns"]}
+        self._arrays = {}
+
+    @property
+    def columns(self) -> list:
+        return list(self._columns)
+
+    @property
+    def source(self) -> dict:
+        """data_fingerprint of the CSV the store was built from."""
+        return {k: self.meta["source"][k] for k in ("path", "bytes", "sha256")}
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def array(self, name) -> np.ndarray:
+        """The column as a read-only memory-mapped array (category columns as codes)."""
+        arr = self._arrays.get(name)
+        if arr is None:
+            try:
+                column = self._columns[name]
+            except KeyError:
+                raise KeyError(f"{name!r} is not in the feature store (columns: {self.columns})")
+            arr = self._arrays[name] = np.load(os.path.join(self.store_dir, column["file"]), mmap_mode="r")
+        return arr
+
+    def frame(self, columns=None) -> pd.DataFrame:
+        """A DataFrame of the selected columns (default: all), backed by the mapped arrays."""
+        data = {}
+        for name in columns or self.columns:
+            arr = self.array(name)
+            if self._columns[name]["kind"] == "category":
+                arr = pd.Categorical.from_codes(arr, categories=self._columns[name]["categories"])
+            data[name] = arr
+        return pd.DataFrame(data, copy=False)
+
+    def is_current(self, csv_path) -> bool:
+        """True while csv_path still has the size and mtime the store was built from."""
+        stat = os.stat(csv_path)
+        source = self.meta["source"]
+        return (source.get("size"), source.get("mtime_ns")) == (stat.st_size, stat.st_mtime_ns)
+
+
+def default_store_dir(csv_path) -> str:
+    name = os.path.splitext(os.path.basename(csv_path))[0] + ".store"
+    return os.path.join(FEATURE_STORE_DIR or os.path.dirname(os.path.abspath(csv_path)), name)
+
+
+def open_store(path, schema=SCHEMA) -> FeatureStore:
+    """
+    Open a store directory, or the store for a CSV -- built (or rebuilt, if the
+    CSV changed) on the way. A CSV in a read-only directory gets its store in
+    the system temp directory.
+    """
+    if os.path.isdir(path):
+        return FeatureStore(path)
+    store_dir = default_store_dir(path)
+    parent = os.path.dirname(store_dir)
+    if os.path.isdir(parent) and not os.access(parent, os.W_OK):
+        store_dir = os.path.join(tempfile.gettempdir(), os.path.basename(store_dir))
+    if os.path.exists(os.path.join(store_dir, SCHEMA_FILENAME)):
+        store = FeatureStore(store_dir)
+        if store.is_current(path):
+            return store
+    return build_store(path, store_dir, schema)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert data_clean_name.csv into a feature store")
+    parser.add_argument("--input-csv", default="data_clean_name.csv")
+    parser.add_argument("--store-dir", default=None,
+                        help="Where to write the store (default: <name>.store next to the CSV)")
+    args = parser.parse_args()
+    store = build_store(args.input_csv, args.store_dir or default_store_dir(args.input_csv))
+    print(f"Wrote {len(store)} rows x {len(store.columns)} columns to {store.store_dir}")
@@ -0,0 +1,248 @@
+# hparam_search.py
+"""
+Parallel, resumable hyperparameter search for train.py.
+
+Every candidate in a parameter grid is scored by stratified k-fold
+cross-validation with early stopping (validation AUC). The fold matrices are
+built once per worker process -- a QuantileDMatrix (quantised once, shared by
+every candidate) when the installed XGBoost has it and tree_method is "hist",
+otherwise a plain DMatrix -- and the (candidate, fold) tasks are spread over a
+process pool.
+
+Each finished fold is written to an on-disk cache keyed by a hash of the
+training data, the fold layout, the search settings and the candidate params,
+so an interrupted or repeated search only trains what is missing:
+
+    python train.py --search --cache-dir search_cache
+
+out_of_fold_proba runs repeated stratified k-fold for one fixed parameter set
+on the same kind of pool and returns every row's out-of-fold probability per
+repeat (used by train_local.py for evaluation and threshold tuning).
+"""
+import hashlib
+import itertools
+import json
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import xgboost as xgb
+from sklearn.model_selection import RepeatedStratifiedKFold, StratifiedKFold
+
+PARAM_GRID = {
+    "learning_rate": [0.05, 0.1, 0.2],
+    "max_depth": [2, 3, 4, 5],
+    "min_child_weight": [1, 3],
+    "subsample": [0.7, 0.9],
+    "colsample_bytree": [0.7, 1.0],
+    "gamma": [0.0, 0.5],
+}
+MAX_BOOST_ROUNDS = 1000
+EARLY_STOPPING_ROUNDS = 30
+
+
+def candidates(grid=PARAM_GRID) -> list:
+    """Every combination of the grid, as a list of param dicts (stable order)."""
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+
+def data_hash(X: np.ndarray, y: np.ndarray) -> str:
+    """sha256 of the exact training matrix and labels."""
+    h = hashlib.sha256()
+    for a in (np.ascontiguousarray(X, dtype=np.float32), np.ascontiguousarray(y, dtype=np.float32)):
+        h.update(str(a.shape).encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+class FoldCache:
+    """One small JSON file per (search key, params, fold) under directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(search_key, params, fold) -> str:
+        blob = json.dumps({"search": search_key, "params": params, "fold": fold}, sort_keys=True)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self.directory, key + ".json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, result):
+        # write-then-rename, so an interrupted run never leaves a half-written entry
+        path = os.path.join(self.directory, key + ".json")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(result, f)
+        os.replace(tmp, path)
+
+
+# ----------------------------
+# Worker side
+# ----------------------------
+_FOLD_MATRICES = None   # fold -> (dtrain, dvalid), built once per worker
+_BASE_PARAMS = None
+
+
+def _make_matrices(X, y, train_idx, valid_idx, tree_method):
+    if tree_method == "hist" and hasattr(xgb, "QuantileDMatrix"):
+        dtrain = xgb.QuantileDMatrix(X[train_idx], y[train_idx])
+        return dtrain, xgb.QuantileDMatrix(X[valid_idx], y[valid_idx], ref=dtrain)
+    return xgb.DMatrix(X[train_idx], y[train_idx]), xgb.DMatrix(X[valid_idx], y[valid_idx])
+
+
+def _init_worker(X, y, folds, tree_method, nthread, seed):
+    global _FOLD_MATRICES, _BASE_PARAMS
+    _FOLD_MATRICES = [_make_matrices(X, y, tr, va, tree_method) for tr, va in folds]
+    _BASE_PARAMS = {
+        "objective": "binary:logistic",
+        "eval_metric": "auc",
+        "tree_method": tree_method,
+        "nthread": nthread,
+        "seed": seed,
+    }
+
+
+def _run_fold(params, fold, max_rounds, early_stopping_rounds) -> dict:
+    dtrain, dvalid = _FOLD_MATRICES[fold]
+    started = time.perf_counter()
+    booster = xgb.train(
+        {**_BASE_PARAMS, **params}, dtrain, num_boost_round=max_rounds,
+        evals=[(dvalid, "valid")], early_stopping_rounds=early_stopping_rounds,
+        verbose_eval=False,
+    )
+    return {
+        "auc": float(booster.best_score),
+        "best_iteration": int(booster.best_iteration),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+# ----------------------------
+# Search driver
+# ----------------------------
+def search(X, y, grid=PARAM_GRID, n_folds=5, seed=42, processes=None, cache_dir=None,
+           max_rounds=MAX_BOOST_ROUNDS, early_stopping_rounds=EARLY_STOPPING_ROUNDS,
+           tree_method="hist", log=print) -> list:
+    """
+    Cross-validate every candidate in grid; return one summary per candidate,
+    best first (mean validation AUC, then fewer trees):
+
+        {"params": {...}, "n_estimators": int, "mean_auc": float, "std_auc": float, "folds": [...]}
+
+    n_estimators is the mean early-stopped tree count across folds.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    y = np.ascontiguousarray(y, dtype=np.float32)
+    folds = list(StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=seed).split(X, y))
+    search_key = {
+        "data": data_hash(X, y),
+        "n_folds": n_folds,
+        "seed": seed,
+        "max_rounds": max_rounds,
+        "early_stopping_rounds": early_stopping_rounds,
+        "tree_method": tree_method,
+        "xgboost": xgb.__version__,
+    }
+    cache = FoldCache(cache_dir) if cache_dir else None
+    grid_params = candidates(grid)
+
+    results = {}   # (candidate index, fold) -> fold result
+    pending = []
+    for c, params in enumerate(grid_params):
+        for fold in range(n_folds):
+            hit = cache.get(cache.key(search_key, params, fold)) if cache else None
+            if hit is not None:
+                results[c, fold] = hit
+            else:
+                pending.append((c, fold))
+    log(f"[search] {len(grid_params)} candidates x {n_folds} folds: "
+        f"{len(results)} cached, {len(pending)} to train")
+
+    def record(c, fold, result):
+        results[c, fold] = result
+        if cache:
+            cache.put(cache.key(search_key, grid_params[c], fold), result)
+
+    processes = processes or os.cpu_count() or 1
+    nthread = max(1, (os.cpu_count() or 1) // processes)
+    init_args = (X, y, folds, tree_method, nthread, seed)
+    started = time.perf_counter()
+    if pending and processes == 1:
+        _init_worker(*init_args)
+        for c, fold in pending:
+            record(c, fold, _run_fold(grid_params[c], fold, max_rounds, early_stopping_rounds))
+    elif pending:
+        # spawn: XGBoost's OpenMP pool is not fork-safe
+        with ProcessPoolExecutor(max_workers=processes, mp_context=mp.get_context("spawn"),
+                                 initializer=_init_worker, initargs=init_args) as pool:
+            futures = {
+                pool.submit(_run_fold, grid_params[c], fold, max_rounds, early_stopping_rounds): (c, fold)
+                for c, fold in pending
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                c, fold = futures[future]
+                record(c, fold, future.result())
+                if done % 50 == 0 or done == len(futures):
+                    log(f"[search] {done}/{len(futures)} folds trained "
+                        f"({time.perf_counter() - started:.1f}s)")
+
+    summaries = []
+    for c, params in enumerate(grid_params):
+        fold_results = [results[c, fold] for fold in range(n_folds)]
+        aucs = np.array([r["auc"] for r in fold_results])
+        summaries.append({
+            "params": params,
+            "n_estimators": int(round(np.mean([r["best_iteration"] + 1 for r in fold_results]))),
+            "mean_auc": float(aucs.mean()),
+            "std_auc": float(aucs.std()),
+            "folds": fold_results,
+        })
+    summaries.sort(key=lambda s: (-s["mean_auc"], s["n_estimators"]))
+    return summaries
+
+
+# ----------------------------
+# Out-of-fold evaluation
+# ----------------------------
+def _fit_predict_fold(X, y, train_idx, valid_idx, params, nthread):
+    model = xgb.XGBClassifier(**params, n_jobs=nthread)
+    model.fit(X[train_idx], y[train_idx])
+    return model.predict_proba(X[valid_idx])[:, 1]
+
+
+def out_of_fold_proba(X, y, params, n_splits=5, n_repeats=3, seed=42, processes=None) -> np.ndarray:
+    """
+    Repeated stratified k-fold with XGBClassifier(**params); the folds are
+    trained in parallel. Returns an (n_repeats, n_rows) array where row r holds
+    every sample's out-of-fold probability from repeat r.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    y = np.asarray(y)
+    splits = list(RepeatedStratifiedKFold(n_splits=n_splits, n_repeats=n_repeats,
+                                          random_state=seed).split(X, y))
+    oof = np.full((n_repeats, len(y)), np.nan)
+    processes = processes or os.cpu_count() or 1
+    nthread = max(1, (os.cpu_count() or 1) // processes)
+    if processes == 1:
+        for i, (tr, va) in enumerate(splits):
+            oof[i // n_splits, va] = _fit_predict_fold(X, y, tr, va, params, nthread)
+        return oof
+    with ProcessPoolExecutor(max_workers=processes, mp_context=mp.get_context("spawn")) as pool:
+        futures = {
+            pool.submit(_fit_predict_fold, X, y, tr, va, params, nthread): (i, va)
+            for i, (tr, va) in enumerate(splits)
+        }
+        for future in as_completed(futures):
+            i, va = futures[future]
+            oof[i // n_splits, va] = future.result()
+    return oof
@@ -1,141 +1,929 @@
 # inference.py  (only showing the edited functions)
 
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 import os
 import io
 import json
-import boto3
-import joblib
+import hashlib
+import atexit
 import pandas as pd
 import numpy as np
 import logging
+import tempfile
+import weakref
+import xgboost as xgb
+
+from compiled_trees import CompiledEnsemble, check_parity, compile_model
+from decision_threshold import load_threshold
+from drift_monitor import DriftMonitor, DriftReference
+from log_pipeline import LogPipeline, sink_from_env
+from metrics import Metrics, MetricsAggregator, SnapshotWriter, start_metrics_server
+from microbatch import MicroBatcher
+from prediction_cache import PredictionCache
+from preprocessing import FEATURE_COLS, OUTLIER_COLS, PREPROCESSOR_FILENAME, Preprocessor
+
+# xgboost dominates this (it imports pandas, scikit-learn and joblib itself);
+# boto3 is only imported when a log segment is shipped to S3 and joblib only
+# when a pickled model.joblib is loaded.
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
 
 logger = logging.getLogger("inference_logger")
 logger.setLevel(logging.INFO)
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
-
-file_handler = logging.FileHandler("inference_log.txt")
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-
-LOG_S3_BUCKET = os.environ.get("LOG_S3_BUCKET", None)
-LOG_S3_PREFIX = os.environ.get("LOG_S3_PREFIX", "logs/inference_logs/")
+# Logging never blocks the request path: records go through a queue to a
+# listener thread that writes inference_log.<pid>.txt in size/time-rotated segments;
+# closed segments are gzipped and shipped to LOG_SINK_DIR or
+# s3://LOG_S3_BUCKET/LOG_S3_PREFIX in the background (see log_pipeline.py).
+LOG_FILE = os.environ.get("LOG_FILE", "inference_log.txt")
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_ROTATE_SECONDS = int(os.environ.get("LOG_ROTATE_SECONDS", "3600"))
+LOG_PIPELINE = LogPipeline(logger, LOG_FILE, formatter, sink=sink_from_env(),
+                           max_bytes=LOG_MAX_BYTES, max_seconds=LOG_ROTATE_SECONDS)
+atexit.register(LOG_PIPELINE.stop)
 
 
 def upload_log_to_s3():
-    if not LOG_S3_BUCKET:
-        return
+    """
+    Close the current log segment and ship it (and anything still pending)
+    to the configured sink. Blocking; meant for the CLI at exit.
+    """
     try:
-        s3_client = boto3.client("s3")
-        with open("inference_log.txt", "r") as f:
-            log_contents = f.read()
-        import time
-        log_key = LOG_S3_PREFIX + "inference_log_" + time.strftime("%Y%m%d-%H%M%S") + ".txt"
-        s3_client.put_object(Bucket=LOG_S3_BUCKET, Key=log_key, Body=log_contents)
-        logger.info("Uploaded log file to s3://%s/%s", LOG_S3_BUCKET, log_key)
+        LOG_PIPELINE.flush()
     except Exception as e:
-        logger.error("Failed to upload log file to S3: %s", e)
+        logger.error("Failed to ship log segments: %s", e)
+
+
+# Native booster files are preferred over the pickled sklearn wrapper.
+# MODEL_FILENAME pins one file. Workers share the loaded trees by being forked
+# after model_fn (serve.py), not through the file.
+NATIVE_MODEL_FILENAMES = ("model.ubj", "model.json", "model.xgb")
+MODEL_FILENAME = os.environ.get("MODEL_FILENAME")
+
+# COMPILED_TREES=1 also compiles every loaded model into flat NumPy arrays
+# (compiled_trees.py) and scores batches of up to COMPILED_TREES_MAX_ROWS rows
+# with them instead of the XGBoost runtime; larger batches and explanations
+# still use the booster. tree_benchmark.py measures the crossover on a host.
+# model_fn checks every compiled model against its booster first (check_parity)
+# and serves a target that differs by more than COMPILED_TREES_TOLERANCE with
+# the booster only, logging an error.
+COMPILED_TREES = os.environ.get("COMPILED_TREES", "0").lower() in ("1", "true", "yes")
+COMPILED_TREES_MAX_ROWS = int(os.environ.get("COMPILED_TREES_MAX_ROWS", "1000"))
+COMPILED_TREES_TOLERANCE = float(os.environ.get("COMPILED_TREES_TOLERANCE", "1e-5"))
+
+# Multi-model registry: the artifact at the root of model_dir is served as
+# DEFAULT_TARGET; every sub-directory holding a model file (e.g. model_dir/dialysis/)
+# is served under its directory name. train.py --extra-targets (as run by
+# build_train_deploy.py) trains them into model.tar.gz that way, and the local
+# model/dialysis links to ../dialysis_model/model_artifact. MODEL_TARGET_DIRS
+# adds explicit entries, e.g. "dialysis=../dialysis_model/model_artifact".
+DEFAULT_TARGET = os.environ.get("DEFAULT_TARGET", "aki")
+MODEL_TARGET_DIRS = os.environ.get("MODEL_TARGET_DIRS", "")
+
+# Optional micro-batching of concurrent default-target requests (see microbatch.py).
+MICROBATCH = os.environ.get("MICROBATCH", "0").lower() in ("1", "true", "yes")
+MICROBATCH_MAX_ROWS = int(os.environ.get("MICROBATCH_MAX_ROWS", "64"))
+MICROBATCH_MAX_WAIT_MS = float(os.environ.get("MICROBATCH_MAX_WAIT_MS", "2"))
+MICROBATCHER = None
+_MICROBATCHED_REGISTRY = None
+
+# Per-row prediction cache for repeat patient vectors (see prediction_cache.py).
+# Only small requests (up to FAST_PATH_MAX_ROWS rows) go through it: batch and
+# streaming jobs rarely repeat a row and would only churn it.
+# PREDICTION_CACHE_MB=0 disables it; it is cleared whenever model_fn loads a
+# different artifact.
+PREDICTION_CACHE_MB = float(os.environ.get("PREDICTION_CACHE_MB", "16"))
+PREDICTION_CACHE = PredictionCache(
+    max_bytes=int(PREDICTION_CACHE_MB * 1024 * 1024),
+    ttl_seconds=float(os.environ.get("PREDICTION_CACHE_TTL_SECONDS", "300")),
+    sig_digits=int(os.environ.get("PREDICTION_CACHE_SIG_DIGITS", "6")),
+) if PREDICTION_CACHE_MB > 0 else None
+
+# Per-stage timers and row counters (see metrics.py). METRICS_PORT serves them
+# locally as /metrics (Prometheus text) and /metrics.json. Processes that do
+# not serve the port (pre-forked workers, or any process that finds it taken)
+# write their snapshot to METRICS_DIR every METRICS_SNAPSHOT_SECONDS, and the
+# serving process merges them; by default the directory is keyed by the port.
+METRICS = Metrics()
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_DIR = os.environ.get("METRICS_DIR") or os.path.join(
+    tempfile.gettempdir(), f"inference-metrics-{METRICS_PORT}")
+METRICS_SNAPSHOT_SECONDS = float(os.environ.get("METRICS_SNAPSHOT_SECONDS", "2"))
+_METRICS_SERVER = None
+_METRICS_WRITER = None
+
+# Per-row explanations ({"explain": true | k | "all"} in the JSON request):
+# TreeSHAP contributions from the booster's pred_contribs, in log-odds.
+# EXPLAIN_TOP_K is the k used for "explain": true; EXPLAIN_APPROX=1 switches
+# to the cheaper approximate (Saabas) contributions.
+EXPLAIN_TOP_K = int(os.environ.get("EXPLAIN_TOP_K", "3"))
+EXPLAIN_APPROX = os.environ.get("EXPLAIN_APPROX", "0").lower() in ("1", "true", "yes")
+
+# Fitted preprocessing statistics; replaced by model_fn with the preprocessor.json
+# saved next to the model. The unfitted default only scales/transforms.
+PREPROCESSOR = Preprocessor()
+
+# Input drift (see drift_monitor.py): with a drift_reference.json next to the
+# model, every scored row is binned into per-feature histograms (fixed memory,
+# no raw values kept); every DRIFT_WINDOW_ROWS rows -- or DRIFT_WINDOW_SECONDS
+# once DRIFT_MIN_ROWS arrived -- they are compared with the training reference
+# (PSI / KS), logged, and exported as the "drift" collector. DRIFT_MONITOR=0 disables it.
+DRIFT_MONITORING = os.environ.get("DRIFT_MONITOR", "1").lower() in ("1", "true", "yes")
+DRIFT_WINDOW_ROWS = int(os.environ.get("DRIFT_WINDOW_ROWS", "1000"))
+DRIFT_WINDOW_SECONDS = float(os.environ.get("DRIFT_WINDOW_SECONDS", "300"))
+DRIFT_MIN_ROWS = int(os.environ.get("DRIFT_MIN_ROWS", "100"))
+DRIFT_PSI_ALERT = float(os.environ.get("DRIFT_PSI_ALERT", "0.2"))
+DRIFT_MONITOR = None
+
+# Startup: model_fn ends with warmup(), which pushes WARMUP_ROWS synthetic rows
+# through input_fn -> predict_fn -> output_fn so the first real request after a
+# scale-out does not pay for first-call setup; MODEL_WARMUP=0 skips it.
+# Import, load and warmup times are logged and exported as the "startup" collector.
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "1").lower() in ("1", "true", "yes")
+WARMUP_ROWS = int(os.environ.get("WARMUP_ROWS", "256"))
+STARTUP = {"import_seconds": IMPORT_SECONDS}
+
+
+# ----------------------------
+# Single-record / small-batch fast path
+# ----------------------------
+# The mobile screens send one JSON object carrying exactly the 12 model
+# features. For those requests we skip pandas entirely: the records are
+# written into a preallocated matrix in FEATURE_COLS order, scaled and
+# log1p/sqrt-transformed in one vectorized step, and scored with a single
+# booster call. The transforms run in float64 (like pandas) and the result is
+# cast to float32 only after the transforms, so split decisions match the
+# DataFrame path exactly.
+_FEATURE_SET = frozenset(FEATURE_COLS)
+
+FAST_PATH_MAX_ROWS = int(os.environ.get("FAST_PATH_MAX_ROWS", "64"))
+
+
+def _to_float(v):
+    # mirrors pd.to_numeric(errors="coerce"): anything unparseable becomes NaN
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return np.nan
 
 
-def scale_and_transform(df: pd.DataFrame) -> pd.DataFrame:
+def is_fast_path_payload(records) -> bool:
     """
-    1) Divide certain lab features by scaling factors
-    2) (Optional) Impute missing values, but only if grouping keys are there
-    3) Apply log1p or sqrt transforms to numeric columns
+    True if the payload is a small list of dicts that only carry model features
+    (no grouping keys to impute by, no extra outlier columns).
     """
-    df = df.copy()
+    if len(records) > FAST_PATH_MAX_ROWS:
+        return False
+    return all(isinstance(r, dict) and r.keys() <= _FEATURE_SET for r in records)
+
+
+def records_to_matrix(records) -> np.ndarray:
+    """
+    Write a list of feature dicts into a preallocated matrix
+    (rows x FEATURE_COLS). Missing or unparseable values become NaN.
+    """
+    X = np.empty((len(records), len(FEATURE_COLS)))
+    for i, rec in enumerate(records):
+        row = X[i]
+        for j, col in enumerate(FEATURE_COLS):
+            row[j] = _to_float(rec.get(col))
+    return X
+
+
+def _preprocess(raw, started):
+    """
+    Preprocess a raw matrix or DataFrame, recording the deserialize time
+    (since `started`), the preprocess time, rows outside the training outlier
+    bounds (scored all the same) and missing_feature_columns: per row, the
+    FEATURE_COLS the request left out or sent empty, summed over the rows.
+    """
+    t = time.perf_counter()
+    METRICS.observe("deserialize", t - started)
+    if isinstance(raw, np.ndarray):
+        missing_cols = int(np.isnan(raw).sum())
+        X = PREPROCESSOR.transform_matrix(np.array(raw, dtype=np.float64))
+        out_of_bounds = int(PREPROCESSOR.out_of_bounds(X).sum())
+        data = X.astype(np.float32)
+    else:
+        missing_cols = int(raw.reindex(columns=FEATURE_COLS).isna().to_numpy().sum())
+        data = preprocess_frame(raw)
+        columns = [c for c in OUTLIER_COLS if c in data.columns]
+        out_of_bounds = int(PREPROCESSOR.out_of_bounds(
+            data[columns].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64), columns).sum())
+    METRICS.observe("preprocess", time.perf_counter() - t,
+                    rows_received=len(raw),
+                    rows_out_of_bounds=out_of_bounds,
+                    missing_feature_columns=missing_cols)
+    return data
+
+
+def preprocess_matrix(X_raw: np.ndarray) -> np.ndarray:
+    """
+    Raw FEATURE_COLS matrix -> float32 model input: transform a float64 working
+    copy, cast once. Every row is kept: the outlier bounds only filter training data.
+    """
+    X = np.array(X_raw, dtype=np.float64)
+    PREPROCESSOR.transform_matrix(X)
+    return X.astype(np.float32)
+
+
+def preprocess_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Raw DataFrame -> scaled / imputed / log-sqrt DataFrame, every row kept."""
+    return PREPROCESSOR.transform(df)
+
+
+# ----------------------------
+# Binary request / response formats
+# ----------------------------
+# Batch callers can skip text parsing entirely. Every request matrix holds the
+# raw FEATURE_COLS values, one row per patient, in FEATURE_COLS order.
+#   application/x-npy                     a .npy file (float32/float64, rows x 12)
+#   application/x-float32-matrix          b"F32M" + uint32 rows + uint32 cols
+#                                         (little-endian), then rows*cols float32 LE
+#   application/vnd.apache.arrow.stream   Arrow IPC stream with the feature columns
+# The same types are accepted as Accept: .npy returns a structured array with
+# one named field per prediction column, F32M a float32 matrix with the columns
+# in response order, Arrow a record batch with the named columns.
+NPY_CONTENT_TYPE = "application/x-npy"
+F32_CONTENT_TYPE = "application/x-float32-matrix"
+ARROW_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+BINARY_CONTENT_TYPES = (NPY_CONTENT_TYPE, F32_CONTENT_TYPE, ARROW_CONTENT_TYPE)
+_F32_MAGIC = b"F32M"
+_F32_HEADER = np.dtype([("magic", "S4"), ("rows", "<u4"), ("cols", "<u4")])
+
+
+def _decode_binary(body, content_type):
+    """
+    Decode a binary request body without copying it (np.frombuffer / Arrow
+    buffers); returns the raw matrix, or a DataFrame for Arrow tables that
+    carry more than the model features.
+    """
+    if content_type == NPY_CONTENT_TYPE:
+        X = np.load(io.BytesIO(body), allow_pickle=False)
+    elif content_type == F32_CONTENT_TYPE:
+        header = np.frombuffer(body, dtype=_F32_HEADER, count=1)[0]
+        if header["magic"] != _F32_MAGIC:
+            raise ValueError("Bad float32 matrix header")
+        rows, cols = int(header["rows"]), int(header["cols"])
+        X = np.frombuffer(body, dtype="<f4", count=rows * cols,
+                          offset=_F32_HEADER.itemsize).reshape(rows, cols)
+    else:
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ValueError(f"{ARROW_CONTENT_TYPE} needs pyarrow installed")
+        table = pa.ipc.open_stream(body).read_all()
+        if not set(table.column_names) <= _FEATURE_SET:
+            return table.to_pandas()
+        X = np.column_stack([
+            table.column(c).to_numpy(zero_copy_only=False) if c in table.column_names
+            else np.full(table.num_rows, np.nan)
+            for c in FEATURE_COLS
+        ]) if table.num_rows else np.empty((0, len(FEATURE_COLS)))
+    if X.ndim != 2 or X.shape[1] != len(FEATURE_COLS):
+        raise ValueError(f"Expected a rows x {len(FEATURE_COLS)} matrix in FEATURE_COLS order, got {X.shape}")
+    return X
+
 
-    # 1a) scaling factors
-    scaling_factors = {
-        "Procalcitonin": 1000.0,
-        "White Blood Cell Count": 10.0,
-        "Creatinine": 88.4,
-        "Urea": 2.14,
-        "Bilirubin": 17.1,
-        "Albumin": 10.0
+def _encode_binary(columns: dict, accept):
+    if accept == NPY_CONTENT_TYPE:
+        names = list(columns)
+        rows = len(columns[names[0]]) if names else 0
+        out = np.empty(rows, dtype=[(n, columns[n].dtype) for n in names])
+        for n in names:
+            out[n] = columns[n]
+        buffer = io.BytesIO()
+        np.save(buffer, out, allow_pickle=False)
+        return buffer.getvalue()
+    elif accept == F32_CONTENT_TYPE:
+        if any(v.dtype.kind in "US" for v in columns.values()):
+            raise ValueError(f"{F32_CONTENT_TYPE} cannot carry feature names; "
+                             f'use "explain": "all" or another Accept type')
+        M = np.column_stack([np.asarray(v, dtype="<f4") for v in columns.values()]) \
+            if columns else np.empty((0, 0), dtype="<f4")
+        header = np.array([(_F32_MAGIC, M.shape[0], M.shape[1])], dtype=_F32_HEADER)
+        return header.tobytes() + np.ascontiguousarray(M, dtype="<f4").tobytes()
+    else:
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ValueError(f"Unsupported accept type: {ARROW_CONTENT_TYPE} needs pyarrow installed")
+        batch = pa.record_batch([pa.array(v) for v in columns.values()], names=list(columns))
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, batch.schema) as writer:
+            writer.write_batch(batch)
+        return sink.getvalue().to_pybytes()
+
+
+def get_booster(model):
+    """
+    Return the raw xgboost Booster behind `model` (an XGBClassifier or a Booster).
+    """
+    return model.get_booster() if hasattr(model, "get_booster") else model
+
+
+def predict_matrix(X: np.ndarray, model, threshold=None) -> dict:
+    """
+    Score a transformed FEATURE_COLS matrix with one booster call (or a
+    CompiledEnsemble).
+    The class is derived from the probability: proba >= threshold (the tuned
+    threshold.json saved with the model), or XGBClassifier.predict's > 0.5 rule
+    when there is none.
+    """
+    if isinstance(model, CompiledEnsemble):
+        proba = model.predict_proba(X)
+    else:
+        proba = get_booster(model).inplace_predict(X)
+    predicted = proba > 0.5 if threshold is None else proba >= threshold
+    return {
+        "PredictedClass": predicted.astype(np.int64),
+        "PredictedProba": proba
     }
-    for col, factor in scaling_factors.items():
-        if col in df.columns:
-            # coerce to numeric just in case someone passed strings
-            df[col] = pd.to_numeric(df[col], errors="coerce") / factor
-
-    # 1b) per‐column median‐impute only if the grouping keys exist
-    desired_impute_cols = ["Respiratory Rate", "Albumin", "Bilirubin", "Procalcitonin", "HCO3"]
-    impute_cols = [c for c in desired_impute_cols if c in df.columns]
-
-    # decide group keys
-    if "Outcome of acute kidney injury" in df.columns:
-        group_cols = ["Gender", "Hypertension", "Outcome of acute kidney injury"]
+
+
+# ----------------------------
+# Explanations
+# ----------------------------
+# One pred_contribs call per batch gives every row's feature contributions plus
+# the bias column; their sum is the row's log-odds (up to float rounding). The
+# probability and class still come from predict_matrix, so a row scores the
+# same with or without "explain".
+_FEATURE_NAMES = np.array(FEATURE_COLS)
+_EXPECTED_VALUES = weakref.WeakKeyDictionary()   # booster -> expected log-odds
+
+
+def expected_value(booster) -> float:
+    """
+    The model's expected log-odds (the TreeSHAP bias term, identical for every
+    row); computed once per booster.
+    """
+    value = _EXPECTED_VALUES.get(booster)
+    if value is None:
+        row = np.full((1, len(FEATURE_COLS)), np.nan, dtype=np.float32)
+        value = float(booster.predict(xgb.DMatrix(row), pred_contribs=True,
+                                      validate_features=False)[0, -1])
+        _EXPECTED_VALUES[booster] = value
+    return value
+
+
+def parse_explain(value):
+    """Normalize the request's "explain" option to None, a top-k int or "all"."""
+    if value is None or value is False:
+        return None
+    if value is True:
+        return EXPLAIN_TOP_K
+    if value == "all":
+        return "all"
+    if isinstance(value, int) and value > 0:
+        return value
+    raise ValueError(f'"explain" must be true, a positive integer or "all", got {value!r}')
+
+
+def explain_matrix(X: np.ndarray, model, explain=EXPLAIN_TOP_K, threshold=None, scorer=None) -> dict:
+    """
+    predict_matrix's columns plus per-row explanations, for the whole batch at once:
+    ExpectedValue (log-odds), then Top<i>Feature / Top<i>Contribution ordered by
+    absolute contribution, or one Contribution_<feature> column per feature
+    when explain == "all". The columns are scored with scorer (what the request
+    would be scored with unexplained, e.g. ModelRegistry.scorer's compiled
+    trees; default: model) and the contributions come from model's booster.
+    """
+    booster = get_booster(model)
+    contribs = booster.predict(
+        xgb.DMatrix(X), pred_contribs=True, approx_contribs=EXPLAIN_APPROX,
+        validate_features=False
+    ).reshape(len(X), len(FEATURE_COLS) + 1)
+    out = predict_matrix(X, booster if scorer is None else scorer, threshold)
+    out["ExpectedValue"] = np.full(len(X), expected_value(booster), dtype=np.float32)
+    features = contribs[:, :-1]
+    if explain == "all":
+        for j, name in enumerate(FEATURE_COLS):
+            out[f"Contribution_{name}"] = features[:, j]
+        return out
+    k = min(explain, len(FEATURE_COLS))
+    order = np.argsort(-np.abs(features), axis=1, kind="stable")[:, :k]
+    names = _FEATURE_NAMES[order]
+    values = np.take_along_axis(features, order, axis=1)
+    for i in range(k):
+        out[f"Top{i + 1}Feature"] = names[:, i]
+        out[f"Top{i + 1}Contribution"] = values[:, i]
+    return out
+
+
+# ----------------------------
+# What-if sweeps
+# ----------------------------
+# {"sweep": {"Creatinine": {"start": 50, "stop": 500, "num": 50}, "SOFA": [0, 2, 4, 6]},
+#  "instances": {...one patient...}} varies one or two features of a base patient
+# (raw units, like any request; a list of values or an evenly spaced range) and
+# answers with the whole risk curve / surface. Every grid point is a row of one
+# broadcasted matrix that is transformed and scored in a single call. "InRange"
+# flags the points inside the training data's outlier bounds (all are scored).
+SWEEP_MAX_FEATURES = 2
+SWEEP_DEFAULT_NUM = int(os.environ.get("SWEEP_DEFAULT_NUM", "20"))
+SWEEP_MAX_ROWS = int(os.environ.get("SWEEP_MAX_ROWS", "10000"))
+
+
+class Sweep:
+    """A base patient (raw FEATURE_COLS row) and the values of each swept feature."""
+
+    def __init__(self, base: np.ndarray, axes: dict):
+        self.base = base
+        self.axes = axes
+
+    @property
+    def shape(self) -> tuple:
+        return tuple(len(v) for v in self.axes.values())
+
+    def matrix(self) -> np.ndarray:
+        """The raw grid, one row per point (C order over the axes)."""
+        shape = self.shape
+        X = np.broadcast_to(self.base, shape + (len(FEATURE_COLS),)).copy()
+        for axis, (feature, values) in enumerate(self.axes.items()):
+            index = [None] * len(shape)
+            index[axis] = slice(None)
+            X[..., FEATURE_COLS.index(feature)] = values[tuple(index)]
+        return X.reshape(-1, len(FEATURE_COLS))
+
+
+class SweepResult:
+    def __init__(self, axes: dict, in_range: np.ndarray, columns: dict):
+        self.axes = axes
+        self.in_range = in_range
+        self.columns = columns
+
+    def to_dict(self) -> dict:
+        """{"axes": {feature: values}, "InRange": grid, <prediction column>: grid, ...}"""
+        shape = tuple(len(v) for v in self.axes.values())
+        out = {
+            "axes": {f: _json_values(v) for f, v in self.axes.items()},
+            "InRange": self.in_range.reshape(shape).tolist(),
+        }
+        for name, values in self.columns.items():
+            out[name] = _json_values(values.reshape(shape))
+        return out
+
+
+def _sweep_num(feature, spec) -> int:
+    """How many values spec asks for, checked before any of them is built."""
+    if isinstance(spec, list):
+        return len(spec)
+    if not isinstance(spec, dict):
+        raise ValueError(f"Sweep values for {feature!r} must be a list or a start/stop/num range")
+    try:
+        num = int(spec.get("num", SWEEP_DEFAULT_NUM))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f'Sweep "num" for {feature!r} must be an integer, got {spec.get("num")!r}')
+    if not 1 <= num <= SWEEP_MAX_ROWS:
+        raise ValueError(f'Sweep "num" for {feature!r} must be between 1 and {SWEEP_MAX_ROWS}, got {num}')
+    return num
+
+
+def _sweep_values(feature, spec, num) -> np.ndarray:
+    if isinstance(spec, dict):
+        try:
+            values = np.linspace(float(spec["start"]), float(spec["stop"]), num)
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f'Sweep range for {feature!r} needs numeric "start", "stop" '
+                             f'and optionally "num", got {spec!r}')
     else:
-        group_cols = ["Gender", "Hypertension"]
-
-    # only do median‐impute if all grouping columns are present
-    if impute_cols and all((g in df.columns) for g in group_cols):
-        for col in impute_cols:
-            # coerce to numeric before taking medians
-            df[col] = pd.to_numeric(df[col], errors="coerce")
-            medians = df.groupby(group_cols)[col].transform("median")
-            df[col] = df[col].fillna(medians)
-
-    # 1c) log1p and sqrt transforms—only on numeric columns
-    log_transform_cols  = ["Procalcitonin", "Creatinine", "Urea", "Lactate", "HCO3", "Mean Arterial Pressure"]
-    sqrt_transform_cols = ["White Blood Cell Count", "APACHEII", "SOFA"]
-
-    # For any column in log_transform_cols that actually exists, coerce to numeric first:
-    for col in log_transform_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce")
-            df[col] = np.log1p(df[col].clip(lower=0))
-
-    for col in sqrt_transform_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce")
-            df[col] = np.sqrt(df[col].clip(lower=0))
-
-    return df
-
-
-def remove_outliers(df: pd.DataFrame) -> pd.DataFrame:
-    df_clean = df.copy()
-    cols = [
-        "Mechanical Ventilation",
-        "Procalcitonin",
-        "Creatinine",
-        "Bilirubin",
-        "White Blood Cell Count"
-    ]
-    for col in cols:
-        if col not in df_clean.columns:
-            continue
-        # coerce to numeric just in case
-        df_clean[col] = pd.to_numeric(df_clean[col], errors="coerce")
-        q1 = df_clean[col].quantile(0.25)
-        q3 = df_clean[col].quantile(0.75)
-        iqr = q3 - q1
-        lower = q1 - 2.5 * iqr
-        upper = q3 + 2.5 * iqr
-        df_clean = df_clean[(df_clean[col] >= lower) & (df_clean[col] <= upper)]
-    return df_clean
+        values = np.array([_to_float(v) for v in spec])
+    if not len(values) or np.isnan(values).any():
+        raise ValueError(f"Sweep values for {feature!r} must be non-empty and numeric")
+    return values
+
+
+def parse_sweep(spec, base) -> Sweep:
+    """Validate a request's "sweep" option and its base patient."""
+    if not isinstance(spec, dict) or not 1 <= len(spec) <= SWEEP_MAX_FEATURES:
+        raise ValueError(f'"sweep" must map 1 to {SWEEP_MAX_FEATURES} features to their values')
+    unknown = [f for f in spec if f not in _FEATURE_SET]
+    if unknown:
+        raise ValueError(f"Cannot sweep {unknown}: not model features ({FEATURE_COLS})")
+    # the grid size is known from the specs alone, so it is bounded before anything is allocated
+    nums = {feature: _sweep_num(feature, values) for feature, values in spec.items()}
+    rows = 1
+    for num in nums.values():
+        rows *= num
+    if rows > SWEEP_MAX_ROWS:
+        raise ValueError(f"Sweep of {rows} points exceeds SWEEP_MAX_ROWS={SWEEP_MAX_ROWS}")
+    axes = {feature: _sweep_values(feature, values, nums[feature]) for feature, values in spec.items()}
+    if isinstance(base, list) and len(base) == 1:
+        base = base[0]
+    if not isinstance(base, dict):
+        raise ValueError("A sweep needs exactly one base patient")
+    return Sweep(records_to_matrix([base])[0], axes)
+
+
+def predict_sweep(sweep: Sweep, model, targets=None) -> SweepResult:
+    """Transform and score every grid point of sweep in one call."""
+    t = time.perf_counter()
+    X = sweep.matrix()
+    PREPROCESSOR.transform_matrix(X)
+    in_range = ~PREPROCESSOR.out_of_bounds(X)
+    X = X.astype(np.float32)
+    METRICS.observe("preprocess", time.perf_counter() - t, rows_received=len(X),
+                    rows_out_of_bounds=int(len(X) - in_range.sum()))
+    if targets is not None:
+        registry = model if isinstance(model, ModelRegistry) else ModelRegistry({DEFAULT_TARGET: model})
+        columns = registry.predict(X, targets)
+    elif isinstance(model, ModelRegistry):
+        target = model.default_target
+        columns = predict_matrix(X, model.scorer(target, len(X)), model.thresholds.get(target))
+    else:
+        columns = predict_matrix(X, model)
+    return SweepResult(sweep.axes, in_range, columns)
+
+
+# ----------------------------
+# Patient trajectories
+# ----------------------------
+# {"trajectory": {"patient_id": "P-17", "updates": [
+#     {"time": "2026-01-02T08:00", "Creatinine": 1.1, "Urea": 38, ...},
+#     {"time": "2026-01-02T14:00", "Creatinine": 1.6}, ...]}}
+# scores a patient's history for the risk-over-time chart in one call. Each
+# update carries only what was measured (raw units); every other feature keeps
+# its last value (carried forward, null counts as not measured), so point i is
+# the patient as known at time i. The whole timeline is one matrix: forward-
+# filled, transformed and scored together. Each point gets the prediction
+# columns plus "<...>PredictedProbaDelta", the change since the previous point,
+# and "InRange" (inside the training data's outlier bounds; all points are scored).
+# Trajectories are re-sent whenever a chart is drawn, so they are not counted
+# by the drift monitor or cached.
+TRAJECTORY_MAX_POINTS = int(os.environ.get("TRAJECTORY_MAX_POINTS", "1000"))
+TRAJECTORY_TIME_KEY = "time"
+_FEATURE_INDEX = {name: j for j, name in enumerate(FEATURE_COLS)}
+
+
+class Trajectory:
+    """A patient's update times and the carried-forward raw FEATURE_COLS row at each."""
+
+    def __init__(self, patient_id, times: list, X: np.ndarray):
+        self.patient_id = patient_id
+        self.times = times
+        self.X = X
+
+
+class TrajectoryResult:
+    def __init__(self, patient_id, times: list, in_range: np.ndarray, columns: dict):
+        self.patient_id = patient_id
+        self.times = times
+        self.in_range = in_range
+        self.columns = columns
+
+    def to_dict(self) -> dict:
+        """{"patient_id": ..., "points": [{"time": ..., "InRange": ..., <column>: ...}, ...]}"""
+        out = {TRAJECTORY_TIME_KEY: self.times, "InRange": self.in_range.tolist()}
+        for name, values in self.columns.items():
+            out[name] = _json_values(values)
+        names = list(out)
+        points = [dict(zip(names, row)) for row in zip(*out.values())]
+        return {"patient_id": self.patient_id, "points": points}
+
+
+def forward_fill(X: np.ndarray) -> np.ndarray:
+    """Replace each NaN with the last non-NaN value above it in its column (leading NaNs stay)."""
+    rows = np.where(np.isnan(X), 0, np.arange(len(X))[:, None])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return X[rows, np.arange(X.shape[1])]
+
+
+def parse_trajectory(spec) -> Trajectory:
+    """Validate a request's "trajectory" and build its carried-forward raw matrix."""
+    if not isinstance(spec, dict) or not isinstance(spec.get("updates"), list):
+        raise ValueError('"trajectory" must be {"patient_id": ..., "updates": [...]}')
+    updates = spec["updates"]
+    if not 1 <= len(updates) <= TRAJECTORY_MAX_POINTS:
+        raise ValueError(f"A trajectory needs 1 to TRAJECTORY_MAX_POINTS={TRAJECTORY_MAX_POINTS} updates, "
+                         f"got {len(updates)}")
+    # updates are sparse, so only the values they carry are written (the rest stays NaN)
+    X = np.full((len(updates), len(FEATURE_COLS)), np.nan)
+    for i, update in enumerate(updates):
+        if not isinstance(update, dict) or update.get(TRAJECTORY_TIME_KEY) is None:
+            raise ValueError(f'Trajectory update {i} must be an object with a "{TRAJECTORY_TIME_KEY}"')
+        row = X[i]
+        for name, value in update.items():
+            j = _FEATURE_INDEX.get(name)
+            if j is not None:
+                row[j] = _to_float(value)
+            elif name != TRAJECTORY_TIME_KEY:
+                raise ValueError(f"Trajectory update {i} has {name!r}: not a model feature ({FEATURE_COLS})")
+    times = [update[TRAJECTORY_TIME_KEY] for update in updates]
+    try:
+        ordered = all(a <= b for a, b in zip(times, times[1:]))
+    except TypeError:
+        raise ValueError(f'Trajectory "{TRAJECTORY_TIME_KEY}" values must be all numbers or all ISO-8601 strings')
+    if not ordered:
+        raise ValueError(f'Trajectory updates must be in "{TRAJECTORY_TIME_KEY}" order')
+    return Trajectory(spec.get("patient_id"), times, forward_fill(X))
+
+
+def predict_trajectory(trajectory: Trajectory, model, targets=None, explain=None) -> TrajectoryResult:
+    """Transform and score every point of trajectory in one call, with deltas between points."""
+    t = time.perf_counter()
+    X = trajectory.X.copy()
+    PREPROCESSOR.transform_matrix(X)
+    in_range = ~PREPROCESSOR.out_of_bounds(X)
+    X = X.astype(np.float32)
+    METRICS.observe("preprocess", time.perf_counter() - t, rows_received=len(X),
+                    rows_out_of_bounds=int(len(X) - in_range.sum()))
+    columns = _score(X, model, targets, explain)
+    for name in [c for c in columns if c.endswith("PredictedProba")]:
+        delta = np.empty(len(X), dtype=object)
+        delta[0] = None
+        delta[1:] = np.diff(columns[name].astype(np.float64)).tolist()
+        columns[f"{name}Delta"] = delta
+    return TrajectoryResult(trajectory.patient_id, trajectory.times, in_range, columns)
 
 
 # ----------------------------
 # Required SageMaker entry‐point functions
 # ----------------------------
-def model_fn(model_dir):
+def find_model_file(model_dir):
+    """
+    Pick the artifact to load: MODEL_FILENAME if set, otherwise the first native
+    booster file present, otherwise model.joblib.
+    """
+    if MODEL_FILENAME:
+        return os.path.join(model_dir, MODEL_FILENAME)
+    for name in NATIVE_MODEL_FILENAMES:
+        path = os.path.join(model_dir, name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(model_dir, "model.joblib")
+
+
+def load_booster(path):
+    """
+    Load a native XGBoost model file (JSON or UBJSON, detected from the content).
+    """
+    booster = xgb.Booster()
+    with open(path, "rb") as f:
+        booster.load_model(bytearray(f.read()))
+    return booster
+
+
+class ModelRegistry:
     """
-    Load the XGBClassifier that was saved in train.py (model.joblib).
+    Every served model keyed by target name ("aki", "dialysis", ...).
+    All models share FEATURE_COLS and the preprocessing, so one transformed
+    matrix is scored by each requested target.
     """
-    model_path = os.path.join(model_dir, "model.joblib")
+
+    def __init__(self, models: dict, default_target: str = DEFAULT_TARGET, versions: dict = None,
+                 thresholds: dict = None, compiled: dict = None):
+        self.models = models
+        self.default_target = default_target
+        # target -> artifact content hash; identifies what this registry serves
+        self.versions = versions or {}
+        # target -> decision threshold (missing: the 0.5 default)
+        self.thresholds = thresholds or {}
+        # target -> CompiledEnsemble (COMPILED_TREES)
+        self.compiled = compiled or {}
+
+    @property
+    def version(self) -> str:
+        return ",".join(
+            f"{t}:{self.versions.get(t, '?')}"
+            + (f"@{self.thresholds[t]:.6g}" if self.thresholds.get(t) is not None else "")
+            for t in sorted(self.models)
+        )
+
+    @property
+    def targets(self):
+        return list(self.models)
+
+    def __getitem__(self, target):
+        try:
+            return self.models[target]
+        except KeyError:
+            raise ValueError(f"Unknown target: {target} (available: {self.targets})")
+
+    def scorer(self, target, n_rows):
+        """What predict_matrix should use for n_rows of target: the compiled trees when small enough."""
+        compiled = self.compiled.get(target)
+        if compiled is not None and n_rows <= COMPILED_TREES_MAX_ROWS:
+            return compiled
+        return self[target]
+
+    def predict(self, X: np.ndarray, targets, explain=None) -> dict:
+        """
+        Score X with each target's model; columns are prefixed "<target>_".
+        With explain, each target's explanation columns are included (explain_matrix).
+        """
+        out = {}
+        for target in targets:
+            threshold = self.thresholds.get(target)
+            if explain is None:
+                cols = predict_matrix(X, self.scorer(target, len(X)), threshold)
+            else:
+                cols = explain_matrix(X, self[target], explain, threshold,
+                                      scorer=self.scorer(target, len(X)))
+            for col, values in cols.items():
+                out[f"{target}_{col}"] = values
+        return out
+
+
+def artifact_version(path) -> str:
+    """Short content hash of a model artifact."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+
+def load_model_artifact(model_dir):
+    """
+    Load one model: a native booster file (model.ubj / model.json / model.xgb)
+    if present, else the pickled XGBClassifier (model.joblib).
+    Returns (model, artifact content hash, decision threshold or None).
+    """
+    model_path = find_model_file(model_dir)
     try:
-        model = joblib.load(model_path)
-        logger.info("Loaded model from %s", model_path)
+        if model_path.endswith(".joblib"):
+            import joblib
+            model = joblib.load(model_path)
+        else:
+            model = load_booster(model_path)
+        version = artifact_version(model_path)
+        threshold = load_threshold(model_dir)
+        logger.info("Loaded model from %s (version %s, threshold %s)", model_path, version,
+                    "0.5 default" if threshold is None else f"{threshold:.4f}")
     except Exception as e:
         logger.error("Failed to load model: %s", e)
         raise
-    return model
+    return model, version, threshold
+
+
+def discover_model_dirs(model_dir) -> dict:
+    """
+    Map target name -> artifact directory (see MODEL_TARGET_DIRS above).
+    """
+    dirs = {DEFAULT_TARGET: model_dir}
+    for name in sorted(os.listdir(model_dir)):
+        sub = os.path.join(model_dir, name)
+        if os.path.isdir(sub) and os.path.exists(find_model_file(sub)):
+            dirs[name] = sub
+    for entry in filter(None, MODEL_TARGET_DIRS.split(",")):
+        target, _, path = entry.partition("=")
+        dirs[target.strip()] = path.strip()
+    return dirs
+
+
+def model_fn(model_dir):
+    """
+    Load every model artifact into a ModelRegistry (the model in model_dir is
+    DEFAULT_TARGET), plus the fitted preprocessor.json shared by all of them.
+    Requests are preprocessed once for every target, so a target directory
+    carrying a different preprocessor.json is refused (ValueError).
+    """
+    global PREPROCESSOR, MICROBATCHER, _MICROBATCHED_REGISTRY, _METRICS_SERVER, _METRICS_WRITER, DRIFT_MONITOR
+    started = time.perf_counter()
+    target_dirs = discover_model_dirs(model_dir)
+    loaded = {target: load_model_artifact(path) for target, path in target_dirs.items()}
+    registry = ModelRegistry(
+        {t: model for t, (model, _, _) in loaded.items()},
+        versions={t: version for t, (_, version, _) in loaded.items()},
+        thresholds={t: threshold for t, (_, _, threshold) in loaded.items()},
+    )
+    logger.info("Serving targets: %s", registry.targets)
+    if COMPILED_TREES:
+        for target, model in registry.models.items():
+            try:
+                compiled = compile_model(model)
+            except ValueError as e:
+                logger.warning("Not compiling %s: %s", target, e)
+                continue
+            diff = check_parity(compiled, get_booster(model))
+            if diff > COMPILED_TREES_TOLERANCE:
+                logger.error("Compiled trees for %s differ from XGBoost by up to %.2e (tolerance %.0e); "
+                             "serving it with the booster", target, diff, COMPILED_TREES_TOLERANCE)
+                continue
+            registry.compiled[target] = compiled
+        logger.info("Compiled trees for %s (batches up to %d rows)",
+                    sorted(registry.compiled), COMPILED_TREES_MAX_ROWS)
+    if PREDICTION_CACHE is not None:
+        PREDICTION_CACHE.set_version(registry.version)
+    if MICROBATCH:
+        default_target = registry.default_target
+        default_threshold = registry.thresholds.get(default_target)
+        MICROBATCHER = MicroBatcher(lambda X: predict_matrix(X, registry.scorer(default_target, len(X)),
+                                                             default_threshold),
+                                    max_batch_rows=MICROBATCH_MAX_ROWS,
+                                    max_wait_ms=MICROBATCH_MAX_WAIT_MS)
+        _MICROBATCHED_REGISTRY = registry
+        logger.info("Micro-batching up to %d rows / %.1f ms", MICROBATCH_MAX_ROWS, MICROBATCH_MAX_WAIT_MS)
+    try:
+        PREPROCESSOR = Preprocessor.load(model_dir)
+        logger.info("Loaded preprocessor from %s", model_dir)
+    except FileNotFoundError:
+        PREPROCESSOR = Preprocessor()
+        logger.warning("No preprocessor.json in %s; imputation and outlier bounds disabled", model_dir)
+    for target, path in target_dirs.items():
+        if os.path.abspath(path) == os.path.abspath(model_dir) \
+                or not os.path.exists(os.path.join(path, PREPROCESSOR_FILENAME)):
+            continue
+        if Preprocessor.load(path).to_dict() != PREPROCESSOR.to_dict():
+            raise ValueError(f"{path} ({target}) has its own {PREPROCESSOR_FILENAME}, different from "
+                             f"{model_dir}'s; every target is served with the one in {model_dir}")
+    if DRIFT_MONITORING:
+        try:
+            DRIFT_MONITOR = DriftMonitor(DriftReference.load(model_dir), DRIFT_WINDOW_ROWS,
+                                         DRIFT_WINDOW_SECONDS, DRIFT_MIN_ROWS, DRIFT_PSI_ALERT, logger)
+            METRICS.add_collector("drift", DRIFT_MONITOR.stats)
+        except (FileNotFoundError, ValueError) as e:
+            DRIFT_MONITOR = None
+            logger.warning("Input drift not monitored: %s (write one with "
+                           "python drift_monitor.py --input-csv <training csv> --model-dir %s)", e, model_dir)
+    if PREDICTION_CACHE is not None:
+        METRICS.add_collector("prediction_cache", PREDICTION_CACHE.stats)
+    if MICROBATCHER is not None:
+        METRICS.add_collector("microbatch", MICROBATCHER.stats)
+    METRICS.add_collector("startup", lambda: dict(STARTUP))
+    if METRICS_PORT and _METRICS_SERVER is None and _METRICS_WRITER is None:
+        try:
+            _METRICS_SERVER = start_metrics_server(
+                MetricsAggregator(METRICS, METRICS_DIR, clear=True), METRICS_PORT)
+            logger.info("Serving metrics on 127.0.0.1:%d/metrics", METRICS_PORT)
+        except OSError as e:
+            _METRICS_WRITER = SnapshotWriter(METRICS, METRICS_DIR, METRICS_SNAPSHOT_SECONDS)
+            logger.warning("Metrics port %d not available (%s); reporting through %s",
+                           METRICS_PORT, e, METRICS_DIR)
+    STARTUP["model_load_seconds"] = time.perf_counter() - started
+    STARTUP["warmup_seconds"] = warmup(registry) if MODEL_WARMUP else 0.0
+    logger.info("Startup: import %.3fs, model load %.3fs, warmup %.3fs",
+                STARTUP["import_seconds"], STARTUP["model_load_seconds"], STARTUP["warmup_seconds"])
+    return registry
+
+
+def warmup(model, rows=WARMUP_ROWS) -> float:
+    """
+    Score synthetic requests (Preprocessor.example_record) through input_fn ->
+    predict_fn -> output_fn: a single JSON record on the fast path, a CSV batch
+    of `rows` on the DataFrame path, and -- when several targets are served --
+    one request naming all of them. Metrics, the prediction cache and the
+    drift monitor are swapped out meanwhile and the micro-batcher's histograms
+    are reset afterwards, so nothing from the warmup is counted, cached or
+    taken for live traffic. Returns the seconds taken.
+    """
+    global METRICS, PREDICTION_CACHE, DRIFT_MONITOR
+    started = time.perf_counter()
+    record = PREPROCESSOR.example_record()
+    csv_body = "\n".join([",".join(FEATURE_COLS)] + [",".join(map(str, record.values()))] * rows) + "\n"
+    requests = [(json.dumps(record), "application/json"), (csv_body, "text/csv")]
+    if isinstance(model, ModelRegistry) and len(model.targets) > 1:
+        requests.append((json.dumps({"targets": model.targets, "instances": [record]}), "application/json"))
+
+    saved = METRICS, PREDICTION_CACHE, DRIFT_MONITOR
+    METRICS, PREDICTION_CACHE, DRIFT_MONITOR = Metrics(), None, None
+    try:
+        for body, content_type in requests:
+            output_fn(predict_fn(input_fn(body, content_type), model), "application/json")
+    finally:
+        METRICS, PREDICTION_CACHE, DRIFT_MONITOR = saved
+        if MICROBATCHER is not None:
+            MICROBATCHER.reset_stats()
+    return time.perf_counter() - started
+
+
+def after_fork():
+    """
+    Call in a worker forked after model_fn (serve.py): restart the background
+    threads the child does not inherit -- the log listener / shipper and the
+    micro-batcher. A METRICS_PORT server keeps running in the parent only; the
+    child starts from zero counts and writes them to METRICS_DIR for it.
+    """
+    global _METRICS_WRITER
+    LOG_PIPELINE.after_fork()
+    if MICROBATCHER is not None:
+        MICROBATCHER.after_fork()
+    if _METRICS_SERVER is not None or _METRICS_WRITER is not None:
+        METRICS.reset()
+        _METRICS_WRITER = SnapshotWriter(METRICS, METRICS_DIR, METRICS_SNAPSHOT_SECONDS)
+
+
+def stop_worker():
+    """Call when a worker stops: write its last metrics and ship its log."""
+    if _METRICS_WRITER is not None:
+        _METRICS_WRITER.stop()
+    LOG_PIPELINE.stop()
+
+
+REQUEST_OPTION_KEYS = ("targets", "explain", "sweep", "trajectory")
+
+
+def parse_targets(value):
+    """Normalize the request's "targets" option to None or a non-empty list of names."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not value or not all(isinstance(t, str) for t in value):
+        raise ValueError(f'"targets" must be a target name or a non-empty list of them, got {value!r}')
+    return value
 
 
 def input_fn(request_body, request_content_type):
@@ -143,31 +931,64 @@ def input_fn(request_body, request_content_type):
     - If ContentType == "application/json", parse JSON → DataFrame → preprocess.
     - If ContentType == "text/csv", read CSV → DataFrame → preprocess.
     """
+    started = time.perf_counter()
     if request_content_type in ("application/json", "json"):
         # 1) Decode bytes → string, then load JSON
         s = request_body.decode("utf-8") if isinstance(request_body, (bytes, bytearray)) else request_body
         payload = json.loads(s)
 
-        # 2) If payload is a single JSON object (dict), wrap it in a list. 
+        # 2) {"targets": [...], "explain": ..., "instances": [...]} (or the features
+        #    inline) asks for several models and/or explanations; the options are
+        #    returned with the data. With "sweep" the data is the Sweep grid,
+        #    with "trajectory" the patient's carried-forward timeline.
+        options = None
+        if isinstance(payload, dict) and any(k in payload for k in REQUEST_OPTION_KEYS):
+            payload = dict(payload)
+            options = {"targets": parse_targets(payload.pop("targets", None)),
+                       "explain": parse_explain(payload.pop("explain", None))}
+            sweep = payload.pop("sweep", None)
+            trajectory = payload.pop("trajectory", None)
+            payload = payload.pop("instances", payload)
+            if trajectory is not None:
+                if sweep is not None or payload:
+                    raise ValueError('"trajectory" cannot be combined with "sweep" or other instances')
+                data = parse_trajectory(trajectory)
+                METRICS.observe("deserialize", time.perf_counter() - started)
+                return data, options
+            if sweep is not None:
+                if options["explain"] is not None:
+                    raise ValueError('"sweep" cannot be combined with "explain"')
+                data = parse_sweep(sweep, payload)
+                METRICS.observe("deserialize", time.perf_counter() - started)
+                return data, options
+
+        # 3) If payload is a single JSON object (dict), wrap it in a list. 
         #    If it's already a list of records, Pandas will handle it directly.
         if isinstance(payload, dict):
             payload = [payload]
 
-        # 3) Create a DataFrame from that list of dicts
-        df = pd.DataFrame(payload)
+        # 4) Small feature-only payloads (the mobile screens) skip pandas entirely
+        if is_fast_path_payload(payload):
+            data = _preprocess(records_to_matrix(payload), started)
+        else:
+            # 5) Create a DataFrame from that list of dicts
+            df = pd.DataFrame(payload)
 
-        logger.info("Read input JSON; applying scale/impute/transform")
-        df = scale_and_transform(df)
-        df = remove_outliers(df)
-        return df
+            logger.info("Read input JSON; applying scale/impute/transform")
+            data = _preprocess(df, started)
+        return data if options is None else (data, options)
 
     elif request_content_type == "text/csv":
         s = request_body.decode("utf-8") if isinstance(request_body, (bytes, bytearray)) else request_body
         df = pd.read_csv(io.StringIO(s))
         logger.info("Read input CSV; applying scale/impute/transform")
-        df = scale_and_transform(df)
-        df = remove_outliers(df)
-        return df
+        return _preprocess(df, started)
+
+    elif request_content_type in BINARY_CONTENT_TYPES:
+        decoded = _decode_binary(request_body, request_content_type)
+        if isinstance(decoded, pd.DataFrame):
+            logger.info("Read input Arrow table; applying scale/impute/transform")
+        return _preprocess(decoded, started)
 
     else:
         raise ValueError(f"Unsupported content type: {request_content_type}")
@@ -175,40 +996,127 @@ def input_fn(request_body, request_content_type):
 
 def predict_fn(input_df, model):
     """
-    Select the 12 feature columns, run model.predict / model.predict_proba, return a DataFrame.
-    """
-    feature_cols = [
-        "HCO3",
-        "Creatinine",
-        "Procalcitonin",
-        "Mean Arterial Pressure",
-        "Bilirubin",
-        "pH",
-        "Albumin",
-        "Urea",
-        "White Blood Cell Count",
-        "SOFA",
-        "APACHEII",
-        "Glasgow"
-    ]
-    available = [c for c in feature_cols if c in input_df.columns]
-    X = input_df[available].copy()
-    preds_class = model.predict(X)
-    preds_proba = model.predict_proba(X)[:, 1]
-
-    out = pd.DataFrame({
-        "PredictedClass": preds_class,
-        "PredictedProba": preds_proba
-    }, index=X.index)
+    Select the 12 feature columns and score them with one booster call; return a DataFrame.
+    A matrix coming from the fast path is scored and returned as a dict of columns.
+    Columns missing from the request are passed to the model as NaN (missing).
+
+    `model` is the ModelRegistry from model_fn (or a single booster/classifier).
+    An (input, options) pair from input_fn carries the request options:
+      - "targets": score every requested target on the same matrix, with
+        "<target>_"-prefixed columns
+      - "explain": add per-row feature contributions (see explain_matrix)
+      - "sweep": input_fn returns a Sweep instead of rows; its whole grid
+        is scored at once (predict_sweep) into a SweepResult
+      - "trajectory": input_fn returns a Trajectory; every point of the
+        timeline is scored at once (predict_trajectory) into a TrajectoryResult
+    In small requests (up to FAST_PATH_MAX_ROWS rows), rows already scored by
+    the same registry version come from PREDICTION_CACHE.
+    Every scored row (cached or not; sweeps and trajectories excepted) goes to DRIFT_MONITOR.
+    """
+    started = time.perf_counter()
+    targets = explain = None
+    if isinstance(input_df, tuple):
+        input_df, options = input_df
+        targets, explain = options.get("targets"), options.get("explain")
+
+    if isinstance(input_df, Sweep):
+        result = predict_sweep(input_df, model, targets)
+        METRICS.observe("predict", time.perf_counter() - started,
+                        rows_scored=result.in_range.size, sweeps=1)
+        return result
+
+    if isinstance(input_df, Trajectory):
+        result = predict_trajectory(input_df, model, targets, explain)
+        if explain is None:
+            METRICS.observe("predict", time.perf_counter() - started,
+                            rows_scored=result.in_range.size, trajectories=1)
+        else:
+            METRICS.observe("predict", time.perf_counter() - started,
+                            rows_scored=result.in_range.size,
+                            rows_explained=result.in_range.size, trajectories=1)
+        return result
+
+    if isinstance(input_df, np.ndarray):
+        X = input_df
+    else:
+        X = input_df.reindex(columns=FEATURE_COLS).to_numpy(dtype=np.float32)
+    if DRIFT_MONITOR is not None:
+        DRIFT_MONITOR.update(X)
+
+    if PREDICTION_CACHE is not None and len(X) <= FAST_PATH_MAX_ROWS \
+            and isinstance(model, ModelRegistry) and PREDICTION_CACHE.version == model.version:
+        preds = PREDICTION_CACHE.get_or_score(
+            X, lambda Xm: _score(Xm, model, targets, explain),
+            extra_key=(None if targets is None else tuple(targets), explain)
+        )
+    else:
+        preds = _score(X, model, targets, explain)
+    if explain is None:
+        METRICS.observe("predict", time.perf_counter() - started, rows_scored=len(X))
+    else:
+        METRICS.observe("predict", time.perf_counter() - started, rows_scored=len(X),
+                        rows_explained=len(X))
+
+    if isinstance(input_df, np.ndarray):
+        return preds
+
+    out = pd.DataFrame(preds, index=input_df.index)
 
     return out
 
 
+def _score(X, model, targets, explain=None):
+    if targets is not None:
+        if not isinstance(model, ModelRegistry):
+            model = ModelRegistry({DEFAULT_TARGET: model})
+        return model.predict(X, targets, explain)
+    if explain is None and MICROBATCHER is not None and model is _MICROBATCHED_REGISTRY:
+        return MICROBATCHER.submit(X)
+    if isinstance(model, ModelRegistry):
+        target = model.default_target
+        threshold = model.thresholds.get(target)
+        if explain is not None:
+            return explain_matrix(X, model[target], explain, threshold,
+                                  scorer=model.scorer(target, len(X)))
+        return predict_matrix(X, model.scorer(target, len(X)), threshold)
+    if explain is not None:
+        return explain_matrix(X, model, explain, None)
+    return predict_matrix(X, model)
+
+
 def output_fn(prediction_df, accept):
     """
     - If Accept == "application/json", return JSON list of objects.
     - If Accept == "text/csv", return CSV.
+    - Binary Accept types (see BINARY_CONTENT_TYPES) return bytes, no text formatting.
+    Fast-path predictions (a dict of column arrays) are formatted without pandas.
     """
+    started = time.perf_counter()
+    try:
+        return _serialize(prediction_df, accept)
+    finally:
+        METRICS.observe("serialize", time.perf_counter() - started)
+
+
+JSON_DOUBLE_PRECISION = 10   # DataFrame.to_json's default
+
+
+def _serialize(prediction_df, accept):
+    if isinstance(prediction_df, (SweepResult, TrajectoryResult)):
+        if accept not in ("application/json", "json"):
+            kind = "Sweep" if isinstance(prediction_df, SweepResult) else "Trajectory"
+            raise ValueError(f"{kind} responses are only available as application/json, not {accept}")
+        # floats rounded and separators compact, like every other JSON response (_format_columns)
+        return json.dumps(prediction_df.to_dict(), separators=(",", ":"))
+
+    if accept in BINARY_CONTENT_TYPES:
+        if not isinstance(prediction_df, dict):
+            prediction_df = {c: prediction_df[c].to_numpy() for c in prediction_df.columns}
+        return _encode_binary(prediction_df, accept)
+
+    if isinstance(prediction_df, dict):
+        return _format_columns(prediction_df, accept)
+
     if accept == "text/csv":
         buffer = io.StringIO()
         prediction_df.to_csv(buffer, index=False)
@@ -222,25 +1130,82 @@ def output_fn(prediction_df, accept):
         raise ValueError(f"Unsupported accept type: {accept}")
 
 
+def _format_columns(columns: dict, accept):
+    # formatted like the DataFrame path, so the response does not depend on
+    # which path a request took
+    names = list(columns)
+    if accept == "text/csv":
+        # DataFrame.to_csv: each value's shortest repr in its own dtype (float32 too)
+        rows = zip(*(columns[n].astype(str).tolist() for n in names))
+        lines = [",".join(names)] + [",".join(r) for r in rows]
+        return "\n".join(lines) + "\n"
+    elif accept in ("application/json", "json"):
+        # DataFrame.to_json: floats rounded to 10 decimals, compact separators
+        rows = zip(*(_json_values(columns[n]) for n in names))
+        return json.dumps([dict(zip(names, r)) for r in rows], separators=(",", ":"))
+    else:
+        raise ValueError(f"Unsupported accept type: {accept}")
+
+
+def _json_values(values: np.ndarray) -> list:
+    if values.dtype.kind == "f":
+        return np.round(values.astype(np.float64), JSON_DOUBLE_PRECISION).tolist()
+    return values.tolist()
+
+
+def score_csv_stream(input_path, output_path, model, chunk_size=50000, explain=None):
+    """
+    Score a CSV of any size in fixed-size chunks: each chunk is preprocessed,
+    predicted (and explained, if explain is set) and appended to output_path,
+    so memory stays bounded by chunk_size.
+    Returns (rows_read, rows_written, seconds).
+    """
+    start = time.perf_counter()
+    rows_read = rows_written = 0
+    with open(output_path, "w", newline="") as out:
+        for i, chunk in enumerate(pd.read_csv(input_path, chunksize=chunk_size)):
+            df = preprocess_frame(chunk)
+            preds_df = predict_fn(df if explain is None else (df, {"explain": explain}), model)
+            preds_df.to_csv(out, header=(i == 0), index=False)
+            rows_read += len(chunk)
+            rows_written += len(preds_df)
+    return rows_read, rows_written, time.perf_counter() - start
+
+
 # When running locally, you can test:
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) != 3:
-        print("Usage: inference.py <input_csv_path> <output_csv_path>")
-        sys.exit(1)
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_csv", help="CSV of patients to score")
+    parser.add_argument("output_csv", help="Where to write the predictions")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read, score and write the CSV in chunks (bounded memory)")
+    parser.add_argument("--chunk-size", type=int, default=50000,
+                        help="Rows per chunk in --stream mode (default: 50000)")
+    parser.add_argument("--explain", default=None,
+                        help='Add feature contributions: top-k per row (an integer) or "all"')
+    args = parser.parse_args()
+    explain = parse_explain(args.explain if args.explain in (None, "all") else int(args.explain))
 
     model_dir = os.environ.get("SM_MODEL_DIR", "/opt/ml/model")
     model = model_fn(model_dir)
 
-    with open(sys.argv[1], "r") as f:
-        body = f.read()
-    df_in = input_fn(body, "text/csv")
+    if args.stream:
+        rows_read, rows_written, seconds = score_csv_stream(
+            args.input_csv, args.output_csv, model, chunk_size=args.chunk_size, explain=explain
+        )
+        print(f"Scored {rows_read} rows ({rows_written} written) in {seconds:.2f}s "
+              f"({rows_read / max(seconds, 1e-9):,.0f} rows/s)")
+    else:
+        with open(args.input_csv, "r") as f:
+            body = f.read()
+        df_in = input_fn(body, "text/csv")
 
-    preds_df = predict_fn(df_in, model)
-    # default to CSV if you’re writing to a file:
-    csv_out = output_fn(preds_df, "text/csv")
-    with open(sys.argv[2], "w") as f:
-        f.write(csv_out)
+        preds_df = predict_fn(df_in if explain is None else (df_in, {"explain": explain}), model)
+        # default to CSV if you’re writing to a file:
+        csv_out = output_fn(preds_df, "text/csv")
+        with open(args.output_csv, "w") as f:
+            f.write(csv_out)
 
     upload_log_to_s3()
-    print("Wrote predictions to", sys.argv[2])
+    print("Wrote predictions to", args.output_csv)
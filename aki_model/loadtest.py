@@ -0,0 +1,114 @@
+# loadtest.py
+"""
+Closed-loop load generator for serve.py (or any /invocations endpoint).
+
+--concurrency client threads each hold one keep-alive connection and send
+requests back to back for --seconds; request bodies are patients sampled from
+data_clean_name.csv. Prints throughput and p50/p95/p99/max latency, and
+optionally writes them as JSON:
+
+    python loadtest.py --url http://127.0.0.1:8080 --concurrency 16 --batch-size 1
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+import pandas as pd
+
+from preprocessing import FEATURE_COLS
+
+
+def make_bodies(reference_csv, batch_size, n_bodies=256, content_type="application/json", seed=42):
+    ref = pd.read_csv(reference_csv)[FEATURE_COLS]
+    rng = np.random.default_rng(seed)
+    bodies = []
+    for _ in range(n_bodies):
+        df = ref.iloc[rng.integers(0, len(ref), size=batch_size)]
+        bodies.append((df.to_json(orient="records") if content_type == "application/json"
+                       else df.to_csv(index=False)).encode("utf-8"))
+    return bodies
+
+
+def _client(url, bodies, content_type, deadline, latencies, statuses, lock):
+    target = urlparse(url)
+    conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+    headers = {"Content-Type": content_type, "Accept": "application/json"}
+    local, codes = [], {}
+    i = 0
+    while time.perf_counter() < deadline:
+        body = bodies[i % len(bodies)]
+        i += 1
+        t0 = time.perf_counter()
+        try:
+            conn.request("POST", "/invocations", body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+            status = "error"
+        local.append(time.perf_counter() - t0)
+        codes[status] = codes.get(status, 0) + 1
+    conn.close()
+    with lock:
+        latencies.extend(local)
+        for status, n in codes.items():
+            statuses[status] = statuses.get(status, 0) + n
+
+
+def run(url, concurrency, seconds, batch_size, reference_csv, content_type) -> dict:
+    bodies = make_bodies(reference_csv, batch_size, content_type=content_type)
+    latencies, statuses, lock = [], {}, threading.Lock()
+    start = time.perf_counter()
+    deadline = start + seconds
+    threads = [
+        threading.Thread(target=_client, args=(url, bodies, content_type, deadline, latencies, statuses, lock))
+        for _ in range(concurrency)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    ms = np.array(latencies) * 1000.0
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99]) if len(ms) else (np.nan,) * 3
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "batch_size": batch_size,
+        "requests": len(ms),
+        "statuses": {str(k): v for k, v in statuses.items()},
+        "requests_per_s": len(ms) / elapsed,
+        "rows_per_s": len(ms) * batch_size / elapsed,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(ms.max()) if len(ms) else float("nan"),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Concurrent keep-alive connections")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--batch-size", type=int, default=1, help="Patients per request")
+    parser.add_argument("--content-type", choices=["application/json", "text/csv"], default="application/json")
+    parser.add_argument("--reference-csv", default="data_clean_name.csv")
+    parser.add_argument("--output", default=None, help="Write the summary as JSON")
+    args = parser.parse_args()
+
+    result = run(args.url, args.concurrency, args.seconds, args.batch_size,
+                 args.reference_csv, args.content_type)
+    print(f"{result['requests']} requests in {args.seconds:.0f}s: {result['requests_per_s']:,.0f} req/s, "
+          f"p50={result['p50_ms']:.2f}ms p95={result['p95_ms']:.2f}ms p99={result['p99_ms']:.2f}ms "
+          f"max={result['max_ms']:.2f}ms statuses={result['statuses']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,285 @@
+# log_pipeline.py
+"""
+Non-blocking, segment-shipping logging for inference.py.
+
+Request threads only put records on a queue (QueueHandler); a QueueListener
+thread does the console / file I/O. The log file is rotated by size or age,
+and each closed segment is gzip-compressed and shipped by a background thread
+to a sink:
+  - S3Sink: any S3-compatible store (LOG_S3_BUCKET, LOG_S3_PREFIX, LOG_S3_ENDPOINT_URL)
+  - LocalDirSink: a local directory (LOG_SINK_DIR), for testing without AWS
+Only closed segments are shipped, so each upload is bounded by the segment size.
+On shutdown (stop) the open segment is closed and shipped too, within a time
+limit; whatever a process that died without stopping left behind is shipped by
+the next pipeline started on the same file.
+"""
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import shutil
+import sys
+import threading
+import time
+
+STOP_TIMEOUT_SECONDS = 10.0   # how long stop() waits for the last segments to ship
+
+
+class LocalDirSink:
+    """Copy shipped segments into a local directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, path, name):
+        shutil.copyfile(path, os.path.join(self.directory, name))
+
+    def __repr__(self):
+        return f"LocalDirSink({self.directory!r})"
+
+
+class S3Sink:
+    """Upload shipped segments to s3://bucket/prefix<name>; the client is created once, lazily."""
+
+    def __init__(self, bucket, prefix="", endpoint_url=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self._client = None
+
+    def put(self, path, name):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client("s3", endpoint_url=self.endpoint_url)
+        self._client.upload_file(path, self.bucket, self.prefix + name)
+
+    def __repr__(self):
+        return f"S3Sink('s3://{self.bucket}/{self.prefix}')"
+
+
+class SegmentShipper:
+    """Background thread that gzips closed log segments and hands them to a sink."""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="log-shipper", daemon=True)
+        self._thread.start()
+
+    def ship(self, path):
+        self._queue.put(path)
+
+    def flush(self, timeout=None) -> bool:
+        """
+        Block until every queued segment has been shipped, or for at most
+        timeout seconds. Returns False if segments were still pending.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            try:
+                gz_path = path + ".gz"
+                with open(path, "rb") as src, gzip.open(gz_path, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                self.sink.put(gz_path, os.path.basename(gz_path))
+                os.remove(path)
+                os.remove(gz_path)
+            except Exception as e:
+                # the segment stays on disk; report on stderr, not through the logger
+                print(f"log_pipeline: failed to ship {path} to {self.sink}: {e}",
+                      file=sys.stderr, flush=True)
+            finally:
+                self._queue.task_done()
+
+
+class SegmentFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler that also rolls over after max_seconds and, instead of
+    keeping numbered backups, renames the closed segment with a timestamp and
+    passes it to on_segment_closed.
+    """
+
+    def __init__(self, filename, max_bytes=0, max_seconds=0, on_segment_closed=None):
+        super().__init__(filename, maxBytes=max_bytes, delay=True)
+        self.max_seconds = max_seconds
+        self.on_segment_closed = on_segment_closed
+        self._opened_at = time.time()
+        self._seq = 0
+
+    def shouldRollover(self, record):
+        if self.max_seconds and time.time() - self._opened_at >= self.max_seconds:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            root, ext = os.path.splitext(self.baseFilename)
+            self._seq += 1
+            segment = f"{root}_{time.strftime('%Y%m%d-%H%M%S')}-{self._seq}{ext}"
+            os.replace(self.baseFilename, segment)
+            if self.on_segment_closed:
+                self.on_segment_closed(segment)
+        self._opened_at = time.time()
+        self.stream = self._open()
+
+
+class _PassThroughQueueHandler(logging.handlers.QueueHandler):
+    # records never leave the process, so formatting is left to the listener thread
+    def prepare(self, record):
+        return record
+
+
+class LogPipeline:
+    """
+    Queue + listener + rotating segment file + shipper, attached to one logger.
+    Each process writes its own file (<name>.<pid><ext>), so pre-forked or pooled
+    workers never rotate a file another process is still writing.
+    """
+
+    def __init__(self, logger, filename, formatter, sink=None, max_bytes=10 * 1024 * 1024,
+                 max_seconds=3600):
+        self.filename = filename
+        self.shipper = SegmentShipper(sink) if sink is not None else None
+        self.file_handler = SegmentFileHandler(
+            self._process_filename(), max_bytes=max_bytes, max_seconds=max_seconds,
+            on_segment_closed=self.shipper.ship if self.shipper else None
+        )
+        console_handler = logging.StreamHandler()
+        for h in (self.file_handler, console_handler):
+            h.setFormatter(formatter)
+
+        self._queue = queue.SimpleQueue()
+        self.listener = logging.handlers.QueueListener(
+            self._queue, console_handler, self.file_handler, respect_handler_level=True
+        )
+        self.queue_handler = _PassThroughQueueHandler(self._queue)
+        logger.addHandler(self.queue_handler)
+        self.listener.start()
+        if self.shipper:
+            self.ship_orphaned_segments()
+
+    def _process_filename(self):
+        root, ext = os.path.splitext(self.filename)
+        return os.path.abspath(f"{root}.{os.getpid()}{ext}")
+
+    def ship_orphaned_segments(self):
+        """
+        Ship the files of processes that are gone (killed, or exited without
+        stop()): their closed segments, and their open per-pid file, which is
+        renamed into a segment first. Files of running processes are left alone.
+        """
+        directory, name = os.path.split(os.path.abspath(self.filename))
+        root, ext = os.path.splitext(name)
+        pattern = re.compile(rf"{re.escape(root)}\.(\d+)(_[\d-]+)?{re.escape(ext)}")
+        for entry in sorted(os.listdir(directory)):
+            match = pattern.fullmatch(entry)
+            if not match or _pid_running(int(match.group(1))):
+                continue
+            path = os.path.join(directory, entry)
+            if match.group(2) is None:
+                if not os.path.getsize(path):
+                    os.remove(path)
+                    continue
+                segment = f"{path[:-len(ext)] if ext else path}_{time.strftime('%Y%m%d-%H%M%S')}-0{ext}"
+                os.replace(path, segment)
+                path = segment
+            self.shipper.ship(path)
+
+    def after_fork(self):
+        """
+        Call in a forked child: threads are not inherited, so start a fresh
+        queue, listener and shipper, writing to the child's own per-pid file.
+        """
+        if self.shipper:
+            self.shipper = SegmentShipper(self.shipper.sink)
+            self.file_handler.on_segment_closed = self.shipper.ship
+        if self.file_handler.stream:
+            self.file_handler.stream.close()
+            self.file_handler.stream = None
+        self.file_handler.baseFilename = self._process_filename()
+        self.file_handler._opened_at = time.time()
+        self._queue = queue.SimpleQueue()
+        self.queue_handler.queue = self._queue
+        self.listener = logging.handlers.QueueListener(
+            self._queue, *self.listener.handlers, respect_handler_level=True
+        )
+        self.listener.start()
+
+    def flush(self):
+        """
+        Close the current segment and ship every pending segment (blocking).
+        Used by the CLI at exit; the server path ships in the background.
+        """
+        self.listener.stop()   # drains the queue into the file
+        self.file_handler.acquire()
+        try:
+            self.file_handler.doRollover()
+        finally:
+            self.file_handler.release()
+        if self.shipper:
+            self.shipper.flush()
+        self.listener.start()
+
+    def stop(self, timeout=STOP_TIMEOUT_SECONDS):
+        """
+        Drain the queue, close the open segment and ship it (plus anything
+        still pending), waiting at most timeout seconds for the sink. Segments
+        not shipped in time stay on disk for the next start.
+        """
+        self.listener.stop()
+        if self.shipper:
+            self.file_handler.acquire()
+            try:
+                self.file_handler.doRollover()
+            finally:
+                self.file_handler.release()
+            if not self.shipper.flush(timeout):
+                print(f"log_pipeline: segments still pending for {self.shipper.sink} "
+                      f"after {timeout}s; they will be shipped on the next start",
+                      file=sys.stderr, flush=True)
+        self.file_handler.close()
+        path = self.file_handler.baseFilename
+        if os.path.exists(path) and not os.path.getsize(path):
+            os.remove(path)   # the empty file the rollover reopened
+
+
+def _pid_running(pid) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sink_from_env():
+    """
+    LOG_SINK_DIR -> LocalDirSink; LOG_S3_BUCKET -> S3Sink; otherwise no shipping.
+    """
+    if os.environ.get("LOG_SINK_DIR"):
+        return LocalDirSink(os.environ["LOG_SINK_DIR"])
+    if os.environ.get("LOG_S3_BUCKET"):
+        return S3Sink(
+            os.environ["LOG_S3_BUCKET"],
+            os.environ.get("LOG_S3_PREFIX", "logs/inference_logs/"),
+            endpoint_url=os.environ.get("LOG_S3_ENDPOINT_URL"),
+        )
+    return None
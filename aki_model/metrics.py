@@ -0,0 +1,275 @@
+# metrics.py
+"""
+Low-overhead serving metrics for inference.py.
+
+Metrics keeps counters and per-stage latency histograms (deserialize,
+preprocess, predict, serialize); recording one observation is a bisect plus a
+couple of integer adds under a lock. Extra collectors (prediction cache,
+micro-batcher) are merged in at render time only.
+
+Exposed as Prometheus text (/metrics) or JSON (/metrics.json) by
+start_metrics_server, next to a /ping.
+
+Several processes (pre-forked workers) report through one server: each
+writes its snapshot to a shared directory (SnapshotWriter) and the process
+serving the port merges them (MetricsAggregator). Counters and stage
+histograms are summed; collector stats stay per process, labelled by pid.
+"""
+import bisect
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STAGE_BUCKETS_SECONDS = [
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0
+]
+
+
+class Histogram:
+    """Fixed-bucket histogram (bucket i counts values <= bounds[i]; the last bucket is +Inf)."""
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.n += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "buckets": {str(b): c for b, c in zip(self.bounds + ["+Inf"], self.counts)},
+            "count": self.n,
+            "sum": self.total,
+        }
+
+
+class Metrics:
+    def __init__(self, stage_buckets=STAGE_BUCKETS_SECONDS):
+        self.stage_buckets = stage_buckets
+        self.counters = {}
+        self.stages = {}
+        self.collectors = {}   # name -> callable returning a stats dict
+        self._lock = threading.Lock()
+
+    def inc(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, stage, seconds, **counts):
+        """Record one stage duration, plus any counter increments, under one lock."""
+        with self._lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = Histogram(self.stage_buckets)
+            hist.observe(seconds)
+            for name, n in counts.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_collector(self, name, fn):
+        self.collectors[name] = fn
+
+    def reset(self):
+        """Forget counters and stages (in a forked worker, which starts from zero)."""
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.stages = {}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = {
+                "counters": dict(self.counters),
+                "stage_seconds": {s: h.snapshot() for s, h in self.stages.items()},
+            }
+        for name, fn in self.collectors.items():
+            out[name] = fn()
+        return out
+
+    def render_json(self) -> str:
+        return json.dumps(self.snapshot())
+
+    def render_prometheus(self, prefix="inference") -> str:
+        return render_prometheus(self.snapshot(), prefix)
+
+
+class SnapshotWriter:
+    """Daemon thread writing a Metrics snapshot to <directory>/<pid>.json every interval seconds."""
+
+    def __init__(self, metrics, directory, interval=2.0):
+        self.metrics = metrics
+        self.path = os.path.join(directory, f"{os.getpid()}.json")
+        self.interval = interval
+        os.makedirs(directory, exist_ok=True)
+        self._stopped = threading.Event()
+        threading.Thread(target=self._run, name="metrics-writer", daemon=True).start()
+
+    def write(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.metrics.snapshot(), f)
+        os.replace(tmp, self.path)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"metrics: failed to write {self.path}: {e}", flush=True)
+
+    def stop(self):
+        """Stop the thread and write the final snapshot."""
+        self._stopped.set()
+        self.write()
+
+
+class MetricsAggregator:
+    """
+    This process's Metrics merged with the snapshots other processes write to
+    directory (see SnapshotWriter). Snapshots of workers that exited are kept,
+    so counters never go backwards; clear=True drops a previous server's files.
+    """
+
+    def __init__(self, metrics, directory, clear=False):
+        self.metrics = metrics
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        if clear:
+            for name in os.listdir(directory):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(directory, name))
+
+    def snapshot(self) -> dict:
+        snapshots = {str(os.getpid()): self.metrics.snapshot()}
+        for name in os.listdir(self.directory):
+            pid = name[:-len(".json")]
+            if not name.endswith(".json") or pid in snapshots:
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshots[pid] = json.load(f)
+            except (OSError, ValueError):
+                continue
+        return merge_snapshots(snapshots)
+
+    def render_json(self) -> str:
+        return json.dumps(self.snapshot())
+
+    def render_prometheus(self, prefix="inference") -> str:
+        return render_prometheus(self.snapshot(), prefix)
+
+
+def merge_snapshots(snapshots: dict) -> dict:
+    """
+    {pid: snapshot} -> one snapshot: counters and stage histograms summed,
+    each process's collector stats under "processes"[pid].
+    """
+    counters, stages, processes = {}, {}, {}
+    for pid, snap in sorted(snapshots.items()):
+        snap = dict(snap)
+        for name, value in snap.pop("counters", {}).items():
+            counters[name] = counters.get(name, 0) + value
+        for stage, hist in snap.pop("stage_seconds", {}).items():
+            merged = stages.setdefault(stage, {"buckets": dict.fromkeys(hist["buckets"], 0),
+                                               "count": 0, "sum": 0.0})
+            for le, count in hist["buckets"].items():
+                merged["buckets"][le] = merged["buckets"].get(le, 0) + count
+            merged["count"] += hist["count"]
+            merged["sum"] += hist["sum"]
+        processes[pid] = snap
+    return {"counters": counters, "stage_seconds": stages, "processes": processes}
+
+
+def render_prometheus(snap, prefix="inference") -> str:
+    """Prometheus text of a Metrics snapshot, or of a merged one (collectors labelled by pid)."""
+    snap = dict(snap)
+    lines = []
+    for name, value in sorted(snap.pop("counters").items()):
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {value}")
+    stages = snap.pop("stage_seconds")
+    if stages:
+        lines.append(f"# TYPE {prefix}_stage_seconds histogram")
+    for stage, hist in sorted(stages.items()):
+        lines.extend(_prometheus_histogram(f"{prefix}_stage_seconds", hist, f'stage="{stage}"'))
+    processes = snap.pop("processes", None)
+    if processes is None:
+        sources = [("", snap)]
+    else:
+        sources = [(f'pid="{pid}"', collectors) for pid, collectors in sorted(processes.items())]
+    lines.extend(_prometheus_collectors(prefix, sources))
+    return "\n".join(lines) + "\n"
+
+
+def _prometheus_histogram(name, hist, labels=""):
+    lines = []
+    cumulative = 0
+    for le, count in hist["buckets"].items():
+        cumulative += count
+        bucket_labels = ",".join(filter(None, [labels, f'le="{le}"']))
+        lines.append(f"{name}_bucket{{{bucket_labels}}} {cumulative}")
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {hist['sum']}")
+    lines.append(f"{name}_count{suffix} {hist['count']}")
+    return lines
+
+
+def _prometheus_collectors(prefix, sources):
+    # sources: [(labels, {collector: stats})]; numbers become gauges, nested
+    # histogram snapshots become histograms, one TYPE line per metric name
+    gauges, histograms = {}, {}
+    for labels, collectors in sources:
+        for collector, stats in collectors.items():
+            for key, value in (stats or {}).items():
+                name = f"{prefix}_{collector}_{key}"
+                if isinstance(value, dict) and "buckets" in value:
+                    histograms.setdefault(name, []).append((labels, value))
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges.setdefault(name, []).append((labels, value))
+    lines = []
+    for name in sorted(set(gauges) | set(histograms)):
+        if name in histograms:
+            lines.append(f"# TYPE {name} histogram")
+            for labels, hist in histograms[name]:
+                lines.extend(_prometheus_histogram(name, hist, labels))
+        else:
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in gauges[name]:
+                lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    return lines
+
+
+def start_metrics_server(metrics, port, host="127.0.0.1"):
+    """
+    Serve /metrics (Prometheus text), /metrics.json and /ping from a daemon
+    thread. metrics is a Metrics or a MetricsAggregator; raises OSError if the
+    port cannot be bound.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, ctype = metrics.render_prometheus(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, ctype = metrics.render_json(), "application/json"
+            elif self.path == "/ping":
+                body, ctype = "", "text/plain"
+            else:
+                self.send_error(404)
+                return
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
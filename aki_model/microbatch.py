@@ -0,0 +1,113 @@
+# microbatch.py
+"""
+Server-side micro-batching for concurrent single-record requests.
+
+Request threads hand their (already preprocessed) feature matrix to a
+MicroBatcher and block. A single scoring thread waits for the first request,
+keeps collecting until it has max_batch_rows rows or max_wait_ms has passed,
+scores everything with one model call and hands each caller its own rows.
+
+Batch sizes and queue waits are recorded in fixed-bucket histograms
+(MicroBatcher.stats()), so the latency / throughput trade-off can be tuned.
+"""
+import queue
+import threading
+import time
+
+import numpy as np
+
+from metrics import Histogram
+
+
+class _Request:
+    __slots__ = ("X", "enqueued", "done", "result", "error")
+
+    def __init__(self, X):
+        self.X = X
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent score_fn(X) calls into one call on the stacked rows.
+    score_fn takes a 2-D matrix and returns a dict of per-row column arrays.
+    """
+
+    def __init__(self, score_fn, max_batch_rows=64, max_wait_ms=2.0):
+        self.score_fn = score_fn
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000.0
+        self._lock = threading.Lock()
+        self.reset_stats()
+        self._start()
+
+    def _start(self):
+        self._lock = threading.Lock()
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="microbatcher", daemon=True)
+        self._thread.start()
+
+    def after_fork(self):
+        """Call in a forked child: restart the scoring thread (threads are not inherited)."""
+        self._start()
+
+    def submit(self, X: np.ndarray) -> dict:
+        """Score X as part of the next batch; blocks until its rows are ready."""
+        req = _Request(X)
+        self._queue.put(req)
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def reset_stats(self):
+        """Start the histograms over (after the warmup requests)."""
+        with self._lock:
+            self.batch_rows = Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256, 512])
+            self.queue_wait_ms = Histogram([0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 25, 50])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "batch_rows": self.batch_rows.snapshot(),
+                "queue_wait_ms": self.queue_wait_ms.snapshot(),
+            }
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        rows = len(batch[0].X)
+        deadline = batch[0].enqueued + self.max_wait
+        while rows < self.max_batch_rows:
+            timeout = deadline - time.perf_counter()
+            try:
+                req = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(req)
+            rows += len(req.X)
+        return batch, rows
+
+    def _run(self):
+        while True:
+            batch, rows = self._collect()
+            started = time.perf_counter()
+            with self._lock:
+                self.batch_rows.observe(rows)
+                for req in batch:
+                    self.queue_wait_ms.observe((started - req.enqueued) * 1000.0)
+            try:
+                X = batch[0].X if len(batch) == 1 else np.concatenate([r.X for r in batch])
+                out = self.score_fn(X)
+                offset = 0
+                for req in batch:
+                    n = len(req.X)
+                    req.result = {k: v[offset:offset + n] for k, v in out.items()}
+                    offset += n
+            except Exception as e:
+                for req in batch:
+                    req.error = e
+            for req in batch:
+                req.done.set()
@@ -0,0 +1,124 @@
+# prediction_cache.py
+"""
+In-process LRU/TTL cache of per-row predictions.
+
+UpdatePredictionScreen / PatientSummaryScreen re-send the same patient vector
+while clinicians browse. Rows are keyed by a canonical form of the feature
+vector the model sees (rounded to sig_digits significant digits, NaN
+normalized) plus the requested targets; the cache is bound to a model version
+and is cleared as soon as a different version is set.
+
+Memory is bounded by max_bytes (an estimate per entry); hits, misses,
+evictions and expirations are counted in stats().
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def quantize(X: np.ndarray, sig_digits: int) -> np.ndarray:
+    """Round every value to sig_digits significant digits (NaN stays a canonical NaN)."""
+    X = np.asarray(X, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        exponent = np.floor(np.log10(np.abs(X)))
+        exponent = np.where(np.isfinite(exponent), exponent, 0)
+        scale = 10.0 ** (sig_digits - 1 - exponent)
+        q = np.round(X * scale) / scale
+    return np.where(np.isnan(X), np.nan, q)
+
+
+class PredictionCache:
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl_seconds=300.0, sig_digits=6):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sig_digits = sig_digits
+        self.version = None
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        self._entries = OrderedDict()   # key -> (expires_at, column names, row values, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def set_version(self, version):
+        """Bind the cache to a model version; a different version drops every entry."""
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self._bytes = 0
+                self.version = version
+
+    def get_or_score(self, X: np.ndarray, score_fn, extra_key=None) -> dict:
+        """
+        Return score_fn's columns for every row of X, calling score_fn only on
+        the rows that are not cached. extra_key (e.g. the targets) is part of the key.
+        """
+        keys = [(extra_key, row.tobytes()) for row in quantize(X, self.sig_digits)]
+        now = time.monotonic()
+        cached = [None] * len(keys)
+        miss_idx = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] < now:
+                    self._remove(key)
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    miss_idx.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    cached[i] = entry[1:3]
+            self.hits += len(keys) - len(miss_idx)
+            self.misses += len(miss_idx)
+
+        if len(miss_idx) == len(keys):
+            out = score_fn(X)
+            self._store(keys, range(len(keys)), out, now)
+            return out
+
+        if miss_idx:
+            scored = score_fn(X[miss_idx])
+            self._store(keys, miss_idx, scored, now)
+            names = tuple(scored)
+            for j, i in enumerate(miss_idx):
+                cached[i] = (names, tuple(scored[n][j] for n in names))
+        names = cached[0][0]
+        return {
+            name: np.array([values[c] for _, values in cached]) for c, name in enumerate(names)
+        }
+
+    def _store(self, keys, idx, out, now):
+        if not self.max_bytes:
+            return
+        names = tuple(out)
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            for j, i in enumerate(idx):
+                values = tuple(out[n][j] for n in names)
+                size = sys.getsizeof(keys[i][1]) + 64 * (len(values) + 2)
+                if keys[i] in self._entries:
+                    self._remove(keys[i])
+                self._entries[keys[i]] = (expires_at, names, values, size)
+                self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        size = self._entries.pop(key)[-1]
+        self._bytes -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "version": self.version,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
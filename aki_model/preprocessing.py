@@ -0,0 +1,417 @@
+# preprocessing.py
+"""
+Shared preprocessing for the AKI and dialysis models.
+
+A Preprocessor is fitted once at training time (train.py / train_local.py) and
+learns everything that used to be recomputed per batch:
+  - median-impute values per (Gender, Hypertension) group, plus global medians
+  - the 2.5 * IQR outlier bounds
+It is saved as preprocessor.json next to the model, and inference.py loads it
+once in model_fn. Applying it is O(rows x features): no groupby or quantile
+work happens at serve time.
+
+Training also saves preprocessor_stats.json: mergeable value -> count tables
+behind every median and IQR bound, so partial_fit can fold newly collected
+rows into the statistics without the original data (train.py --incremental).
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+FEATURE_COLS = [
+    "HCO3",
+    "Creatinine",
+    "Procalcitonin",
+    "Mean Arterial Pressure",
+    "Bilirubin",
+    "pH",
+    "Albumin",
+    "Urea",
+    "White Blood Cell Count",
+    "SOFA",
+    "APACHEII",
+    "Glasgow"
+]
+
+SCALING_FACTORS = {
+    "Procalcitonin": 1000.0,
+    "White Blood Cell Count": 10.0,
+    "Creatinine": 88.4,
+    "Urea": 2.14,
+    "Bilirubin": 17.1,
+    "Albumin": 10.0
+}
+IMPUTE_COLS = ["Respiratory Rate", "Albumin", "Bilirubin", "Procalcitonin", "HCO3"]
+GROUP_COLS = ["Gender", "Hypertension"]
+LOG_TRANSFORM_COLS = ["Procalcitonin", "Creatinine", "Urea", "Lactate", "HCO3", "Mean Arterial Pressure"]
+SQRT_TRANSFORM_COLS = ["White Blood Cell Count", "APACHEII", "SOFA"]
+OUTLIER_COLS = [
+    "Mechanical Ventilation",
+    "Procalcitonin",
+    "Creatinine",
+    "Bilirubin",
+    "White Blood Cell Count"
+]
+IQR_MULTIPLIER = 2.5
+# every raw column fit / transform / filter_outliers read (what a trainer must load)
+RAW_INPUT_COLS = list(dict.fromkeys(FEATURE_COLS + IMPUTE_COLS + GROUP_COLS + OUTLIER_COLS))
+
+PREPROCESSOR_FILENAME = "preprocessor.json"
+STATS_FILENAME = "preprocessor_stats.json"
+STATS_SIG_DIGITS = 6
+
+
+class ValueCounts:
+    """
+    Mergeable value -> count table for exact-ish quantiles. Values are rounded
+    to STATS_SIG_DIGITS significant digits, NaN is skipped; quantile()
+    interpolates linearly like pandas.
+    """
+
+    def __init__(self, counts=None):
+        self.counts = dict(counts or {})
+
+    def update(self, values) -> "ValueCounts":
+        v = pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(dtype=float)
+        v = v[~np.isnan(v)]
+        if len(v):
+            with np.errstate(divide="ignore"):
+                exponent = np.floor(np.log10(np.abs(v)))
+            exponent = np.where(np.isfinite(exponent), exponent, 0)
+            scale = 10.0 ** (STATS_SIG_DIGITS - 1 - exponent)
+            unique, counts = np.unique(np.round(v * scale) / scale, return_counts=True)
+            for x, n in zip(unique.tolist(), counts.tolist()):
+                self.counts[x] = self.counts.get(x, 0) + n
+        return self
+
+    def quantile(self, q) -> float:
+        if not self.counts:
+            return float("nan")
+        x = np.array(sorted(self.counts))
+        cum = np.cumsum([self.counts[k] for k in x])
+        h = (cum[-1] - 1) * q
+        lo = int(np.floor(h))
+        a = x[np.searchsorted(cum, lo, side="right")]
+        b = x[np.searchsorted(cum, min(lo + 1, cum[-1] - 1), side="right")]
+        return float(a + (h - lo) * (b - a))
+
+    def to_list(self) -> list:
+        keys = sorted(self.counts)
+        return [keys, [self.counts[k] for k in keys]]
+
+    @classmethod
+    def from_list(cls, pair) -> "ValueCounts":
+        return cls(zip(pair[0], pair[1]))
+
+
+class Preprocessor:
+    """
+    Fitted scale / impute / log-sqrt / outlier-filter pipeline. Outlier
+    filtering applies to training data only; serving scores every row.
+
+    An unfitted Preprocessor still scales and transforms, skips imputation and
+    only drops rows that are NaN in an outlier column (what the old per-batch
+    code did for a single record).
+    """
+
+    def __init__(self):
+        self.global_medians = {}   # col -> median
+        self.group_medians = {}    # (gender, hypertension) -> {col: median}
+        self.outlier_bounds = {}   # col -> (lower, upper)
+        self.stats = None          # ValueCounts behind the above (training only)
+        self._median_table = None
+        self._matrix_ops = {}
+
+    @property
+    def is_fitted(self) -> bool:
+        return bool(self.outlier_bounds)
+
+    # ----------------------------
+    # fitting
+    # ----------------------------
+    def fit(self, df: pd.DataFrame) -> "Preprocessor":
+        """
+        Learn imputation medians (on scaled values) and outlier bounds (on fully
+        transformed values). Like the original remove_outliers, each column's
+        IQR is taken over the rows that survived the previous columns.
+        """
+        scaled = _scale(df)
+        impute_cols = [c for c in IMPUTE_COLS if c in scaled.columns]
+        self.global_medians = {c: float(scaled[c].median()) for c in impute_cols}
+        self.group_medians = {}
+        self.stats = {
+            "n_rows": len(df),
+            "global": {c: ValueCounts().update(scaled[c]) for c in impute_cols},
+            "groups": {},
+            "outliers": {},
+        }
+        for key, group in self._groups(scaled, impute_cols):
+            medians = group.median()
+            self.group_medians[key] = {c: float(v) for c, v in medians.items() if pd.notna(v)}
+            self.stats["groups"][key] = {c: ValueCounts().update(group[c]) for c in impute_cols}
+        self._median_table = None
+
+        transformed = self._impute(scaled)
+        _log_sqrt(transformed)
+
+        self.outlier_bounds = {}
+        self._matrix_ops = {}
+        for col in OUTLIER_COLS:
+            if col not in transformed.columns:
+                continue
+            self.stats["outliers"][col] = ValueCounts().update(transformed[col])
+            q1 = transformed[col].quantile(0.25)
+            q3 = transformed[col].quantile(0.75)
+            iqr = q3 - q1
+            lower = q1 - IQR_MULTIPLIER * iqr
+            upper = q3 + IQR_MULTIPLIER * iqr
+            self.outlier_bounds[col] = (float(lower), float(upper))
+            transformed = transformed[(transformed[col] >= lower) & (transformed[col] <= upper)]
+        return self
+
+    def partial_fit(self, df: pd.DataFrame) -> "Preprocessor":
+        """
+        Fold new rows into the fitted statistics (needs self.stats, i.e. a
+        Preprocessor fitted or loaded with its stats). Medians and bounds are
+        recomputed from the merged value counts; as in fit, each outlier column
+        only counts new rows that pass the (updated) bounds of the columns before it.
+        """
+        if self.stats is None:
+            raise ValueError(f"No incremental statistics ({STATS_FILENAME}); refit on the full data")
+        scaled = _scale(df)
+        impute_cols = [c for c in IMPUTE_COLS if c in scaled.columns]
+        for col in impute_cols:
+            counts = self.stats["global"].setdefault(col, ValueCounts()).update(scaled[col])
+            self.global_medians[col] = counts.quantile(0.5)
+        for key, group in self._groups(scaled, impute_cols):
+            group_stats = self.stats["groups"].setdefault(key, {})
+            medians = self.group_medians.setdefault(key, {})
+            for col in impute_cols:
+                counts = group_stats.setdefault(col, ValueCounts()).update(group[col])
+                if counts.counts:
+                    medians[col] = counts.quantile(0.5)
+        self._median_table = None
+
+        transformed = self._impute(scaled)
+        _log_sqrt(transformed)
+        self._matrix_ops = {}
+        for col in OUTLIER_COLS:
+            if col not in transformed.columns:
+                continue
+            counts = self.stats["outliers"].setdefault(col, ValueCounts()).update(transformed[col])
+            q1, q3 = counts.quantile(0.25), counts.quantile(0.75)
+            lower = q1 - IQR_MULTIPLIER * (q3 - q1)
+            upper = q3 + IQR_MULTIPLIER * (q3 - q1)
+            self.outlier_bounds[col] = (lower, upper)
+            transformed = transformed[(transformed[col] >= lower) & (transformed[col] <= upper)]
+        self.stats["n_rows"] += len(df)
+        return self
+
+    @staticmethod
+    def _groups(scaled: pd.DataFrame, impute_cols):
+        # (float group key, rows of impute_cols) per (Gender, Hypertension) group
+        if not impute_cols or not all(g in scaled.columns for g in GROUP_COLS):
+            return
+        keys = scaled[GROUP_COLS].apply(pd.to_numeric, errors="coerce")
+        for key, group in scaled[impute_cols].groupby([keys[g] for g in GROUP_COLS]):
+            yield tuple(float(k) for k in key), group
+
+    # ----------------------------
+    # DataFrame path
+    # ----------------------------
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        1) Divide certain lab features by scaling factors
+        2) Fill missing values from the fitted group medians (only if the grouping keys are there)
+        3) Apply log1p or sqrt transforms
+        """
+        out = self._impute(_scale(df))
+        _log_sqrt(out)
+        return out
+
+    def filter_outliers(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Drop rows outside the fitted bounds (or NaN) in any outlier column present.
+        """
+        keep = np.ones(len(df), dtype=bool)
+        for col in OUTLIER_COLS:
+            if col not in df.columns:
+                continue
+            lower, upper = self.outlier_bounds.get(col, (-np.inf, np.inf))
+            values = pd.to_numeric(df[col], errors="coerce").to_numpy()
+            keep &= (values >= lower) & (values <= upper)
+        return df[keep]
+
+    def _impute(self, df: pd.DataFrame) -> pd.DataFrame:
+        impute_cols = [c for c in IMPUTE_COLS if c in df.columns]
+        if not impute_cols or not self.global_medians or not all(g in df.columns for g in GROUP_COLS):
+            return df
+        keys = pd.MultiIndex.from_arrays(
+            [pd.to_numeric(df[g], errors="coerce").astype(float) for g in GROUP_COLS]
+        )
+        medians = self._get_median_table().reindex(keys)
+        for col in impute_cols:
+            fill = medians[col].to_numpy() if col in medians.columns else np.full(len(df), np.nan)
+            fill = np.where(np.isnan(fill), self.global_medians.get(col, np.nan), fill)
+            df[col] = df[col].fillna(pd.Series(fill, index=df.index))
+        return df
+
+    def _get_median_table(self) -> pd.DataFrame:
+        if self._median_table is None:
+            index = pd.MultiIndex.from_tuples(list(self.group_medians), names=GROUP_COLS) \
+                if self.group_medians else pd.MultiIndex.from_arrays([[], []], names=GROUP_COLS)
+            self._median_table = pd.DataFrame(list(self.group_medians.values()), index=index,
+                                              columns=list(self.global_medians), dtype=float)
+        return self._median_table
+
+    # ----------------------------
+    # NumPy path (no imputation: grouping keys are not model features)
+    # ----------------------------
+    def transform_matrix(self, X: np.ndarray, columns=FEATURE_COLS) -> np.ndarray:
+        """
+        In-place equivalent of transform on a float64 matrix whose columns are `columns`.
+        """
+        ops = self._get_matrix_ops(columns)
+        X /= ops["scale"]
+        X[:, ops["log_idx"]] = np.log1p(np.maximum(X[:, ops["log_idx"]], 0))
+        X[:, ops["sqrt_idx"]] = np.sqrt(np.maximum(X[:, ops["sqrt_idx"]], 0))
+        return X
+
+    def out_of_bounds(self, X: np.ndarray, columns=FEATURE_COLS) -> np.ndarray:
+        """
+        Rows of a transformed matrix with a value outside the fitted bounds
+        (missing values are not). Training drops such rows (filter_outliers);
+        serving still scores them and only counts / flags them.
+        """
+        ops = self._get_matrix_ops(columns)
+        Xo = X[:, ops["outlier_idx"]]
+        return ((Xo < ops["lower"]) | (Xo > ops["upper"])).any(axis=1)
+
+    def _get_matrix_ops(self, columns) -> dict:
+        key = tuple(columns)
+        ops = self._matrix_ops.get(key)
+        if ops is None:
+            outlier_cols = [c for c in OUTLIER_COLS if c in key]
+            bounds = [self.outlier_bounds.get(c, (-np.inf, np.inf)) for c in outlier_cols]
+            ops = {
+                "scale": np.array([SCALING_FACTORS.get(c, 1.0) for c in key]),
+                "log_idx": np.array([key.index(c) for c in LOG_TRANSFORM_COLS if c in key], dtype=int),
+                "sqrt_idx": np.array([key.index(c) for c in SQRT_TRANSFORM_COLS if c in key], dtype=int),
+                "outlier_idx": np.array([key.index(c) for c in outlier_cols], dtype=int),
+                "lower": np.array([b[0] for b in bounds]),
+                "upper": np.array([b[1] for b in bounds]),
+            }
+            self._matrix_ops[key] = ops
+        return ops
+
+    def example_record(self, columns=FEATURE_COLS) -> dict:
+        """
+        One raw-unit record that passes filter_outliers: outlier columns sit in
+        the middle of their fitted bounds, every other feature transforms to 1.0.
+        Used to warm up a freshly loaded model (inference.warmup).
+        """
+        record = {}
+        for col in columns:
+            lower, upper = self.outlier_bounds.get(col, (0.0, 2.0))
+            value = (max(lower, 0.0) + upper) / 2   # transformed units
+            if col in LOG_TRANSFORM_COLS:
+                value = np.expm1(value)
+            elif col in SQRT_TRANSFORM_COLS:
+                value = value ** 2
+            record[col] = float(value * SCALING_FACTORS.get(col, 1.0))
+        return record
+
+    # ----------------------------
+    # serialization
+    # ----------------------------
+    def to_dict(self) -> dict:
+        return {
+            "global_medians": self.global_medians,
+            "group_medians": [
+                {"group": list(key), "medians": medians}
+                for key, medians in self.group_medians.items()
+            ],
+            "outlier_bounds": {c: list(b) for c, b in self.outlier_bounds.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Preprocessor":
+        pre = cls()
+        pre.global_medians = dict(d.get("global_medians", {}))
+        pre.group_medians = {
+            tuple(float(k) for k in g["group"]): dict(g["medians"])
+            for g in d.get("group_medians", [])
+        }
+        pre.outlier_bounds = {c: tuple(b) for c, b in d.get("outlier_bounds", {}).items()}
+        return pre
+
+    def stats_to_dict(self) -> dict:
+        return {
+            "n_rows": self.stats["n_rows"],
+            "global": {c: v.to_list() for c, v in self.stats["global"].items()},
+            "groups": [
+                {"group": list(key), "counts": {c: v.to_list() for c, v in cols.items()}}
+                for key, cols in self.stats["groups"].items()
+            ],
+            "outliers": {c: v.to_list() for c, v in self.stats["outliers"].items()},
+        }
+
+    @staticmethod
+    def stats_from_dict(d: dict) -> dict:
+        return {
+            "n_rows": d["n_rows"],
+            "global": {c: ValueCounts.from_list(v) for c, v in d["global"].items()},
+            "groups": {
+                tuple(float(k) for k in g["group"]):
+                    {c: ValueCounts.from_list(v) for c, v in g["counts"].items()}
+                for g in d["groups"]
+            },
+            "outliers": {c: ValueCounts.from_list(v) for c, v in d["outliers"].items()},
+        }
+
+    def save(self, model_dir: str) -> str:
+        """Write preprocessor.json (and preprocessor_stats.json when there are stats)."""
+        path = os.path.join(model_dir, PREPROCESSOR_FILENAME)
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        if self.stats is not None:
+            with open(os.path.join(model_dir, STATS_FILENAME), "w") as f:
+                json.dump(self.stats_to_dict(), f)
+        return path
+
+    @classmethod
+    def load(cls, model_dir: str, with_stats: bool = False) -> "Preprocessor":
+        """
+        Load preprocessor.json; with_stats also loads preprocessor_stats.json
+        if it exists (needed for partial_fit, not for serving).
+        """
+        with open(os.path.join(model_dir, PREPROCESSOR_FILENAME), "r") as f:
+            pre = cls.from_dict(json.load(f))
+        stats_path = os.path.join(model_dir, STATS_FILENAME)
+        if with_stats and os.path.exists(stats_path):
+            with open(stats_path, "r") as f:
+                pre.stats = cls.stats_from_dict(json.load(f))
+        return pre
+
+
+def _scale(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    for col, factor in SCALING_FACTORS.items():
+        if col in df.columns:
+            # coerce to numeric just in case someone passed strings
+            df[col] = pd.to_numeric(df[col], errors="coerce") / factor
+    for col in IMPUTE_COLS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df
+
+
+def _log_sqrt(df: pd.DataFrame) -> None:
+    for col in LOG_TRANSFORM_COLS:
+        if col in df.columns:
+            df[col] = np.log1p(pd.to_numeric(df[col], errors="coerce").clip(lower=0))
+    for col in SQRT_TRANSFORM_COLS:
+        if col in df.columns:
+            df[col] = np.sqrt(pd.to_numeric(df[col], errors="coerce").clip(lower=0))
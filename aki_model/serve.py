@@ -0,0 +1,207 @@
+# serve.py
+"""
+Local SageMaker-compatible inference server (no AWS needed).
+
+Implements the hosting contract on top of inference.py:
+  GET  /ping                  -> 200 once the models are loaded
+  POST /invocations           -> input_fn -> predict_fn -> output_fn
+                                 (Content-Type / Accept as on an endpoint)
+  GET  /execution-parameters  -> batch transform settings
+
+The parent process loads every model once (model_fn, which also runs the
+warmup requests), binds the port and then pre-forks --workers processes, which
+start warm, share the loaded models copy-on-write and accept connections from
+the same listening socket. Each worker serves HTTP/1.1
+with keep-alive (one thread per open connection) and scores with a
+single-threaded booster, so workers x threads never oversubscribes the CPUs.
+The parent restarts workers that die and stops them all on SIGINT / SIGTERM.
+
+With --asyncio each worker runs the asyncio front end instead (see
+async_server.py): connections are coroutines, predict_fn runs on a small thread
+pool and excess load is shed with 429 / 503.
+
+    python serve.py --model-dir model --workers 4 --port 8080
+    python serve.py --model-dir model --workers 4 --asyncio --max-in-flight 32
+    python loadtest.py --url http://127.0.0.1:8080 --concurrency 16
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import inference
+
+DEFAULT_CONTENT_TYPE = "application/json"
+
+
+class InvocationHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive
+    disable_nagle_algorithm = True  # headers and body are separate writes
+    model = None                    # set by run_worker
+    workers = 1
+
+    def do_GET(self):
+        if self.path == "/ping":
+            self._reply(200 if self.model is not None else 503, b"", "text/plain")
+        elif self.path == "/execution-parameters":
+            body = ('{"MaxConcurrentTransforms": %d, "BatchStrategy": "MULTI_RECORD", '
+                    '"MaxPayloadInMB": 6}' % self.workers)
+            self._reply(200, body.encode("utf-8"), "application/json")
+        else:
+            self._reply(404, b"Not found", "text/plain")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path != "/invocations":
+            self._reply(404, b"Not found", "text/plain")
+            return
+        content_type = (self.headers.get("Content-Type") or DEFAULT_CONTENT_TYPE).split(";")[0].strip()
+        accept = (self.headers.get("Accept") or "").split(",")[0].split(";")[0].strip()
+        if accept in ("", "*/*"):
+            accept = DEFAULT_CONTENT_TYPE
+        try:
+            data = inference.input_fn(body, content_type)
+            result = inference.output_fn(inference.predict_fn(data, self.model), accept)
+        except ValueError as e:
+            self._reply(400, str(e).encode("utf-8"), "text/plain")
+            return
+        except Exception as e:
+            inference.logger.exception("Invocation failed")
+            self._reply(500, str(e).encode("utf-8"), "text/plain")
+            return
+        if isinstance(result, str):
+            result = result.encode("utf-8")
+        self._reply(200, result, accept)
+
+    def _reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_worker(listener, model, workers, async_options=None):
+    """Serve on the inherited listening socket until SIGTERM."""
+    inference.after_fork()
+    for booster in model.models.values():
+        inference.get_booster(booster).set_param({"nthread": 1})
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # the parent handles Ctrl-C
+    if async_options is not None:
+        run_async_worker(listener, model, workers, async_options)
+        return
+
+    handler = type("Handler", (InvocationHandler,), {"model": model, "workers": workers})
+    server = ThreadingHTTPServer(listener.getsockname()[:2], handler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = listener
+    server.daemon_threads = True
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    server.serve_forever()
+    inference.stop_worker()
+
+
+def run_async_worker(listener, model, workers, async_options):
+    import async_server
+
+    async def main():
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        await async_server.serve_socket(listener, model, stop, workers=workers, **async_options)
+
+    asyncio.run(main())
+    inference.stop_worker()
+
+
+def serve(model_dir, host="127.0.0.1", port=8080, workers=None, backlog=1024, async_options=None):
+    """
+    Pre-fork `workers` processes serving model_dir; async_options (a dict of
+    AsyncInferenceServer settings) selects the asyncio front end.
+    """
+    workers = workers or os.cpu_count() or 1
+    model = inference.model_fn(model_dir)
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+
+    children = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(listener, model, workers, async_options)
+            finally:
+                os._exit(0)
+        children[pid] = time.time()
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    inference.logger.info("Serving %s on http://%s:%d with %d workers", model_dir, host, port, workers)
+    print(f"Serving on http://{host}:{port} ({workers} workers)", flush=True)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.pop(pid, None)
+        if not stopping:
+            inference.logger.warning("Worker %d exited (status %d); restarting", pid, status)
+            spawn()
+    listener.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", default=os.environ.get("SM_MODEL_DIR", "model"),
+                        help="Directory holding the model artifacts (default: model)")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Bind address (0.0.0.0 inside a container)")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("SAGEMAKER_BIND_TO_PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SAGEMAKER_MODEL_SERVER_WORKERS", "0")),
+                        help="Pre-forked worker processes (default: one per CPU)")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="Serve with the asyncio front end (async_server.py)")
+    parser.add_argument("--executor-threads", type=int, default=2,
+                        help="--asyncio: invocation (input_fn / predict_fn / output_fn) threads per worker")
+    parser.add_argument("--max-in-flight", type=int, default=64,
+                        help="--asyncio: admitted invocations per worker before 503")
+    parser.add_argument("--max-pipeline", type=int, default=8,
+                        help="--asyncio: outstanding requests per connection before 429")
+    parser.add_argument("--max-queue-wait-ms", type=float, default=1000.0,
+                        help="--asyncio: drop (503) invocations that waited longer for a thread")
+    parser.add_argument("--idle-timeout", type=float, default=75.0,
+                        help="--asyncio: close idle or stalled connections after this many seconds")
+    args = parser.parse_args()
+    async_options = {
+        "executor_threads": args.executor_threads,
+        "max_in_flight": args.max_in_flight,
+        "max_pipeline": args.max_pipeline,
+        "max_queue_wait_ms": args.max_queue_wait_ms,
+        "idle_timeout": args.idle_timeout,
+    } if args.asyncio else None
+    serve(args.model_dir, args.host, args.port, args.workers or None, async_options=async_options)
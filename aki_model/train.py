@@ -1,131 +1,287 @@
 # train.py
+import argparse
+import hashlib
+import io
+import json
 import os
+import shutil
+import time
 import pandas as pd
 import numpy as np
 import joblib
 import warnings
 
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, roc_auc_score, classification_report
+from sklearn.metrics import accuracy_score, roc_auc_score, classification_report, log_loss
+import xgboost as xgb
 from xgboost import XGBClassifier
 
+import feature_store
+import hparam_search
+from decision_threshold import THRESHOLD_FILENAME
+from drift_monitor import DriftReference, served_matrix
+from feature_store import TARGETS, data_fingerprint
+from preprocessing import FEATURE_COLS, RAW_INPUT_COLS, Preprocessor
+
 warnings.filterwarnings("ignore")
 np.random.seed(42)
 
+DEFAULT_PARAMS = {
+    "random_state": 42,
+    "learning_rate": 0.2,
+    "max_depth": 3,
+    "n_estimators": 200,
+    "colsample_bytree": 0.7,
+    "subsample": 0.7,
+    "min_child_weight": 1,
+    "gamma": 0.0
+}
 
-def scale_and_transform(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    1) Divide certain lab features by scaling factors
-    2) Impute missing values (group‐median by Gender, Hypertension, Outcome of AKI),
-       done per‐column so that the length never changes
-    3) Apply log1p or sqrt transforms to specified columns
-    """
-    df = df.copy()
-
-    # 1a) scaling factors
-    scaling_factors = {
-        "Procalcitonin": 1000.0,
-        "White Blood Cell Count": 10.0,
-        "Creatinine": 88.4,
-        "Urea": 2.14,
-        "Bilirubin": 17.1,
-        "Albumin": 10.0
-    }
-    for col, factor in scaling_factors.items():
-        if col in df.columns:
-            df[col] = df[col] / factor
+# Every saved model appends an entry here: its version (sha256 of model.ubj,
+# the same id inference.py reports), its parent, and which bytes of the
+# training CSV it has seen, so --incremental knows which rows are new.
+LINEAGE_FILENAME = "lineage.json"
+DEFAULT_TARGET = "aki"
+BASE_MODEL_FILENAMES = ("model.ubj", "model.json", "model.xgb", "model.joblib")
 
-    # 1b) per‐column median‐impute
-    desired_impute_cols = ["Respiratory Rate", "Albumin", "Bilirubin", "Procalcitonin", "HCO3"]
-    impute_cols = [c for c in desired_impute_cols if c in df.columns]
 
-    # grouping keys exist?
-    if "Outcome of acute kidney injury" in df.columns:
-        group_cols = ["Gender", "Hypertension", "Outcome of acute kidney injury"]
-    else:
-        group_cols = ["Gender", "Hypertension"]
+def _as_bool(value):
+    # SageMaker passes hyperparameters as strings ("--search True")
+    return str(value).lower() in ("1", "true", "yes", "y")
+
 
-    # Only attempt per‐column transform if group keys exist
-    if impute_cols and all(g in df.columns for g in group_cols):
-        for col in impute_cols:
-            medians = df.groupby(group_cols)[col].transform("median")
-            df[col]  = df[col].fillna(medians)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    # SageMaker training container will put our “training” data in:
+    parser.add_argument("--input-path", default="/opt/ml/input/data/training/data_clean_name.csv",
+                        help="data_clean_name.csv or a feature store directory (feature_store.py)")
+    parser.add_argument("--target", choices=sorted(TARGETS), default=None,
+                        help=f"Label to train on (default: {DEFAULT_TARGET}; with --incremental, "
+                             "the base model's target, which it must match)")
+    parser.add_argument("--model-dir", default=os.environ.get("SM_MODEL_DIR", "/opt/ml/model"))
+    parser.add_argument("--extra-targets", default="",
+                        help="Comma-separated labels also trained (full training only), each into "
+                             "<model-dir>/<target>/, where inference.py serves it as that target")
+    parser.add_argument("--output-data-dir",
+                        default=os.environ.get("SM_OUTPUT_DATA_DIR", "/opt/ml/output/data"),
+                        help="Where the search leaderboard (search_results.json) is written")
+    parser.add_argument("--search", type=_as_bool, nargs="?", const=True, default=False,
+                        help="Cross-validate hparam_search.PARAM_GRID and train with the best candidate")
+    parser.add_argument("--cache-dir", default=os.environ.get("SEARCH_CACHE_DIR", "/opt/ml/checkpoints/search_cache"),
+                        help="On-disk fold-result cache (the checkpoint dir survives spot restarts)")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Search worker processes (default: one per CPU)")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--early-stopping-rounds", type=int, default=hparam_search.EARLY_STOPPING_ROUNDS)
+    parser.add_argument("--incremental", type=_as_bool, nargs="?", const=True, default=False,
+                        help="Continue boosting the model in --base-model-dir on rows appended "
+                             "to --input-path since it was trained (or on --new-data)")
+    parser.add_argument("--base-model-dir", default=None,
+                        help="Model to continue from in --incremental mode (default: --model-dir)")
+    parser.add_argument("--new-data", default=None,
+                        help="CSV holding only the new rows (instead of detecting appended rows)")
+    parser.add_argument("--incremental-rounds", type=int, default=20,
+                        help="Boosting rounds added per incremental update")
+    # unknown SageMaker hyperparameters are ignored
+    args, _ = parser.parse_known_args(argv)
+    return args
 
-    # 1c) log1p and sqrt transforms
-    log_transform_cols  = ["Procalcitonin", "Creatinine", "Urea", "Lactate", "HCO3", "Mean Arterial Pressure"]
-    sqrt_transform_cols = ["White Blood Cell Count", "APACHEII", "SOFA"]
 
-    for col in log_transform_cols:
-        if col in df.columns:
-            df[col] = np.log1p(df[col].clip(lower=0))
+def search_params(X_train, y_train, args):
+    """Run the cross-validated grid search; return XGBClassifier params for the winner."""
+    summaries = hparam_search.search(
+        X_train.to_numpy(), y_train.to_numpy(), n_folds=args.folds,
+        processes=args.processes, cache_dir=args.cache_dir,
+        early_stopping_rounds=args.early_stopping_rounds,
+    )
+    best = summaries[0]
+    print(f"[train.py] Best CV AUC {best['mean_auc']:.4f} ± {best['std_auc']:.4f} "
+          f"with {best['params']}, n_estimators={best['n_estimators']}")
+    os.makedirs(args.output_data_dir, exist_ok=True)
+    results_path = os.path.join(args.output_data_dir, "search_results.json")
+    with open(results_path, "w") as f:
+        json.dump(summaries, f, indent=2)
+    print(f"[train.py] Search results saved to: {results_path}")
+    # the final model is trained the way the candidates were scored
+    return {"random_state": 42, "tree_method": "hist", **best["params"],
+            "n_estimators": best["n_estimators"]}
 
-    for col in sqrt_transform_cols:
-        if col in df.columns:
-            df[col] = np.sqrt(df[col].clip(lower=0))
 
-    return df
+# ----------------------------
+# Lineage
+# ----------------------------
+def read_lineage(model_dir) -> list:
+    path = os.path.join(model_dir, LINEAGE_FILENAME)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
 
 
-def remove_outliers(df: pd.DataFrame) -> pd.DataFrame:
+def appended_rows(path, seen: dict) -> pd.DataFrame:
+    """Rows added to the CSV after the `seen` fingerprint; fails if that prefix changed."""
+    if data_fingerprint(path, seen["bytes"])["sha256"] != seen["sha256"]:
+        raise SystemExit(f"[train.py] {path} no longer starts with the {seen['bytes']} bytes the "
+                         "base model was trained on; run a full training instead")
+    with open(path, "rb") as f:
+        data = f.read()
+    header = data[:data.find(b"\n") + 1]
+    end = data.rfind(b"\n") + 1
+    return feature_store.validate(pd.read_csv(io.BytesIO(header + data[seen["bytes"]:end])))
+
+
+def save_artifacts(model_dir, booster, preprocessor, entry, history, model=None,
+                   drift_reference=None) -> str:
     """
-    Remove extreme outliers in a small set of columns:
-    - Mechanical Ventilation
-    - Procalcitonin
-    - Creatinine
-    - Bilirubin
-    - White Blood Cell Count
-    We use 2.5 * IQR as the cutoff.
+    Write model.joblib (`model`, or a classifier wrapping booster), model.ubj,
+    the preprocessor, drift_reference.json (if given) and lineage.json
+    (history + entry); returns the new model version.
     """
-    df_clean = df.copy()
-    cols = [
-        "Mechanical Ventilation",
-        "Procalcitonin",
-        "Creatinine",
-        "Bilirubin",
-        "White Blood Cell Count"
-    ]
-    for col in cols:
-        if col not in df_clean.columns:
+    os.makedirs(model_dir, exist_ok=True)
+    booster_path = os.path.join(model_dir, "model.ubj")
+    booster.save_model(booster_path)
+    if model is None:
+        model = XGBClassifier()
+        model.load_model(booster_path)
+    joblib.dump(model, os.path.join(model_dir, "model.joblib"))
+    preprocessor.save(model_dir)
+    if drift_reference is not None:
+        drift_reference.save(model_dir)
+    with open(booster_path, "rb") as f:
+        version = hashlib.sha256(f.read()).hexdigest()[:16]
+    entry = {"version": version, **entry}
+    with open(os.path.join(model_dir, LINEAGE_FILENAME), "w") as f:
+        json.dump(history + [entry], f, indent=2)
+    print(f"[train.py] Saved model {version} to: {model_dir}")
+    return version
+
+
+# ----------------------------
+# Incremental update
+# ----------------------------
+def load_base_booster(model_dir):
+    for name in BASE_MODEL_FILENAMES:
+        path = os.path.join(model_dir, name)
+        if not os.path.exists(path):
             continue
-        q1 = df_clean[col].quantile(0.25)
-        q3 = df_clean[col].quantile(0.75)
-        iqr = q3 - q1
-        lower = q1 - 2.5 * iqr
-        upper = q3 + 2.5 * iqr
-        df_clean = df_clean[(df_clean[col] >= lower) & (df_clean[col] <= upper)]
-    return df_clean
+        if name.endswith(".joblib"):
+            return joblib.load(path).get_booster()
+        booster = xgb.Booster()
+        booster.load_model(path)
+        return booster
+    raise SystemExit(f"[train.py] No model file in {model_dir}")
 
 
-def main():
-    # SageMaker training container will put our “training” data in:
-    input_path = "/opt/ml/input/data/training/data_clean_name.csv"
-    print(f"[train.py] Loading raw CSV from: {input_path}")
-    df = pd.read_csv(input_path)
+def train_incremental(args):
+    """
+    Warm-start update: refresh the preprocessing statistics with the new rows
+    only, then add --incremental-rounds trees fitted on them to the base model.
+    """
+    started = time.perf_counter()
+    base_dir = args.base_model_dir or args.model_dir
+    history = read_lineage(base_dir)
+    parent = history[-1] if history else {}
+    parent_target = parent.get("target")
+    if args.target is None:
+        args.target = parent_target or DEFAULT_TARGET
+    elif parent_target is not None and args.target != parent_target:
+        raise SystemExit(f"[train.py] {base_dir} was trained on --target {parent_target}; "
+                         f"cannot update it with --target {args.target}")
+    if args.new_data:
+        new_df = feature_store.read_csv(args.new_data)
+        seen = parent.get("data")
+    elif os.path.isdir(args.input_path):
+        raise SystemExit("[train.py] Detecting appended rows needs the CSV as --input-path "
+                         "(or pass --new-data)")
+    elif parent.get("data"):
+        new_df = appended_rows(args.input_path, parent["data"])
+        seen = data_fingerprint(args.input_path)
+    else:
+        raise SystemExit(f"[train.py] No {LINEAGE_FILENAME} in {base_dir}; pass --new-data "
+                         "or run a full training first")
+    print(f"[train.py] Incremental update of {base_dir} with {len(new_df)} new rows")
+    if new_df.empty:
+        print("[train.py] Nothing to do")
+        return
+
+    preprocessor = Preprocessor.load(base_dir, with_stats=True)
+    if preprocessor.stats is not None:
+        preprocessor.partial_fit(new_df)
+    else:
+        print("[train.py] No preprocessor_stats.json in the base model; preprocessing left unchanged")
+    served = served_matrix(preprocessor, new_df)
+    df = preprocessor.filter_outliers(preprocessor.transform(new_df))
+    X = df[FEATURE_COLS]
+    y = df[TARGETS[args.target]]
+    try:
+        drift_reference = DriftReference.load(base_dir).add(served)
+    except FileNotFoundError:
+        drift_reference = None
+        print("[train.py] No drift_reference.json in the base model; not writing one")
+
+    booster = load_base_booster(base_dir)
+    params = parent.get("params", DEFAULT_PARAMS)
+    train_params = {
+        "objective": "binary:logistic",
+        "seed": params.get("random_state", 42),
+        **{k: v for k, v in params.items() if k not in ("random_state", "n_estimators")},
+    }
+    dtrain = xgb.DMatrix(X, label=y)
+    before = booster.predict(dtrain)
+    booster = xgb.train(train_params, dtrain, num_boost_round=args.incremental_rounds, xgb_model=booster)
+    after = booster.predict(dtrain)
+    if y.nunique() == 2:
+        # the rows the new trees were fitted on, so this is a training loss, not a held-out one
+        print(f"[train.py] Training log loss on the new rows: "
+              f"{log_loss(y, before):.4f} -> {log_loss(y, after):.4f}")
+
+    entry = {
+        "parent": parent.get("version"),
+        "mode": "incremental",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "target": args.target,
+        "data": seen,
+        "rows_added": len(new_df),
+        "rows_used": len(df),
+        "rounds_added": args.incremental_rounds,
+        "num_trees": booster.num_boosted_rounds(),
+        "params": params,
+    }
+    save_artifacts(args.model_dir, booster, preprocessor, entry, history, drift_reference=drift_reference)
+    threshold_path = os.path.join(base_dir, THRESHOLD_FILENAME)
+    if os.path.exists(threshold_path) and os.path.abspath(base_dir) != os.path.abspath(args.model_dir):
+        shutil.copy(threshold_path, args.model_dir)
+    print(f"[train.py] Incremental update took {time.perf_counter() - started:.2f}s")
+
 
-    # 1) scale & transforms (scaling, impute, log/sqrt)
-    df = scale_and_transform(df)
+# ----------------------------
+# Full training
+# ----------------------------
+def main(args):
+    if args.incremental:
+        return train_incremental(args)
+    args.target = args.target or DEFAULT_TARGET
+    input_path = args.input_path
+    target_col = TARGETS[args.target]
+    print(f"[train.py] Loading training data from: {input_path}")
+    store = feature_store.open_store(input_path)
+    df = store.frame(RAW_INPUT_COLS + [target_col])
+    rows_read = len(df)
 
-    # 2) remove outliers
-    df = remove_outliers(df)
+    # 1) fit preprocessing statistics, then scale / impute / log-sqrt
+    preprocessor = Preprocessor().fit(df)
+    # the served inputs are compared against these rows (drift_monitor.py): every
+    # row, not imputed, as predict_fn sees them
+    drift_reference = DriftReference.fit(served_matrix(preprocessor, df))
+    df = preprocessor.transform(df)
+
+    # 2) remove outliers (fitted bounds)
+    df = preprocessor.filter_outliers(df)
 
     # 3) pick out feature matrix X and target y
-    feature_cols = [
-        "HCO3",
-        "Creatinine",
-        "Procalcitonin",
-        "Mean Arterial Pressure",
-        "Bilirubin",
-        "pH",
-        "Albumin",
-        "Urea",
-        "White Blood Cell Count",
-        "SOFA",
-        "APACHEII",
-        "Glasgow"
-    ]
-    available_features = [c for c in feature_cols if c in df.columns]
+    available_features = [c for c in FEATURE_COLS if c in df.columns]
     X = df[available_features].copy()
-    y = df["Outcome of acute kidney injury"].copy()
+    y = df[target_col].copy()
 
     print(f"[train.py] After transforms → X shape: {X.shape}, y shape: {y.shape}")
 
@@ -134,17 +290,8 @@ def main():
         X, y, test_size=0.20, random_state=42, stratify=y
     )
 
-    # 5) define and fit XGBClassifier
-    params = {
-        "random_state": 42,
-        "learning_rate": 0.2,
-        "max_depth": 3,
-        "n_estimators": 200,
-        "colsample_bytree": 0.7,
-        "subsample": 0.7,
-        "min_child_weight": 1,
-        "gamma": 0.0
-    }
+    # 5) define and fit XGBClassifier (searched on the training split only)
+    params = search_params(X_train, y_train, args) if args.search else DEFAULT_PARAMS
     model = XGBClassifier(**params)
 
     print("[train.py] Fitting XGBClassifier on training data...")
@@ -159,13 +306,33 @@ def main():
     print("[train.py] Classification Report:")
     print(classification_report(y_test, y_pred))
 
-    # 7) save the trained model under /opt/ml/model for SageMaker
-    model_dir = os.environ.get("SM_MODEL_DIR", "/opt/ml/model")
-    os.makedirs(model_dir, exist_ok=True)
-    output_path = os.path.join(model_dir, "model.joblib")
-    joblib.dump(model, output_path)
-    print(f"[train.py] Model saved to: {output_path}")
+    # 7) save the trained model under /opt/ml/model for SageMaker: model.joblib,
+    #    the native model.ubj (inference.py loads it without unpickling the sklearn
+    #    wrapper), preprocessor.json (+ stats), drift_reference.json and a fresh lineage.json
+    entry = {
+        "parent": None,
+        "mode": "full",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "target": args.target,
+        "data": store.source,
+        "rows_added": rows_read,
+        "rows_used": len(X_train),
+        "num_trees": model.get_booster().num_boosted_rounds(),
+        "params": params,
+        "holdout": {"accuracy": acc, "roc_auc": roc_auc},
+    }
+    save_artifacts(args.model_dir, model.get_booster(), preprocessor, entry, [], model=model,
+                   drift_reference=drift_reference)
+
+    # 8) the extra targets, each a full training of its own into a sub-directory
+    #    (same data, so the same preprocessor.json as the root model)
+    for target in filter(None, (t.strip() for t in args.extra_targets.split(","))):
+        if target not in TARGETS or target == args.target:
+            raise SystemExit(f"[train.py] --extra-targets: {target!r} is not another target of {sorted(TARGETS)}")
+        print(f"[train.py] Training extra target {target}")
+        main(argparse.Namespace(**{**vars(args), "target": target, "extra_targets": "",
+                                   "model_dir": os.path.join(args.model_dir, target)}))
 
 
 if __name__ == "__main__":
-    main()
+    main(parse_args())
@@ -10,99 +10,37 @@ import shap
 from xgboost import XGBClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import (
-    accuracy_score, confusion_matrix, classification_report,
-    roc_curve, auc
+    accuracy_score, confusion_matrix, classification_report
 )
 
+from decision_threshold import roc_auc, save_threshold, threshold_curves, threshold_for_recall
+from drift_monitor import DriftReference, served_matrix
+from feature_store import TARGETS, open_store
+from hparam_search import out_of_fold_proba
+from preprocessing import FEATURE_COLS, RAW_INPUT_COLS, Preprocessor
+
 pd.set_option("display.max_columns", None)
 sns.set()  # just for nicer default styling
 
-def scale_and_transform(df: pd.DataFrame) -> pd.DataFrame:
-    # 1) scaling
-    scaling_factors = {
-        "Procalcitonin": 1000.0,
-        "White Blood Cell Count": 10.0,
-        "Creatinine": 88.4,
-        "Urea": 2.14,
-        "Bilirubin": 17.1,
-        "Albumin": 10.0
-    }
-    for col, f in scaling_factors.items():
-        if col in df.columns:
-            df[col] = df[col] / f
-
-    # 2) median-impute
-    impute_cols = ["Respiratory Rate", "Albumin", "Bilirubin", "Procalcitonin", "HCO3"]
-    df[impute_cols] = df.groupby(
-        ["Gender", "Hypertension", "Outcome of acute kidney injury"]
-    )[impute_cols].transform(lambda x: x.fillna(x.median()))
-
-    # 3) log1p & sqrt
-    log_cols  = ["Procalcitonin", "Creatinine", "Urea", "Lactate", "HCO3", "Mean Arterial Pressure"]
-    sqrt_cols = ["White Blood Cell Count", "APACHEII", "SOFA"]
-    for col in log_cols:
-        if col in df.columns:
-            df[col] = np.log1p(df[col].clip(lower=0))
-    for col in sqrt_cols:
-        if col in df.columns:
-            df[col] = np.sqrt(df[col].clip(lower=0))
-
-    return df
-
-def remove_outliers(df: pd.DataFrame) -> pd.DataFrame:
-    cols = ['Mechanical Ventilation', 'Procalcitonin', 'Creatinine',
-            'Bilirubin', 'White Blood Cell Count']
-    df_clean = df.copy()
-    for col in cols:
-        if col not in df_clean.columns:
-            continue
-        q1 = df_clean[col].quantile(0.25)
-        q3 = df_clean[col].quantile(0.75)
-        iqr = q3 - q1
-        lower = q1 - 2.5 * iqr
-        upper = q3 + 2.5 * iqr
-        df_clean = df_clean[(df_clean[col] >= lower) & (df_clean[col] <= upper)]
-    return df_clean
-
-def main(input_csv: str, output_dir: str):
-    # load
-    df = pd.read_csv(input_csv)
-
-    # preprocess
-    df = scale_and_transform(df)
-
-    # four manual slices & outlier removal
-    df1 = df.iloc[:98, :].copy()
-    df2 = df.iloc[99:210, :].copy()
-    df3 = df.iloc[211:411, :].copy()
-    df4 = df.iloc[412:531, :].copy()
-
-    df1 = remove_outliers(df1)
-    df2 = remove_outliers(df2)
-    df3 = remove_outliers(df3)
-    df4 = remove_outliers(df4)
-
-    df = pd.concat([df1, df2, df3, df4], ignore_index=True)
+def main(input_csv: str, output_dir: str, folds: int = 5, repeats: int = 3,
+         target_recall: float = 0.9, processes: int = None, target: str = "aki"):
+    # load (memory-mapped feature store, built from the CSV on first use)
+    target_col = TARGETS[target]
+    df = open_store(input_csv).frame(RAW_INPUT_COLS + [target_col])
+
+    # preprocess (same fitted pipeline as train.py / inference.py)
+    preprocessor = Preprocessor().fit(df)
+    served = served_matrix(preprocessor, df)   # the drift reference's rows, before imputation
+    df = preprocessor.filter_outliers(preprocessor.transform(df))
 
     # features & target
-    feature_cols = [
-        'HCO3','Creatinine','Procalcitonin','Mean Arterial Pressure',
-        'Bilirubin','pH','Albumin','Urea','White Blood Cell Count',
-        'SOFA','APACHEII','Glasgow'
-    ]
-    X = df[feature_cols].copy()
-    y = df['Outcome of acute kidney injury']
+    X = df[FEATURE_COLS].copy()
+    y = df[target_col]
 
     # categorical dtypes if any
     for c in X.select_dtypes(include=['object']).columns:
         X[c] = X[c].astype('category')
 
-    # train/test split
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42, stratify=y
-    )
-
-    # train
     param_grid = {
         'colsample_bytree': 0.7,
         'gamma': 0,
@@ -112,13 +50,34 @@ def main(input_csv: str, output_dir: str):
         'n_estimators': 200,
         'subsample': 0.7
     }
+
+    # repeated stratified k-fold: out-of-fold probabilities for every row, per repeat
+    oof = out_of_fold_proba(X, y, {**param_grid, 'random_state': 42},
+                            n_splits=folds, n_repeats=repeats, processes=processes)
+    repeat_aucs = [roc_auc(threshold_curves(y, scores)) for scores in oof]
+    print(f"{repeats}x{folds}-fold CV ROC AUC: {np.mean(repeat_aucs):.4f} ± {np.std(repeat_aucs):.4f}")
+
+    # curves and threshold over all repeats' scores at once
+    y_stacked = np.tile(y.to_numpy(), repeats)
+    curves = threshold_curves(y_stacked, oof)
+    chosen = threshold_for_recall(curves, target_recall)
+    chosen.update(oof_roc_auc=roc_auc(curves), folds=folds, repeats=repeats)
+    thresh = chosen['threshold']
+    print(f"Threshold for recall >= {target_recall}: {thresh:.4f} "
+          f"(CV recall {chosen['recall']:.3f}, precision {chosen['precision']:.3f})")
+
+    # train/test split
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=42, stratify=y
+    )
+
+    # train
     model = XGBClassifier(enable_categorical=True, random_state=42)
     model.set_params(**param_grid)
     model.fit(X_train, y_train)
 
-    # predict with threshold
+    # predict with the cross-validated threshold
     y_scores = model.predict_proba(X_test)[:, 1]
-    thresh = 0.33
     y_pred = (y_scores >= thresh).astype(int)
 
     # metrics
@@ -135,13 +94,12 @@ def main(input_csv: str, output_dir: str):
     plt.ylabel("True Label")
     plt.show()
 
-    # ROC curve
-    fpr, tpr, _ = roc_curve(y_test, y_scores)
-    roc_auc = auc(fpr, tpr)
+    # ROC curve (out-of-fold, all repeats)
     plt.figure(figsize=(6,5))
-    plt.plot(fpr, tpr, lw=2, label=f'ROC curve (area = {roc_auc:.2f})')
+    plt.plot(np.r_[0, curves['fpr']], np.r_[0, curves['recall']], lw=2,
+             label=f"ROC curve (area = {chosen['oof_roc_auc']:.2f})")
     plt.plot([0,1], [0,1], linestyle='--', color='grey')
-    plt.title("Receiver Operating Characteristic (ROC) Curve")
+    plt.title("Out-of-Fold Receiver Operating Characteristic (ROC) Curve")
     plt.xlabel('False Positive Rate')
     plt.ylabel('True Positive Rate')
     plt.legend(loc="lower right")
@@ -157,12 +115,28 @@ def main(input_csv: str, output_dir: str):
     model_path = os.path.join(output_dir, "model.xgb")
     model.get_booster().save_model(model_path)
     print(f"Saved XGBoost model to {model_path}")
+    preprocessor.save(output_dir)
+    print(f"Saved preprocessor to {output_dir}")
+    drift_path = DriftReference.fit(served).save(output_dir)
+    print(f"Saved drift reference to {drift_path}")
+    threshold_path = save_threshold(output_dir, chosen)
+    print(f"Saved decision threshold to {threshold_path}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--input-csv",  default="data_clean_name.csv",
-                        help="Path to data_clean_name.csv")
+                        help="Path to data_clean_name.csv (or its feature store directory)")
+    parser.add_argument("--target", choices=sorted(TARGETS), default="aki",
+                        help="Label to train on")
     parser.add_argument("--output-dir", default="model_artifact",
                         help="Directory to save the trained model")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Repeats of the stratified k-fold evaluation")
+    parser.add_argument("--target-recall", type=float, default=0.9,
+                        help="Recall the saved decision threshold must reach (out-of-fold)")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Parallel fold workers (default: one per CPU)")
     args = parser.parse_args()
-    main(args.input_csv, args.output_dir)
+    main(args.input_csv, args.output_dir, args.folds, args.repeats,
+         args.target_recall, args.processes, args.target)
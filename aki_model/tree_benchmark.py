@@ -0,0 +1,151 @@
+# tree_benchmark.py
+"""
+Parity check and latency comparison: compiled_trees.py vs the XGBoost runtime.
+
+For every model directory, the served artifact is compiled and checked against
+XGBClassifier.predict_proba on synthetic patients (benchmark.py), including
+rows with extra missing values and rows sitting exactly on split thresholds.
+The script exits 1 if any probability differs by more than --tolerance or any
+class (at the model's decision threshold) flips.
+
+Then both are timed per batch size (p50 of repeated calls on the transformed
+matrix, i.e. the predict stage only) and the largest batch where the compiled
+evaluator still wins is reported -- a starting point for COMPILED_TREES_MAX_ROWS:
+
+    python tree_benchmark.py --model-dir model_artifact ../dialysis_model/model_artifact
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import xgboost as xgb
+
+import inference as inf
+from benchmark import summarize, synthetic_patients, time_calls
+from compiled_trees import compile_model
+from decision_threshold import load_threshold
+from preprocessing import FEATURE_COLS, Preprocessor
+
+DEFAULT_BATCH_SIZES = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+def load_classifier(model_dir):
+    """The served model as an XGBClassifier (so predict_proba is the reference)."""
+    path = inf.find_model_file(model_dir)
+    if path.endswith(".joblib"):
+        import joblib
+        return joblib.load(path)
+    model = xgb.XGBClassifier()
+    model.load_model(path)
+    return model
+
+
+def reference_parity_rows(model_dir, n_rows, reference_csv, seed=42) -> np.ndarray:
+    """Transformed synthetic patients, plus copies with extra NaNs and split-threshold values."""
+    try:
+        pre = Preprocessor.load(model_dir)
+    except FileNotFoundError:
+        pre = Preprocessor()
+    raw = synthetic_patients(n_rows, reference_csv, columns=FEATURE_COLS, seed=seed)
+    X = pre.transform_matrix(raw.to_numpy(dtype=np.float64)).astype(np.float32)
+    rng = np.random.default_rng(seed)
+    sparse = np.where(rng.random(X.shape) < 0.3, np.nan, X)
+    on_split = X.copy()
+    compiled = compile_model(load_classifier(model_dir))
+    slots = rng.integers(0, compiled.feature.size, size=len(X)) if compiled.feature.size else []
+    for row, slot in enumerate(slots):
+        threshold = compiled.threshold.ravel()[slot]
+        if np.isfinite(threshold):
+            on_split[row, compiled.feature.ravel()[slot]] = threshold
+    return np.vstack([X, sparse, on_split]).astype(np.float32)
+
+
+def check_reference_parity(model_dir, n_rows, reference_csv, tolerance) -> dict:
+    """
+    Compiled vs XGBClassifier.predict_proba on reference_parity_rows, with class
+    flips at the model's threshold (compiled_trees.check_parity, run by
+    model_fn, uses threshold-derived rows and no data instead).
+    """
+    model = load_classifier(model_dir)
+    compiled = compile_model(model)
+    X = reference_parity_rows(model_dir, n_rows, reference_csv)
+    expected = model.predict_proba(X)[:, 1]
+    got = compiled.predict_proba(X)
+    threshold = load_threshold(model_dir)
+    if threshold is None:
+        flips = int(np.sum((expected > 0.5) != (got > 0.5)))
+    else:
+        flips = int(np.sum((expected >= threshold) != (got >= threshold)))
+    max_diff = float(np.max(np.abs(expected - got))) if len(X) else 0.0
+    return {
+        "rows": len(X),
+        "trees": compiled.n_trees,
+        "depth": compiled.depth,
+        "max_abs_diff": max_diff,
+        "class_flips": flips,
+        "ok": max_diff <= tolerance and flips == 0,
+    }
+
+
+def bench(model_dir, batch_sizes, reference_csv, min_seconds, max_iters) -> list:
+    booster = load_classifier(model_dir).get_booster()
+    compiled = compile_model(booster)
+    X = reference_parity_rows(model_dir, max(batch_sizes), reference_csv)[:max(batch_sizes)]
+    results = []
+    for n in batch_sizes:
+        Xn = np.ascontiguousarray(X[:n])
+        native = summarize(time_calls(lambda: booster.inplace_predict(Xn), min_seconds, max_iters), n)
+        fast = summarize(time_calls(lambda: compiled.predict_proba(Xn), min_seconds, max_iters), n)
+        results.append({
+            "batch_size": n,
+            "native": native,
+            "compiled": fast,
+            "speedup": native["p50_ms"] / fast["p50_ms"] if fast["p50_ms"] > 0 else float("inf"),
+        })
+        print(f"  batch={n:<6} native p50={native['p50_ms'] * 1000:8.1f}us  "
+              f"compiled p50={fast['p50_ms'] * 1000:8.1f}us  x{results[-1]['speedup']:.2f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", nargs="+", default=["model_artifact"],
+                        help="Model directories to compile and compare")
+    parser.add_argument("--reference-csv", default="data_clean_name.csv")
+    parser.add_argument("--parity-rows", type=int, default=10000,
+                        help="Synthetic patients per parity variant (plain / missing / on-split)")
+    parser.add_argument("--tolerance", type=float, default=1e-5,
+                        help="Largest allowed probability difference")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=DEFAULT_BATCH_SIZES)
+    parser.add_argument("--min-seconds", type=float, default=0.5)
+    parser.add_argument("--max-iters", type=int, default=2000)
+    parser.add_argument("--output", default=None, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "xgboost": xgb.__version__,
+        },
+        "models": {},
+    }
+    failed = False
+    for model_dir in args.model_dir:
+        parity = check_reference_parity(model_dir, args.parity_rows, args.reference_csv, args.tolerance)
+        print(f"{model_dir}: {parity['trees']} trees, depth {parity['depth']}; parity on "
+              f"{parity['rows']} rows: max |diff| {parity['max_abs_diff']:.2e}, "
+              f"{parity['class_flips']} class flips -> {'OK' if parity['ok'] else 'FAILED'}")
+        failed |= not parity["ok"]
+        results = bench(model_dir, args.batch_sizes, args.reference_csv, args.min_seconds, args.max_iters)
+        wins = [r["batch_size"] for r in results if r["speedup"] > 1.0]
+        print(f"  largest batch where compiled wins: {max(wins) if wins else 'none'}")
+        report["models"][model_dir] = {"parity": parity, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if failed else 0)